@@ -0,0 +1,39 @@
+"""Compare decoding Mongo documents into Transaction with dacite and with compile_decoder
+
+python -m benchmarks.bench_decoding [documents]
+"""
+
+import sys
+import time
+
+from dacite import from_dict
+
+from benchmarks.data import make_documents
+from ecobud.model.decoding import compile_decoder
+from ecobud.model.transactions import Transaction
+
+
+def timed(decode, documents):
+    start = time.perf_counter()
+    decoded = [decode(document) for document in documents]
+    return time.perf_counter() - start, decoded
+
+
+def main(count: int) -> None:
+    documents = make_documents("bench", count)
+    candidates = {
+        "dacite": lambda document: from_dict(Transaction, document),
+        "compiled": compile_decoder(Transaction),
+        "compiled strict": compile_decoder(Transaction, strict=True),
+    }
+
+    results = {name: timed(decode, documents) for name, decode in candidates.items()}
+    reference = results["dacite"][1]
+    baseline = results["dacite"][0]
+    for name, (seconds, decoded) in results.items():
+        assert decoded == reference, f"{name} decodes differently from dacite"
+        print(f"{name:16} {seconds:8.3f}s {count / seconds:12,.0f} docs/s {baseline / seconds:6.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
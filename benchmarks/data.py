@@ -0,0 +1,59 @@
+"""Synthetic Tink payloads and transaction documents shaped like production data"""
+
+import random
+from dataclasses import asdict
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+from ecobud.model.transactions import Transaction, schema_fields
+
+MERCHANTS = ["Tesco", "Sainsbury's", "TfL", "Amazon", "Pret", "Netflix", "Octopus Energy", "Landlord", "Boots"]
+START = date(2021, 1, 1)
+DAYS = 3 * 365
+
+
+def make_tink_payloads(count: int, seed: int = 0, accounts: int = 3) -> List[Dict[str, Any]]:
+    """Tink transactions, newest first like the pages of /data/v2/transactions"""
+    rng = random.Random(seed)
+    payloads = []
+    for index in range(count):
+        merchant = rng.choice(MERCHANTS)
+        scale = rng.choice([0, 1, 2, 2, 2])
+        payloads.append(
+            {
+                "id": f"{seed}-{index}",
+                "accountId": f"account{rng.randrange(accounts)}",
+                "amount": {
+                    "value": {"unscaledValue": str(-rng.randrange(1, 50000 * 10**scale // 100)), "scale": str(scale)},
+                    "currencyCode": "GBP",
+                },
+                "dates": {"booked": (START + timedelta(days=rng.randrange(DAYS))).isoformat()},
+                "descriptions": {
+                    "detailed": {"unstructured": f"CARD PAYMENT TO {merchant.upper()}"},
+                    "display": merchant,
+                    "original": f"{merchant.upper()} {rng.randrange(10000)}",
+                },
+                "status": "BOOKED" if rng.random() < 0.95 else "PENDING",
+            }
+        )
+    payloads.sort(key=lambda payload: payload["dates"]["booked"], reverse=True)
+    return payloads
+
+
+def make_documents(username: str, count: int, seed: int = 0, spreadShare: float = 0.2) -> List[Dict[str, Any]]:
+    """Stored transactions, a share of them spread over up to a year from their booking date"""
+    rng = random.Random(seed)
+    documents = []
+    for payload in make_tink_payloads(count, seed):
+        document = asdict(Transaction.from_tink(username, payload))
+        if rng.random() < spreadShare:
+            booked = date.fromisoformat(document["date"])
+            document["ecoData"] = {
+                "oneOff": False,
+                "startDate": booked.isoformat(),
+                "endDate": (booked + timedelta(days=rng.randrange(1, 365))).isoformat(),
+            }
+            document.update(schema_fields(document))
+        document["ignore"] = rng.random() < 0.02
+        documents.append(document)
+    return documents
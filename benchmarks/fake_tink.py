@@ -0,0 +1,194 @@
+"""Stand-in for the Tink API, serving synthetic users and transactions over real HTTP
+
+Run it standalone and point the server at it with TINK_BASE_URL:
+
+    python -m benchmarks.fake_tink [--port 8081] [--latency 0.05] [--error-rate 0.01] [--page-size 100]
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.data import make_tink_payloads
+
+
+class FakeTink:
+    """Serves the endpoints used by ecobud.connections.tink
+
+    Given payloads, every user sees those transactions, otherwise each user
+    gets transactionsPerUser of their own, generated from their external id.
+    Responses are delayed by an exponentially distributed latency of the given
+    mean, and a share errorRate of them fail with a 503 or a 500.
+    """
+
+    def __init__(
+        self,
+        payloads: Optional[List[Dict[str, Any]]] = None,
+        pageSize: int = 100,
+        transactionsPerUser: int = 1000,
+        latency: float = 0.0,
+        errorRate: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.payloads = payloads
+        self.pageSize = pageSize
+        self.transactionsPerUser = transactionsPerUser
+        self.latency = latency
+        self.errorRate = errorRate
+        self.users: Dict[str, str] = {}
+        self.usersLock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.user_payloads = lru_cache(maxsize=1024)(self._user_payloads)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeTink":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _user_payloads(self, externalUserId: str) -> List[Dict[str, Any]]:
+        return make_tink_payloads(self.transactionsPerUser, seed=zlib.crc32(externalUserId.encode("utf-8")))
+
+    def token(self, form: Dict[str, List[str]]) -> Tuple[int, Dict[str, Any]]:
+        code = form.get("code", [""])[0]
+        # User tokens carry the external user id they were granted to
+        accessToken = "user:" + code.removeprefix("code:") if code else "client"
+        return 200, {"access_token": accessToken, "token_type": "bearer", "expires_in": 3600}
+
+    def authorization_grant(self, form: Dict[str, List[str]]) -> Tuple[int, Dict[str, Any]]:
+        return 200, {"code": "code:" + form["external_user_id"][0]}
+
+    def create_user(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        externalUserId = body["external_user_id"]
+        with self.usersLock:
+            if externalUserId in self.users:
+                return 409, {"errorCode": "user_with_external_user_id_already_exists"}
+            self.users[externalUserId] = uuid.uuid4().hex
+        return 200, {"external_user_id": externalUserId, "user_id": self.users[externalUserId]}
+
+    def get_user(self, externalUserId: str) -> Tuple[int, Dict[str, Any]]:
+        with self.usersLock:
+            userId = self.users.setdefault(externalUserId, uuid.uuid4().hex)
+        return 200, {"id": userId, "externalUserId": externalUserId, "market": "GB"}
+
+    def delete_user(self, externalUserId: str) -> Tuple[int, Dict[str, Any]]:
+        with self.usersLock:
+            self.users.pop(externalUserId, None)
+        return 200, {}
+
+    def transactions_page(self, externalUserId: str, query: Dict[str, List[str]]) -> Tuple[int, Dict[str, Any]]:
+        payloads = self.payloads if self.payloads is not None else self.user_payloads(externalUserId)
+        accountIds = set(query.get("accountIdIn", []))
+        if accountIds:
+            payloads = [payload for payload in payloads if payload["accountId"] in accountIds]
+        start = int(query.get("pageToken", ["0"])[0])
+        end = start + self.pageSize
+        return 200, {
+            "transactions": payloads[start:end],
+            "nextPageToken": str(end) if end < len(payloads) else "",
+        }
+
+    def webhook_endpoint(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        return 200, {"id": uuid.uuid4().hex, "url": body.get("url"), "secret": uuid.uuid4().hex}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    body = json.loads(raw or "{}")
+                else:
+                    body = parse_qs(raw)
+                routes = {
+                    "/api/v1/oauth/token": lambda: fake.token(body),
+                    "/api/v1/oauth/authorization-grant": lambda: fake.authorization_grant(body),
+                    "/api/v1/oauth/authorization-grant/delegate": lambda: fake.authorization_grant(body),
+                    "/api/v1/user/create": lambda: fake.create_user(body),
+                    "/api/v1/user/delete": lambda: fake.delete_user(self.user()),
+                    "/events/v2/webhook-endpoints": lambda: fake.webhook_endpoint(body),
+                }
+                self.route(routes)
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                routes = {
+                    "/api/v1/user": lambda: fake.get_user(self.user()),
+                    "/data/v2/transactions": lambda: fake.transactions_page(self.user(), query),
+                }
+                self.route(routes)
+
+            def user(self):
+                return self.headers.get("Authorization", "").removeprefix("Bearer ").removeprefix("user:")
+
+            def route(self, routes):
+                if fake.latency:
+                    time.sleep(random.expovariate(1 / fake.latency))
+                path = urlparse(self.path).path
+                if path not in routes:
+                    self.reply(404, {"errorMessage": f"Unknown endpoint {path}"})
+                elif random.random() < fake.errorRate:
+                    self.reply(random.choice([500, 503]), {"errorMessage": "Injected failure"})
+                else:
+                    self.reply(*routes[path]())
+
+            def reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean response delay in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500 or 503")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--transactions", type=int, default=1000, help="transactions of every user")
+    args = parser.parse_args()
+
+    fake = FakeTink(
+        pageSize=args.page_size,
+        transactionsPerUser=args.transactions,
+        latency=args.latency,
+        errorRate=args.error_rate,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"Serving a fake Tink API on {fake.url}")
+    fake.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
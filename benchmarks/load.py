@@ -0,0 +1,139 @@
+"""Drive a running server with many logged in users at a target request rate
+
+    python -m benchmarks.load [--url http://localhost:8000] [--users 50] [--rate 100] [--duration 60]
+
+Point the server at the fake Tink (python -m benchmarks.fake_tink) with
+TINK_BASE_URL and run python -m ecobud.worker so that logged in users get
+transactions. Requests are sent on a fixed schedule whatever the response
+times, and latencies are counted from the time a request was due, so a
+server falling behind shows up in the percentiles instead of slowing the load.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import requests
+
+PERIOD = ("2022-01-01", "2022-12-31")
+
+# (name, path, weight)
+ENDPOINTS = [
+    ("transactions", "/transactions", 5),
+    ("analytics summary", "/analytics/{}/{}?summary=1".format(*PERIOD), 3),
+    ("analytics", "/analytics/{}/{}?engine=numpy".format(*PERIOD), 1),
+]
+
+local = threading.local()
+
+
+def session() -> requests.Session:
+    """Session of the current thread, keeping its connections alive"""
+    if not hasattr(local, "session"):
+        local.session = requests.Session()
+    return local.session
+
+
+def log_in(url: str, username: str, password: str = "load-test") -> Dict[str, str]:
+    """Cookies of a session logged in as the user, who is created first if needed"""
+    response = requests.post(
+        url + "/user", json={"username": username, "email": f"{username}@ecobud.test", "password": password}
+    )
+    if response.status_code not in (201, 409):
+        raise RuntimeError(f"Could not create {username}: {response.status_code} {response.text}")
+    response = requests.post(url + "/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    return response.cookies.get_dict()
+
+
+def call(url: str, cookies: Dict[str, str], due: float) -> Tuple[float, int]:
+    try:
+        status = session().get(url, cookies=cookies).status_code
+    except requests.RequestException:
+        status = 0
+    return time.perf_counter() - due, status
+
+
+def percentile(latencies: List[float], share: float) -> float:
+    return latencies[min(len(latencies) - 1, int(share * len(latencies)))]
+
+
+def report(results: Dict[str, List[Tuple[float, int]]], elapsed: float) -> Dict[str, Any]:
+    summary = {}
+    for name, calls in sorted(results.items()):
+        latencies = sorted(latency for latency, _ in calls)
+        summary[name] = {
+            "requests": len(calls),
+            "errors": sum(1 for _, status in calls if not 200 <= status < 300),
+            "throughput": len(calls) / elapsed,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+    print(f"{'endpoint':20} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, stats in summary.items():
+        print(
+            f"{name:20} {stats['requests']:9} {stats['errors']:7} {stats['throughput']:8.1f} "
+            f"{stats['p50'] * 1000:8.1f} {stats['p95'] * 1000:8.1f} {stats['p99'] * 1000:8.1f}"
+        )
+    return summary
+
+
+def run(
+    url: str,
+    users: int,
+    rate: float,
+    duration: float,
+    concurrency: int,
+    endpoints: List[Tuple[str, str, int]] = ENDPOINTS,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        cookies = list(executor.map(lambda index: log_in(url, f"load{index}"), range(users)))
+    print(f"Logged in {users} users")
+
+    rng = random.Random(seed)
+    names, paths, weights = zip(*endpoints)
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        for index in range(int(rate * duration)):
+            due = start + index / rate
+            time.sleep(max(0.0, due - time.perf_counter()))
+            endpoint = rng.choices(range(len(names)), weights)[0]
+            future = executor.submit(call, url + paths[endpoint], rng.choice(cookies), due)
+            futures.append((names[endpoint], future))
+        results = defaultdict(list)
+        for name, future in futures:
+            results[name].append(future.result())
+        elapsed = time.perf_counter() - start
+
+    results["all"] = [result for calls in list(results.values()) for result in calls]
+    return report(results, elapsed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=100, help="requests per second")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=200, help="requests in flight at most")
+    parser.add_argument("--output", type=Path, help="write the summary as JSON")
+    args = parser.parse_args()
+
+    summary = run(args.url.rstrip("/"), args.users, args.rate, args.duration, args.concurrency)
+    if args.output:
+        args.output.write_text(
+            json.dumps({"arguments": {**vars(args), "output": str(args.output)}, "summary": summary}, indent=2)
+        )
+
+
+if __name__ == "__main__":
+    main()
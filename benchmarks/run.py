@@ -0,0 +1,175 @@
+"""Time the hot paths of the server against synthetic data, a local mongod and a fake Tink
+
+    python -m benchmarks.run [--rows 1000,10000] [--repeat 5] [--output results.json] [--compare previous.json]
+
+MONGO_CONNECTION_STRING should point at a local mongod and MONGO_DB_NAME end
+with "bench", the database is dropped before running.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from unittest.mock import patch
+
+from benchmarks.data import make_documents, make_tink_payloads
+from benchmarks.fake_tink import FakeTink
+from ecobud.app import app
+from ecobud.cache import NoCache
+from ecobud.config import MONGO_DB_NAME
+from ecobud.connections import mongo, tink
+from ecobud.indexes import ensure_indexes
+from ecobud.model.analytics import get_analytics, get_period_cost
+from ecobud.model.migrations import migrate_transactions, transactions_migrated
+from ecobud.model.rollups import rebuild_rollups, rollupsdb
+from ecobud.model.transactions import (
+    get_transactions,
+    iter_transactions,
+    sync_transactions,
+    syncstatedb,
+    transactionsdb,
+)
+
+RESULTS_DIR = Path(__file__).parent / "results"
+PERIOD = ("2022-01-01", "2022-12-31")
+
+
+def measure(name: str, rows: int, function: Callable, repeat: int, setup: Optional[Callable] = None) -> Dict:
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    result = {
+        "name": name,
+        "rows": rows,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings),
+    }
+    print(f"{name:36} {rows:>9} rows {result['median'] * 1000:10.1f} ms")
+    return result
+
+
+def clear_user(username: str) -> None:
+    transactionsdb.delete_many({"username": username})
+    rollupsdb.delete_many({"username": username})
+    syncstatedb.delete_many({"_id": username})
+
+
+def bench_sync(username: str, rows: int, repeat: int) -> List[Dict]:
+    payloads = make_tink_payloads(rows, seed=rows)
+    pages = rows // 100 + 1
+    with FakeTink(payloads) as fake, patch.object(tink, "TINK_BASE_URL", fake.url):
+        return [
+            measure(
+                "sync_transactions initial",
+                rows,
+                lambda: sync_transactions(username, noPages=pages, full=True),
+                repeat,
+                setup=lambda: clear_user(username),
+            ),
+            measure("sync_transactions up to date", rows, lambda: sync_transactions(username, noPages=pages), repeat),
+        ]
+
+
+def seed(username: str, rows: int) -> None:
+    clear_user(username)
+    documents = make_documents(username, rows, seed=rows)
+    for start in range(0, len(documents), 10000):
+        transactionsdb.insert_many(documents[start : start + 10000], ordered=False)
+    rebuild_rollups(username)
+    migrate_transactions(pause=0)
+    transactions_migrated.cache_clear()
+
+
+def bench_reads(username: str, rows: int, repeat: int) -> List[Dict]:
+    startDate, endDate = PERIOD
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["username"] = username
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, response.data
+        return response.data
+
+    benchmarks = {
+        "get_analytics python": lambda: get_analytics(startDate, endDate, username, engine="python"),
+        "get_analytics numpy": lambda: get_analytics(startDate, endDate, username, engine="numpy"),
+        "get_period_cost aggregate": lambda: get_period_cost(startDate, endDate, username),
+        "get_period_cost rollup": lambda: get_period_cost(startDate, endDate, username, engine="rollup"),
+        "get_transactions first page": lambda: get_transactions(username),
+        "iter_transactions all": lambda: sum(1 for _ in iter_transactions(username)),
+        "GET /transactions": lambda: get("/transactions"),
+        "GET /transactions stream": lambda: get("/transactions?stream=1"),
+        "GET /analytics": lambda: get(f"/analytics/{startDate}/{endDate}"),
+        "GET /analytics summary": lambda: get(f"/analytics/{startDate}/{endDate}?summary=1"),
+    }
+    with patch("ecobud.model.analytics.analytics_cache", NoCache("bench")):
+        return [measure(name, rows, function, repeat) for name, function in benchmarks.items()]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], previous: Dict[str, Any]) -> None:
+    """Print how the median of every benchmark moved since a previous run"""
+    before = {(result["name"], result["rows"]): result["median"] for result in previous["results"]}
+    print(f"\nCompared with {previous.get('commit')}")
+    for result in results:
+        key = (result["name"], result["rows"])
+        if key in before:
+            print(f"{result['name']:36} {result['rows']:>9} rows {result['median'] / before[key]:8.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000,10000,100000", help="comma separated numbers of transactions")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", type=Path, help="results of a previous run")
+    args = parser.parse_args()
+
+    if not MONGO_DB_NAME.endswith("bench"):
+        parser.error(f"MONGO_DB_NAME is {MONGO_DB_NAME}, it should end with 'bench' as the database gets dropped")
+    mongo.get_client().drop_database(MONGO_DB_NAME)
+    ensure_indexes()
+
+    results = []
+    for rows in [int(rows) for rows in args.rows.split(",")]:
+        username = f"bench{rows}"
+        results += bench_sync(username, rows, args.repeat)
+        seed(username, rows)
+        results += bench_reads(username, rows, args.repeat)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "createdAt": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    output = args.output or RESULTS_DIR / f"{(commit or 'unknown')[:12]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Compare gunicorn worker classes under the same load, with Tink answering slowly
+
+    python -m benchmarks.serving [--tink-latency 0.2] [--rate 50] [--duration 30] [--modes sync,gthread]
+
+Every mode runs gunicorn with GUNICORN_WORKERS workers against the fake Tink.
+Part of the load hits /tink/transactions, which waits on Tink for every
+request, the rest reads transactions and analytics from MongoDB, so it needs
+the same local mongod as benchmarks.run.
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import time
+
+from benchmarks import load
+from benchmarks.fake_tink import FakeTink
+
+PORT = 8765
+ENDPOINTS = load.ENDPOINTS + [("tink transactions", "/tink/transactions", 3)]
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def serve(mode: str, tinkUrl: str) -> subprocess.Popen:
+    env = {**os.environ, "TINK_BASE_URL": tinkUrl, "GUNICORN_WORKER_CLASS": mode}
+    # The entry point the Dockerfile serves
+    server = subprocess.Popen(["gunicorn", "--bind", f"127.0.0.1:{PORT}", "ecobud.app:create_app()"], env=env)
+    wait_for_port(PORT)
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="sync,gthread", help="comma separated gunicorn worker classes")
+    parser.add_argument("--tink-latency", type=float, default=0.2, help="mean Tink response time in seconds")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+
+    summaries = {}
+    with FakeTink(transactionsPerUser=100, latency=args.tink_latency) as fake:
+        for mode in args.modes.split(","):
+            print(f"\n{mode} workers")
+            server = serve(mode, fake.url)
+            try:
+                summaries[mode] = load.run(
+                    f"http://127.0.0.1:{PORT}", args.users, args.rate, args.duration, 500, ENDPOINTS
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(f"\n{'mode':10} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, summary in summaries.items():
+        stats = summary["all"]
+        print(
+            f"{mode:10} {stats['throughput']:8.1f} {stats['errors']:7} "
+            f"{stats['p50'] * 1000:8.1f} {stats['p99'] * 1000:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Time how long a fresh interpreter takes to import the app, and what that import starts
+
+    python -m benchmarks.startup [--repeat 10] [--module ecobud.app]
+
+Every import runs in a new interpreter, so nothing is cached between runs
+beyond the bytecode. Threads alive after the import show whether importing
+already started a MongoDB client and its monitors.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+PROBE = """
+import json, threading, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start, "threads": threading.active_count()}}))
+"""
+
+
+def measure(module: str, repeat: int) -> Dict[str, float]:
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module)], capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    seconds = [run["seconds"] for run in runs]
+    return {
+        "median": statistics.median(seconds),
+        "min": min(seconds),
+        "max": max(seconds),
+        "threads": max(run["threads"] for run in runs),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--module", default="ecobud.app")
+    args = parser.parse_args()
+
+    result = measure(args.module, args.repeat)
+    print(
+        f"import {args.module}: median {result['median'] * 1000:.1f} ms "
+        f"(min {result['min'] * 1000:.1f}, max {result['max'] * 1000:.1f}), {result['threads']} threads running"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+# Requests mostly wait on MongoDB and Tink, so each worker serves many of them
+# at once: on threads by default (gthread), or on greenlets with gevent, which
+# needs the gevent extra installed. "sync" restores one request per worker.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+# Requests in flight per worker, threads for gthread and greenlets for gevent.
+# More than one thread would silently turn sync workers into gthread ones.
+threads = int(os.environ.get("GUNICORN_THREADS", "64" if worker_class == "gthread" else "1"))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "500"))
+# Import the app once in the master rather than in every worker. It is safe as
+# the MongoDB client is only created on first use, in each worker. gevent has
+# to patch the standard library before the app is imported, so it cannot.
+preload_app = os.environ.get("GUNICORN_PRELOAD", str(worker_class != "gevent")).lower() == "true"
+
+# Metrics of every worker are kept in this directory, see ecobud.metrics
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/ecobud-metrics")
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
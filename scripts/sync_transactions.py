@@ -3,4 +3,4 @@ from ecobud.model.transactions import transactionsdb, sync_transactions
 ### Remove all transactions from the database
 transactionsdb.delete_many({})
 
-sync_transactions("test0")
\ No newline at end of file
+sync_transactions("test0", full=True)
\ No newline at end of file
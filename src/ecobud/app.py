@@ -1,25 +1,74 @@
 import logging
+import time
 
-from flask import Flask, request, session
+from flask import Blueprint, Flask, Response, current_app, g, request, session
 
-from ecobud.config import FLASK_SECRET_KEY
-from ecobud.connections.tink import get_bank_connection_url, get_user_transactions
-from ecobud.model.analytics import get_analytics
-from ecobud.model.transactions import get_specific_transaction, get_transactions, update_transaction
+from ecobud.config import FLASK_SECRET_KEY, TINK_WEBHOOK_SECRET, TRANSACTIONS_MAX_PAGE_SIZE, TRANSACTIONS_PAGE_SIZE
+from ecobud.connections.tink import (
+    InvalidWebhookSignature,
+    get_bank_connection_url,
+    get_user_transactions,
+    verify_webhook_signature,
+)
+from ecobud.metrics import REQUEST_LATENCY, render
+from ecobud.model.analytics import (
+    UnknownAnalyticsBucket,
+    UnknownAnalyticsEngine,
+    get_analytics,
+    get_period_cost,
+    iter_analytics,
+)
+from ecobud.model.sync_jobs import enqueue_sync
+from ecobud.model.transactions import (
+    InvalidCursor,
+    InvalidTransactionChanges,
+    TransactionsNotFound,
+    edit_transactions,
+    get_specific_transaction,
+    get_transactions,
+    iter_transactions,
+    update_transaction,
+)
 from ecobud.model.user import UserAlreadyExists, UserNotFound, WrongPassword, create_user, login_user
+from ecobud.model.webhooks import InvalidWebhookEvent, handle_tink_event
+from ecobud.passwords import PasswordHasherBusy
+from ecobud.responses import JSONProvider, compress_response, conditional
 
 logging.basicConfig(
     level=logging.DEBUG,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
 
-app = Flask(__name__)
+api = Blueprint("api", __name__)
 logger = logging.getLogger(__name__)
 
-app.secret_key = FLASK_SECRET_KEY
+NDJSON = "application/x-ndjson"
+
+
+@api.before_app_request
+def start_timer():
+    g.started = time.perf_counter()
+
+
+@api.after_app_request
+def record_latency(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_LATENCY.labels(route, request.method, str(response.status_code)).observe(time.perf_counter() - g.started)
+    return response
+
 
+def wants_stream():
+    return bool(request.args.get("stream")) or request.accept_mimetypes.best == NDJSON
 
-@app.route("/user", methods=["POST"])
+
+def ndjson_response(rows):
+    """Encode and send rows one per line as they are produced"""
+    # Rows are encoded after the request context is gone
+    dumps = current_app.json.dumps
+    return Response((dumps(row) + "\n" for row in rows), mimetype=NDJSON)
+
+
+@api.route("/user", methods=["POST"])
 def user_post():
     username = request.json["username"]
     email = request.json["email"]
@@ -28,26 +77,31 @@ def user_post():
         create_user(username, email, password)
     except UserAlreadyExists:
         return {"error": "User already exists"}, 409
+    except PasswordHasherBusy:
+        return {"error": "Too many requests, retry shortly"}, 503, {"Retry-After": "1"}
 
     return {"username": username}, 201
 
 
-@app.route("/login", methods=["POST"])
+@api.route("/login", methods=["POST"])
 def login_post():
     username = request.json["username"]
     password = request.json["password"]
     try:
         login_user(username, password)
         session["username"] = username
+        enqueue_sync(username)
     except UserNotFound:
         return {"error": "User not found"}, 404
     except WrongPassword:
         return {"error": "Wrong password"}, 401
+    except PasswordHasherBusy:
+        return {"error": "Too many requests, retry shortly"}, 503, {"Retry-After": "1"}
 
     return {"username": username}, 200
 
 
-@app.route("/bank/link", methods=["GET"])
+@api.route("/bank/link", methods=["GET"])
 def bank_post():
     username = session.get("username")
     if not username:
@@ -56,7 +110,7 @@ def bank_post():
     return {"url": bank_connection_url}
 
 
-@app.route("/tink/transactions", methods=["GET"])
+@api.route("/tink/transactions", methods=["GET"])
 def tranasctions_get():
     username = session.get("username")
     if not username:
@@ -65,24 +119,61 @@ def tranasctions_get():
     return {"transactions": transactions}
 
 
-@app.route("/tink/webhook", methods=["POST"])
+@api.route("/tink/webhook", methods=["POST"])
 def webhook_post():
-    logger.debug(f"Got webhook {request.json}")
-    return {"success": True}
+    logger.debug(f"Got webhook {request.get_data(as_text=True)}")
+    if not TINK_WEBHOOK_SECRET:
+        logger.warning("Rejected webhook: TINK_WEBHOOK_SECRET is not set")
+        return {"error": "Webhooks are not configured"}, 503
+    try:
+        verify_webhook_signature(request.get_data(), request.headers.get("X-Tink-Signature"), TINK_WEBHOOK_SECRET)
+    except InvalidWebhookSignature as e:
+        logger.debug(f"Rejected webhook: {e}")
+        return {"error": "Invalid signature"}, 401
+
+    try:
+        result = handle_tink_event(request.get_json(silent=True))
+    except InvalidWebhookEvent:
+        return {"error": "Invalid event"}, 400
+    return {"success": True, **result}, 202
 
 
-@app.route("/transactions", methods=["GET"])
+@api.route("/transactions", methods=["GET"])
+@conditional
 def transactions_get():
     logger.debug(f"Getting transactions for {session.get('username')}")
     username = session.get("username")
     if not username:
         return {"error": "Not logged in"}, 401
-    transactions = get_transactions(username)
+    if wants_stream():
+        try:
+            transactions = iter_transactions(
+                username,
+                cursor=request.args.get("cursor"),
+                full=bool(request.args.get("full")),
+            )
+        except InvalidCursor:
+            return {"error": "Invalid cursor"}, 400
+        return ndjson_response(transactions)
+
+    pageSize = request.args.get("pageSize", TRANSACTIONS_PAGE_SIZE, type=int)
+    if not 0 < pageSize <= TRANSACTIONS_MAX_PAGE_SIZE:
+        return {"error": f"pageSize must be between 1 and {TRANSACTIONS_MAX_PAGE_SIZE}"}, 400
+    try:
+        transactions, next_cursor = get_transactions(
+            username,
+            pageSize=pageSize,
+            cursor=request.args.get("cursor"),
+            full=bool(request.args.get("full")),
+        )
+    except InvalidCursor:
+        return {"error": "Invalid cursor"}, 400
     logger.debug(f"Got transactions for {session.get('username')}, number is {len(transactions)}")
-    return {"transactions": transactions}, 200
+    return {"transactions": transactions, "next": next_cursor}, 200
 
 
-@app.route("/transactions/<transaction_id>", methods=["GET"])
+@api.route("/transactions/<transaction_id>", methods=["GET"])
+@conditional
 def transaction_get(transaction_id):
     username = session.get("username")
     if not username:
@@ -91,7 +182,7 @@ def transaction_get(transaction_id):
     return {"transaction": transaction}, 200
 
 
-@app.route("/transactions/<transaction_id>", methods=["PUT"])
+@api.route("/transactions/<transaction_id>", methods=["PUT"])
 def transaction_put(transaction_id):
     logger.debug(f"Got update request for transaction {transaction_id}")
     transaction = request.json["transaction"]
@@ -108,25 +199,86 @@ def transaction_put(transaction_id):
         logger.debug(f"Wrong transaction id")
         return {"error": "Wrong transaction id"}, 401
 
-    update_transaction(transaction)
+    try:
+        updated = update_transaction(transaction)
+    except InvalidTransactionChanges as e:
+        return {"error": str(e)}, 400
+    if not updated:
+        logger.debug(f"Transaction {transaction_id} missing or changed meanwhile")
+        return {"error": "Transaction not found or changed since its version"}, 409
     logger.debug(f"[Success] Updated transaction {transaction_id}")
     return {"success": True}, 200
 
 
-@app.route("/analytics/<start_date>/<end_date>", methods=["GET"])
+@api.route("/transactions", methods=["PATCH"])
+def transactions_patch():
+    username = session.get("username")
+    if not username:
+        return {"error": "Not logged in"}, 401
+    edits = (request.get_json(silent=True) or {}).get("transactions")
+    if not isinstance(edits, list):
+        return {"error": "Expected a list of transactions"}, 400
+    try:
+        result = edit_transactions(username, edits)
+    except InvalidTransactionChanges as e:
+        return {"error": str(e)}, 400
+    except TransactionsNotFound as e:
+        return {"error": str(e)}, 404
+    return result, 200
+
+
+@api.route("/analytics/<start_date>/<end_date>", methods=["GET"])
+@conditional
 def analytics_get(start_date, end_date):
     username = session.get("username")
     logger.debug(f"Got request for analytics for user {username} between {start_date} and {end_date}")
     if not username:
         return {"error": "Not logged in"}, 401
 
-    analytics = get_analytics(start_date, end_date, username)
+    if wants_stream():
+        return ndjson_response(iter_analytics(start_date, end_date, username))
+
+    if request.args.get("summary"):
+        groupBy = request.args.get("groupBy")
+        engine = request.args.get("engine", "aggregate")
+        try:
+            analytics = get_period_cost(start_date, end_date, username, groupBy=groupBy, engine=engine)
+        except UnknownAnalyticsEngine:
+            return {"error": f"Unknown analytics engine {engine}"}, 400
+        except UnknownAnalyticsBucket:
+            return {"error": f"Unknown analytics bucket {groupBy}"}, 400
+        return {"analytics": analytics}, 200
+
+    engine = request.args.get("engine", "python")
+    try:
+        analytics = get_analytics(start_date, end_date, username, engine=engine)
+    except UnknownAnalyticsEngine:
+        return {"error": f"Unknown analytics engine {engine}"}, 400
     logger.debug(f"Got analytics {analytics}")
     return {"analytics": analytics}, 200
 
 
-@app.route("/logout", methods=["POST"])
+@api.route("/metrics", methods=["GET"])
+def metrics_get():
+    body, content_type = render()
+    return Response(body, content_type=content_type)
+
+
+@api.route("/logout", methods=["POST"])
 def logout_post():
     logger.debug(f"Logging out {session.get('username')}")
     session.pop("username", None)
     return {"success": True}, 200
+
+
+def create_app() -> Flask:
+    """Application serving the API, it connects to MongoDB once a request needs to"""
+    app = Flask(__name__)
+    app.secret_key = FLASK_SECRET_KEY
+    app.json = JSONProvider(app)
+    app.register_blueprint(api)
+    app.after_request(compress_response)
+    return app
+
+
+app = create_app()
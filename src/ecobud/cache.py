@@ -0,0 +1,141 @@
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+from pymongo import ASCENDING, IndexModel
+from pymongo.collection import Collection
+from pymongo.errors import DocumentTooLarge
+
+from ecobud.config import ANALYTICS_CACHE_BACKEND, ANALYTICS_CACHE_SIZE, ANALYTICS_CACHE_TTL
+from ecobud.connections.mongo import collections
+from ecobud.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(*parts) -> str:
+    return json.dumps(parts)
+
+
+class ResultCache(ABC):
+    """Bounded cache of JSON-like results, counting hits and misses"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._counters_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._get(key)
+        with self._counters_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_REQUESTS.labels(self.name, "miss" if value is None else "hit").inc()
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._set(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Any]:
+        """Stored value of key, None when absent or expired"""
+
+    @abstractmethod
+    def _set(self, key: str, value: Any) -> None:
+        """Store value under key"""
+
+
+class NoCache(ResultCache):
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value):
+        pass
+
+
+class LocalCache(ResultCache):
+    """LRU cache private to the process, entries also expire after ttl seconds"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        super().__init__(name)
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            return self._cache.get(key)
+
+    def _set(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+
+
+class MongoCache(ResultCache):
+    """Cache shared by every process through a collection
+
+    Entries expire through a TTL index. Once the collection outgrows maxsize,
+    the least recently read entries are dropped.
+    """
+
+    INDEXES = [
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_ttl", expireAfterSeconds=0),
+        IndexModel([("lastAccess", ASCENDING)], name="lastAccess"),
+    ]
+
+    def __init__(self, name: str, collection: Collection, maxsize: int, ttl: float):
+        super().__init__(name)
+        self.collection = collection
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    def _get(self, key):
+        now = datetime.utcnow()
+        document = self.collection.find_one_and_update(
+            {"_id": key, "expiresAt": {"$gt": now}},
+            {"$set": {"lastAccess": now}},
+            projection={"value": 1},
+        )
+        return document["value"] if document else None
+
+    def _set(self, key, value):
+        now = datetime.utcnow()
+        try:
+            self.collection.replace_one(
+                {"_id": key},
+                {"value": value, "lastAccess": now, "expiresAt": now + timedelta(seconds=self.ttl)},
+                upsert=True,
+            )
+        except DocumentTooLarge:
+            logger.debug(f"Not caching {key}, too large")
+            return
+
+        excess = self.collection.estimated_document_count() - self.maxsize
+        if excess > 0:
+            oldest = self.collection.find({}, {"_id": 1}).sort("lastAccess", ASCENDING).limit(excess)
+            self.collection.delete_many({"_id": {"$in": [document["_id"] for document in oldest]}})
+
+
+def make_cache(name: str, backend: str, maxsize: int, ttl: float) -> ResultCache:
+    if backend == "mongo":
+        return MongoCache(name, collections[name], maxsize=maxsize, ttl=ttl)
+    if backend == "local":
+        return LocalCache(name, maxsize=maxsize, ttl=ttl)
+    return NoCache(name)
+
+
+analytics_cache = make_cache(
+    "analytics_cache",
+    backend=ANALYTICS_CACHE_BACKEND,
+    maxsize=ANALYTICS_CACHE_SIZE,
+    ttl=ANALYTICS_CACHE_TTL,
+)
@@ -3,7 +3,48 @@ import os
 TINK_CLIENT_ID = os.environ["TINK_CLIENT_ID"]
 TINK_CLIENT_SECRET = os.environ["TINK_CLIENT_SECRET"]
 MONGO_CONNECTION_STRING = os.environ["MONGO_CONNECTION_STRING"]
-TINK_BASE_URL = "https://api.tink.com"
+TINK_BASE_URL = os.environ.get("TINK_BASE_URL", "https://api.tink.com")
 SELF_BASE_URL = os.environ["SELF_BASE_URL"]
 FLASK_SECRET_KEY = os.environ["FLASK_SECRET_KEY"]
 MONGO_DB_NAME = os.environ["MONGO_DB_NAME"]
+SYNC_WORKER_CONCURRENCY = int(os.environ.get("SYNC_WORKER_CONCURRENCY", "4"))
+SYNC_POLL_INTERVAL = float(os.environ.get("SYNC_POLL_INTERVAL", "1"))
+SYNC_LEASE_SECONDS = int(os.environ.get("SYNC_LEASE_SECONDS", "300"))
+SYNC_HEARTBEAT_SECONDS = float(os.environ.get("SYNC_HEARTBEAT_SECONDS", "60"))
+SYNC_MAX_PAGES = int(os.environ.get("SYNC_MAX_PAGES", "10"))
+SYNC_DEBOUNCE_SECONDS = float(os.environ.get("SYNC_DEBOUNCE_SECONDS", "30"))
+TINK_WEBHOOK_SECRET = os.environ.get("TINK_WEBHOOK_SECRET")
+TRANSACTIONS_PAGE_SIZE = int(os.environ.get("TRANSACTIONS_PAGE_SIZE", "100"))
+TRANSACTIONS_MAX_PAGE_SIZE = int(os.environ.get("TRANSACTIONS_MAX_PAGE_SIZE", "500"))
+TRANSACTIONS_MAX_BATCH_SIZE = int(os.environ.get("TRANSACTIONS_MAX_BATCH_SIZE", "500"))
+TRANSACTIONS_MAX_SPREAD_DAYS = int(os.environ.get("TRANSACTIONS_MAX_SPREAD_DAYS", "3660"))
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "500"))
+ANALYTICS_CACHE_BACKEND = os.environ.get("ANALYTICS_CACHE_BACKEND", "mongo")
+ANALYTICS_CACHE_SIZE = int(os.environ.get("ANALYTICS_CACHE_SIZE", "1000"))
+ANALYTICS_CACHE_TTL = float(os.environ.get("ANALYTICS_CACHE_TTL", "3600"))
+TINK_POOL_SIZE = int(os.environ.get("TINK_POOL_SIZE", "64"))
+TINK_CONNECT_TIMEOUT = float(os.environ.get("TINK_CONNECT_TIMEOUT", "3.05"))
+TINK_READ_TIMEOUT = float(os.environ.get("TINK_READ_TIMEOUT", "30"))
+TINK_MAX_RETRIES = int(os.environ.get("TINK_MAX_RETRIES", "3"))
+TINK_BACKOFF_BASE = float(os.environ.get("TINK_BACKOFF_BASE", "0.5"))
+TINK_BACKOFF_MAX = float(os.environ.get("TINK_BACKOFF_MAX", "10"))
+MIGRATION_BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", "1000"))
+MIGRATION_PAUSE = float(os.environ.get("MIGRATION_PAUSE", "0.1"))
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", "2"))
+PASSWORD_QUEUE_SIZE = int(os.environ.get("PASSWORD_QUEUE_SIZE", "16"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+USER_CACHE_NEGATIVE_TTL = float(os.environ.get("USER_CACHE_NEGATIVE_TTL", "5"))
+USER_CACHE_WATCH = os.environ.get("USER_CACHE_WATCH", "true").lower() == "true"
+TINK_TOKEN_REFRESH_MARGIN = float(os.environ.get("TINK_TOKEN_REFRESH_MARGIN", "60"))
+TINK_TOKEN_LEASE_SECONDS = float(os.environ.get("TINK_TOKEN_LEASE_SECONDS", "30"))
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "0"))
+# Comma separated, in order of preference: zstd (zstandard package), snappy (python-snappy package), zlib
+MONGO_COMPRESSORS = os.environ.get("MONGO_COMPRESSORS", "")
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get("RESPONSE_COMPRESSION_MIN_SIZE", "1024"))
+RESPONSE_COMPRESSION_LEVEL = int(os.environ.get("RESPONSE_COMPRESSION_LEVEL", "6"))
@@ -0,0 +1,127 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses telling the request was not processed, so even non idempotent ones can be retried
+REJECTED_STATUSES = {429, 503}
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds to wait according to the Retry-After header, either delay-seconds or an HTTP-date"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """Session keeping connections alive between calls, with timeouts and retries
+
+    Failed calls are retried with exponential backoff and full jitter, or after
+    the delay the server asked for with Retry-After, unless that is longer than
+    backoff_max, in which case the response is returned as is. Latency, errors and
+    retries are counted per endpoint, and every attempt is reported to the
+    observer with its endpoint, status code (or "error") and duration.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        timeout: Tuple[float, float] = (3.05, 30),
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 10,
+        observer: Optional[Callable[[str, str, float], None]] = None,
+    ):
+        self.session = requests.Session()
+        # The session is shared by every thread, refusing cookies keeps its state read-only
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = time.sleep
+        self.observer = observer
+        self._stats = defaultdict(lambda: {"requests": 0, "errors": 0, "retries": 0, "seconds": 0.0})
+        self._stats_lock = threading.Lock()
+
+    def backoff(self, attempt: int, response: Optional[requests.Response] = None) -> Optional[float]:
+        """Seconds to wait before the next attempt, None when the server asked for longer than backoff_max"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        requested = retry_after(response) if response is not None else None
+        if requested is not None:
+            if requested > self.backoff_max:
+                return None
+            delay = max(delay, requested)
+        return delay
+
+    def request(self, method: str, url: str, endpoint: str, idempotent: bool = True, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retriable = idempotent or isinstance(e, requests.ConnectTimeout)
+                self._record(endpoint, time.perf_counter() - start, "error")
+                if not retriable or attempt >= self.max_retries:
+                    raise
+                logger.debug(f"{method} {endpoint} failed with {e!r}, retrying")
+                delay = self.backoff(attempt)
+            else:
+                statuses = RETRY_STATUSES if idempotent else REJECTED_STATUSES
+                self._record(endpoint, time.perf_counter() - start, str(response.status_code))
+                if response.status_code not in statuses or attempt >= self.max_retries:
+                    return response
+                delay = self.backoff(attempt, response)
+                if delay is None:
+                    # Retrying any earlier would only be rejected again
+                    logger.debug(f"{method} {endpoint} got {response.status_code}, asked to wait beyond the backoff")
+                    return response
+                logger.debug(f"{method} {endpoint} got {response.status_code}, retrying")
+
+            self.sleep(delay)
+            attempt += 1
+            with self._stats_lock:
+                self._stats[endpoint]["retries"] += 1
+
+    def get(self, url: str, endpoint: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url: str, endpoint: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._stats_lock:
+            return {endpoint: dict(stats) for endpoint, stats in self._stats.items()}
+
+    def _record(self, endpoint: str, seconds: float, status: str) -> None:
+        with self._stats_lock:
+            stats = self._stats[endpoint]
+            stats["requests"] += 1
+            stats["errors"] += int(status == "error" or int(status) >= 400)
+            stats["seconds"] += seconds
+        if self.observer is not None:
+            self.observer(endpoint, status, seconds)
@@ -1,14 +1,100 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from pymongo.collection import Collection
+from pymongo.database import Database
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 
-from ecobud.config import MONGO_CONNECTION_STRING, MONGO_DB_NAME
-
-client = MongoClient(
+from ecobud.config import (
+    MONGO_COMPRESSORS,
+    MONGO_CONNECT_TIMEOUT_MS,
     MONGO_CONNECTION_STRING,
-    server_api=ServerApi("1"),
+    MONGO_DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
 )
+from ecobud.metrics import MongoCommandListener
+
+# The client of this process, created on first use. A forked child never uses
+# the client of its parent: its sockets and monitor threads are not safe to
+# share, so the child creates its own.
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+
+def client_options() -> Dict[str, Any]:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        # 0 waits for replies forever
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+def get_client() -> MongoClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGO_CONNECTION_STRING,
+                    server_api=ServerApi("1"),
+                    event_listeners=[MongoCommandListener()],
+                    **client_options(),
+                )
+    return _client
+
+
+def get_database() -> Database:
+    return get_client()[MONGO_DB_NAME]
+
+
+def _forget_client() -> None:
+    global _client, _client_lock
+    _client = None
+    # The lock may have been held by another thread of the parent when it forked
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_client)
+
+
+class LazyCollection:
+    """Stands for a collection of the database of the current process, resolved on every use"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def resolve(self) -> Collection:
+        return get_database()[self.name]
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self.resolve(), attribute)
+
+    def __repr__(self) -> str:
+        return f"LazyCollection({self.name!r})"
+
+
+class LazyDatabase:
+    """Stands for the database of the current process, handing out lazy collections"""
+
+    def __getitem__(self, name: str) -> LazyCollection:
+        return LazyCollection(name)
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(get_database(), attribute)
+
 
-collections = client[MONGO_DB_NAME]
+collections = LazyDatabase()
 
 
 def test_connection():
@@ -1,34 +1,82 @@
+import hashlib
+import hmac
 import logging
 import sys
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-import cachetools.func
-import requests as re
-
-from ecobud.config import SELF_BASE_URL, TINK_BASE_URL, TINK_CLIENT_ID, TINK_CLIENT_SECRET
+from ecobud.config import (
+    SELF_BASE_URL,
+    TINK_BACKOFF_BASE,
+    TINK_BACKOFF_MAX,
+    TINK_BASE_URL,
+    TINK_CLIENT_ID,
+    TINK_CLIENT_SECRET,
+    TINK_CONNECT_TIMEOUT,
+    TINK_MAX_RETRIES,
+    TINK_POOL_SIZE,
+    TINK_READ_TIMEOUT,
+    TINK_TOKEN_LEASE_SECONDS,
+    TINK_TOKEN_REFRESH_MARGIN,
+)
+from ecobud.connections.http import HttpClient
+from ecobud.connections.mongo import collections
+from ecobud.connections.tokens import TokenStore
+from ecobud.metrics import observe_tink_call
 from ecobud.utils import curl, fmt_response
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+client = HttpClient(
+    pool_size=TINK_POOL_SIZE,
+    timeout=(TINK_CONNECT_TIMEOUT, TINK_READ_TIMEOUT),
+    max_retries=TINK_MAX_RETRIES,
+    backoff_base=TINK_BACKOFF_BASE,
+    backoff_max=TINK_BACKOFF_MAX,
+    observer=observe_tink_call,
+)
 
-@cachetools.func.ttl_cache(maxsize=128, ttl=10 * 60)
-def get_client_token(scope, grant_type="client_credentials"):
+tokens = TokenStore(
+    collections["tink_tokens"],
+    refreshMargin=TINK_TOKEN_REFRESH_MARGIN,
+    leaseSeconds=TINK_TOKEN_LEASE_SECONDS,
+)
+
+# Lifetime assumed for tokens returned without expires_in
+DEFAULT_TOKEN_LIFETIME = 10 * 60
+
+# Tolerated age of a webhook signature timestamp, guards against replays
+WEBHOOK_SIGNATURE_TOLERANCE = 5 * 60
+
+
+class InvalidWebhookSignature(Exception):
+    pass
+
+
+def _request_token(data):
+    """Access token from the token endpoint and its lifetime in seconds"""
     url = TINK_BASE_URL + "/api/v1/oauth/token"
+    response = client.post(url, "oauth/token", data=data)
+    logger.debug(f"Sent request {curl(response)}")
+    logger.debug(f"Got response {fmt_response(response)}")
+    token = response.json()
+    return token["access_token"], token.get("expires_in", DEFAULT_TOKEN_LIFETIME)
+
+
+def get_client_token(scope, grant_type="client_credentials"):
     data = {
         "client_id": TINK_CLIENT_ID,
         "client_secret": TINK_CLIENT_SECRET,
         "grant_type": grant_type,
         "scope": scope,
     }
-    response = re.post(url=url, data=data)
-    logger.debug(f"Sent request {curl(response)}")
-    logger.debug(f"Got response {fmt_response(response)}")
-    return response.json()["access_token"]
+    return tokens.get(f"client:{grant_type}:{scope}", lambda: _request_token(data))
 
 
-@cachetools.func.ttl_cache(maxsize=128, ttl=10 * 60)
 def get_user_authorization_code(username, scope, delegate=False, **kwargs):
+    """Single use code, never cached"""
     client_token = get_client_token(
         scope="authorization:grant",
         grant_type="client_credentials",
@@ -46,26 +94,23 @@ def get_user_authorization_code(username, scope, delegate=False, **kwargs):
         },
         **kwargs,
     }
-    response = re.post(url=url, data=data, headers=headers)
+    response = client.post(url, "oauth/authorization-grant", data=data, headers=headers)
     logger.debug(f"Sent request {curl(response)}")
     logger.debug(f"Got response {fmt_response(response)}")
     return response.json()["code"]
 
 
-@cachetools.func.ttl_cache(maxsize=128, ttl=10 * 60)
 def get_user_token(username, scope):
-    user_authorization_code = get_user_authorization_code(username, scope)
-    url = TINK_BASE_URL + "/api/v1/oauth/token"
-    data = {
-        "client_id": TINK_CLIENT_ID,
-        "client_secret": TINK_CLIENT_SECRET,
-        "grant_type": "authorization_code",
-        "code": user_authorization_code,
-    }
-    response = re.post(url=url, data=data)
-    logger.debug(f"Sent request {curl(response)}")
-    logger.debug(f"Got response {fmt_response(response)}")
-    return response.json()["access_token"]
+    def fetch():
+        data = {
+            "client_id": TINK_CLIENT_ID,
+            "client_secret": TINK_CLIENT_SECRET,
+            "grant_type": "authorization_code",
+            "code": get_user_authorization_code(username, scope),
+        }
+        return _request_token(data)
+
+    return tokens.get(f"user:{username}:{scope}", fetch)
 
 
 def create_user(username):
@@ -81,7 +126,7 @@ def create_user(username):
         "locale": "en_US",
         "retention_class": "permanent",
     }
-    response = re.post(url=url, json=data, headers=headers)
+    response = client.post(url, "user/create", idempotent=False, json=data, headers=headers)
     return response.json()
 
 
@@ -89,7 +134,7 @@ def get_user(username):
     user_token = get_user_token(username, "user:read")
     url = TINK_BASE_URL + "/api/v1/user"
     headers = {"Authorization": "Bearer " + user_token}
-    response = re.get(url=url, headers=headers)
+    response = client.get(url, "user", headers=headers)
     logger.debug(f"Sent request {curl(response)}")
     logger.debug(f"Got response {fmt_response(response)}")
     return response.json()
@@ -99,32 +144,54 @@ def delete_user(username):
     user_token = get_user_token(username, "user:delete")
     url = TINK_BASE_URL + "/api/v1/user/delete"
     headers = {"Authorization": "Bearer " + user_token}
-    response = re.post(url=url, headers=headers)
+    response = client.post(url, "user/delete", idempotent=False, headers=headers)
+    tokens.discard(f"user:{username}:")
     logger.debug(f"Sent request {curl(response)}")
     logger.debug(f"Got response {fmt_response(response)}")
     return response.json()
 
 
-def get_user_transactions(username, noPages=1):
+def get_user_transactions_page(username, pageToken=None, accountIds=None):
     user_token = get_user_token(username, "transactions:read")
     url = TINK_BASE_URL + "/data/v2/transactions"
     headers = {"Authorization": "Bearer " + user_token}
+    params = {"pageToken": pageToken} if pageToken else {}
+    if accountIds:
+        params["accountIdIn"] = accountIds
+    response = client.get(url, "data/transactions", headers=headers, params=params)
+    logger.debug(f"Sent request {curl(response)}")
+    logger.debug(f"Got response {fmt_response(response)}")
+    return response.json()
+
 
-    page = 0
-    transactions = []
-    next_page_token = None
+def iter_user_transaction_pages(username, pageToken=None, accountIds=None, noPages=None):
+    """Pages of transactions, up to noPages of them, each fetched while the previous one is processed
 
-    while page < noPages:
-        page += 1
-        params = {"pageToken": next_page_token} if next_page_token else {}
-        response = re.get(url=url, headers=headers, params=params)
-        data = response.json()
-        logger.debug(f"Sent request {curl(response)}")
-        logger.debug(f"Got response {fmt_response(response)}")
-        transactions.extend(data["transactions"])
-        next_page_token = data["nextPageToken"]
+    At most the page being processed and the one being prefetched are held in
+    memory. Closing the iterator early discards the prefetched page.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(get_user_transactions_page, username, pageToken, accountIds)
+        pages = 0
+        while future is not None:
+            page = future.result()
+            pages += 1
+            next_page_token = page.get("nextPageToken")
+            future = None
+            if next_page_token and (noPages is None or pages < noPages):
+                future = executor.submit(get_user_transactions_page, username, next_page_token, accountIds)
+            yield page
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-    return transactions
+
+def get_user_transactions(username, noPages=1):
+    return [
+        transaction
+        for page in iter_user_transaction_pages(username, noPages=noPages)
+        for transaction in page["transactions"]
+    ]
 
 
 def get_bank_connection_url(username):
@@ -172,7 +239,25 @@ def register_transaction_webhook(webhook_url=None):
         "enabledEvents": ["account-transactions:modified"],
         "url": webhook_url,
     }
-    response = re.post(url=url, json=data, headers=headers)
+    response = client.post(url, "events/webhook-endpoints", idempotent=False, json=data, headers=headers)
     logger.debug(f"Sent request {curl(response)}")
     logger.debug(f"Got response {fmt_response(response)}")
     return response.json()
+
+
+def verify_webhook_signature(body, signature_header, secret, now=None):
+    """Check the X-Tink-Signature header, formatted as t=<timestamp>,v1=<hex hmac-sha256 of "<t>.<body>">"""
+    try:
+        fields = dict(field.split("=", 1) for field in signature_header.split(","))
+        timestamp = fields["t"]
+        signature = fields["v1"]
+    except (AttributeError, KeyError, ValueError):
+        raise InvalidWebhookSignature(f"Malformed signature header {signature_header}")
+
+    now = time.time() if now is None else now
+    if not timestamp.isdigit() or abs(now - int(timestamp)) > WEBHOOK_SIGNATURE_TOLERANCE:
+        raise InvalidWebhookSignature(f"Stale signature timestamp {timestamp}")
+
+    expected = hmac.new(secret.encode("utf-8"), timestamp.encode("utf-8") + b"." + body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, signature):
+        raise InvalidWebhookSignature("Signature mismatch")
@@ -0,0 +1,119 @@
+import logging
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from cachetools import LRUCache
+from pymongo import ASCENDING, IndexModel
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore:
+    """Access tokens shared by every process through a collection, each refreshed by a single caller
+
+    A token is used until refreshMargin seconds before it expires, or half its
+    lifetime for short lived ones. Then one caller, across threads and
+    processes, takes a lease on it and fetches a new one, while the others keep
+    using the current token or wait for the new one if it already expired.
+    """
+
+    INDEXES = [
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_ttl", expireAfterSeconds=0),
+    ]
+
+    def __init__(
+        self,
+        collection: Collection,
+        refreshMargin: float = 60,
+        leaseSeconds: float = 30,
+        maxsize: int = 10000,
+        poll: float = 0.1,
+    ):
+        self.collection = collection
+        self.refreshMargin = refreshMargin
+        self.leaseSeconds = leaseSeconds
+        self.poll = poll
+        self.now = datetime.utcnow
+        self.sleep = time.sleep
+        self._local = LRUCache(maxsize=maxsize)
+        self._local_lock = threading.Lock()
+        # Threads refreshing the same key queue on the same lock
+        self._locks = [threading.Lock() for _ in range(64)]
+
+    def get(self, key: str, fetch: Callable[[], Tuple[str, float]]) -> str:
+        """Token stored under key, calling fetch for a new one and its lifetime in seconds when due"""
+        entry = self._cached(key)
+        if self._usable(entry, "refreshAt"):
+            return entry["token"]
+        with self._locks[zlib.crc32(key.encode("utf-8")) % len(self._locks)]:
+            entry = self._cached(key)
+            if self._usable(entry, "refreshAt"):
+                return entry["token"]
+            return self._refresh(key, fetch)
+
+    def discard(self, prefix: str) -> None:
+        """Forget every token whose key starts with prefix"""
+        with self._local_lock:
+            for key in [key for key in self._local if key.startswith(prefix)]:
+                del self._local[key]
+        self.collection.delete_many({"_id": {"$regex": "^" + re.escape(prefix)}})
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._local_lock:
+            return self._local.get(key)
+
+    def _usable(self, entry: Optional[Dict[str, Any]], until: str) -> bool:
+        # Entries inserted by a lease have no token yet
+        return entry is not None and "token" in entry and self.now() < entry[until]
+
+    def _refresh(self, key: str, fetch: Callable[[], Tuple[str, float]]) -> str:
+        while True:
+            entry = self.collection.find_one({"_id": key})
+            if self._usable(entry, "refreshAt"):
+                break
+            if self._take_lease(key):
+                entry = self._fetch(key, fetch)
+                break
+            # Another process is refreshing the token
+            if self._usable(entry, "expiresAt"):
+                return entry["token"]
+            self.sleep(self.poll)
+
+        with self._local_lock:
+            self._local[key] = entry
+        return entry["token"]
+
+    def _take_lease(self, key: str) -> bool:
+        now = self.now()
+        try:
+            self.collection.update_one(
+                {"_id": key, "$or": [{"refreshingUntil": None}, {"refreshingUntil": {"$lt": now}}]},
+                {"$set": {"refreshingUntil": now + timedelta(seconds=self.leaseSeconds)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def _fetch(self, key: str, fetch: Callable[[], Tuple[str, float]]) -> Dict[str, Any]:
+        try:
+            token, expiresIn = fetch()
+        except Exception:
+            self.collection.update_one({"_id": key}, {"$unset": {"refreshingUntil": ""}})
+            raise
+        now = self.now()
+        entry = {
+            "token": token,
+            "refreshAt": now + timedelta(seconds=expiresIn - min(self.refreshMargin, expiresIn / 2)),
+            "expiresAt": now + timedelta(seconds=expiresIn),
+        }
+        # Replacing the document also releases the lease
+        self.collection.replace_one({"_id": key}, entry, upsert=True)
+        logger.debug(f"Refreshed token {key}, expires in {expiresIn} seconds")
+        return entry
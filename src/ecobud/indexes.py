@@ -0,0 +1,191 @@
+import logging
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+
+from ecobud.cache import MongoCache
+from ecobud.connections.mongo import collections
+from ecobud.connections.tokens import TokenStore
+from ecobud.model.analytics import period_query
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "transactions": [
+        # get_transactions: pages of non-ignored transactions of a user, by (date, _id)
+        IndexModel(
+            [("username", ASCENDING), ("ignore", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+            name="username_ignore_date_id",
+        ),
+        # period_query: one-off branch of the $or
+        IndexModel(
+            [("username", ASCENDING), ("ecoData.oneOff", ASCENDING), ("date", ASCENDING)],
+            name="username_oneOff_date",
+        ),
+        # period_query: spread branch of the $or
+        IndexModel(
+            [
+                ("username", ASCENDING),
+                ("ecoData.oneOff", ASCENDING),
+                ("ecoData.endDate", ASCENDING),
+                ("ecoData.startDate", ASCENDING),
+            ],
+            name="username_oneOff_spread",
+        ),
+        # period_query once transactions are migrated to day ordinals
+        IndexModel(
+            [("username", ASCENDING), ("ecoData.oneOff", ASCENDING), ("day", ASCENDING)],
+            name="username_oneOff_day",
+        ),
+        IndexModel(
+            [
+                ("username", ASCENDING),
+                ("ecoData.oneOff", ASCENDING),
+                ("ecoData.endDay", ASCENDING),
+                ("ecoData.startDay", ASCENDING),
+            ],
+            name="username_oneOff_spread_days",
+        ),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "daily_rollups": [
+        IndexModel([("username", ASCENDING), ("day", ASCENDING)], name="username_day", unique=True),
+    ],
+    "analytics_cache": MongoCache.INDEXES,
+    "tink_tokens": TokenStore.INDEXES,
+    "sync_jobs": [
+        # claim_sync_job: both branches of the $or
+        IndexModel(
+            [("pending", ASCENDING), ("runningUntil", ASCENDING), ("notBefore", ASCENDING)],
+            name="pending_runningUntil_notBefore",
+        ),
+        IndexModel([("runningUntil", ASCENDING)], name="runningUntil"),
+    ],
+}
+
+# Representative shapes of the hot queries, the values do not matter to the planner
+CANONICAL_QUERIES: List[Tuple[str, str, Callable[[Collection], Cursor]]] = [
+    (
+        "transactions",
+        "get_transactions",
+        lambda collection: collection.find({"username": "", "ignore": False})
+        .sort([("date", -1), ("_id", -1)])
+        .limit(100),
+    ),
+    (
+        "transactions",
+        "get_transactions after cursor",
+        lambda collection: collection.find(
+            {
+                "username": "",
+                "ignore": False,
+                "$or": [{"date": {"$lt": "2023-01-01"}}, {"date": "2023-01-01", "_id": {"$lt": ""}}],
+            }
+        )
+        .sort([("date", -1), ("_id", -1)])
+        .limit(100),
+    ),
+    (
+        "transactions",
+        "period_query",
+        lambda collection: collection.find(period_query("", "2023-01-01", "2023-12-31", numeric=False)),
+    ),
+    (
+        "transactions",
+        "period_query on day ordinals",
+        lambda collection: collection.find(period_query("", "2023-01-01", "2023-12-31", numeric=True)),
+    ),
+    (
+        "transactions",
+        "transaction by id",
+        lambda collection: collection.find({"_id": "", "username": ""}),
+    ),
+    (
+        "users",
+        "user by username",
+        lambda collection: collection.find({"username": ""}),
+    ),
+    (
+        "daily_rollups",
+        "get_rolled_up_period_cost",
+        lambda collection: collection.find({"username": "", "day": {"$gte": 737700, "$lte": 738000}}),
+    ),
+    (
+        "sync_jobs",
+        "claim_sync_job",
+        lambda collection: collection.find(
+            {
+                "$or": [
+                    {"pending": True, "runningUntil": None, "notBefore": {"$lte": datetime(2000, 1, 1)}},
+                    {"runningUntil": {"$lt": datetime(2000, 1, 1)}},
+                ]
+            }
+        ),
+    ),
+]
+
+
+class CollectionScan(Exception):
+    pass
+
+
+def ensure_indexes() -> Dict[str, List[str]]:
+    """Create the declared indexes, a no-op for the ones that already exist"""
+    created = {}
+    for name, indexes in INDEXES.items():
+        created[name] = collections[name].create_indexes(indexes)
+        logger.debug(f"Indexes on {name}: {created[name]}")
+    return created
+
+
+def plan_stages(plan: Any) -> Set[str]:
+    """Every stage name appearing anywhere in an explain() plan"""
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages |= plan_stages(value)
+    return stages
+
+
+def check_query_plans() -> Dict[str, Set[str]]:
+    """Explain every canonical query, raising if one of them scans a whole collection"""
+    plans = {}
+    for name, description, query in CANONICAL_QUERIES:
+        explanation = query(collections[name]).explain()
+        plans[description] = plan_stages(explanation["queryPlanner"]["winningPlan"])
+        logger.debug(f"Plan for {description}: {plans[description]}")
+
+    scans = [description for description, stages in plans.items() if "COLLSCAN" in stages]
+    if scans:
+        raise CollectionScan(f"Queries falling back to COLLSCAN: {', '.join(scans)}")
+    return plans
+
+
+def main(argv: Iterable[str]) -> int:
+    commands = {"create": ensure_indexes, "check": check_query_plans}
+    argv = list(argv)
+    if len(argv) != 1 or argv[0] not in commands:
+        print(f"Usage: python -m ecobud.indexes [{'|'.join(commands)}]")
+        return 2
+
+    try:
+        print(commands[argv[0]]())
+    except CollectionScan as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,65 @@
+import os
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+
+# When PROMETHEUS_MULTIPROC_DIR is set, as under gunicorn, every worker writes
+# its samples to memory-mapped files in that directory and any of them can
+# serve the sum over all workers.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+REQUEST_LATENCY = Histogram(
+    "ecobud_request_duration_seconds",
+    "Time spent handling API requests, up to the response headers",
+    ["route", "method", "status"],
+)
+MONGO_LATENCY = Histogram(
+    "ecobud_mongo_command_duration_seconds",
+    "Round trip time of MongoDB commands",
+    ["command", "outcome"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, float("inf")),
+)
+TINK_LATENCY = Histogram(
+    "ecobud_tink_request_duration_seconds",
+    "Round trip time of Tink API calls, one sample per attempt",
+    ["endpoint", "status"],
+)
+CACHE_REQUESTS = Counter(
+    "ecobud_cache_requests_total",
+    "Cache lookups by outcome",
+    ["cache", "result"],
+)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.labels(event.command_name, "succeeded").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_LATENCY.labels(event.command_name, "failed").observe(event.duration_micros / 1e6)
+
+
+def observe_tink_call(endpoint: str, status: str, seconds: float) -> None:
+    TINK_LATENCY.labels(endpoint, status).observe(seconds)
+
+
+def render() -> Tuple[bytes, str]:
+    """Metrics in the Prometheus text format, and their content type"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
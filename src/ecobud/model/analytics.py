@@ -1,13 +1,29 @@
 import logging
 from dataclasses import asdict, dataclass, field
-from datetime import datetime
-from typing import Any, Dict, Iterable, Optional, Tuple
+from datetime import date, datetime
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
+
+from ecobud.cache import analytics_cache, cache_key
+from ecobud.config import STREAM_BATCH_SIZE
+from ecobud.model.migrations import transactions_migrated
+from ecobud.model.rollups import day_number, get_rolled_up_period_cost
 from ecobud.model.transactions import Transaction, transactionsdb
+from ecobud.model.versions import get_data_version
 
 logger = logging.getLogger(__name__)
 
 
+class UnknownAnalyticsEngine(Exception):
+    pass
+
+
+class UnknownAnalyticsBucket(Exception):
+    pass
+
+
 @dataclass
 class AnalyticsInputData:
     """Data used as input for analytics"""
@@ -60,22 +76,55 @@ class AnalysedTransaction:
             else:
                 return 0
         else:
-            overlappingDays = (
-                max(
-                    0,
-                    (
-                        min(analyticsEndDate, datetimeTransactionDate)
-                        - max(
-                            analyticsStartDate,
-                            datetimeTransactionDate,
-                        )
-                    ).days,
-                )
-                + 1
+            spreadStartDate = datetime.fromisoformat(self.transaction.ecoData.startDate)
+            spreadEndDate = datetime.fromisoformat(self.transaction.ecoData.endDate)
+            overlappingDays = max(
+                0,
+                (min(analyticsEndDate, spreadEndDate) - max(analyticsStartDate, spreadStartDate)).days + 1,
             )
             return self.transaction.amount * overlappingDays / self.days_in_period()
 
 
+def period_query(username: str, startDate: str, endDate: str, numeric: Optional[bool] = None) -> Dict[str, Any]:
+    """Query matching all transactions effective between two dates, leaving out ignored ones as the rollups do
+
+    Numeric queries compare the day ordinals of the transactions rather than
+    their ISO dates, they are used by default once every transaction has them.
+    """
+    if numeric is None:
+        numeric = transactions_migrated()
+    if numeric:
+        start, end = day_number(startDate), day_number(endDate)
+        dateField, startField, endField = "day", "ecoData.startDay", "ecoData.endDay"
+    else:
+        start, end = startDate, endDate
+        dateField, startField, endField = "date", "ecoData.startDate", "ecoData.endDate"
+    return {
+        "$and": [
+            {
+                "username": username,
+                "ignore": {"$ne": True},
+            },
+            {
+                "$or": [
+                    {
+                        "ecoData.oneOff": True,
+                        dateField: {
+                            "$gte": start,
+                            "$lte": end,
+                        },
+                    },
+                    {
+                        "ecoData.oneOff": False,
+                        startField: {"$lte": end},
+                        endField: {"$gte": start},
+                    },
+                ]
+            },
+        ]
+    }
+
+
 @dataclass
 class Analytics:
     inputData: AnalyticsInputData
@@ -88,29 +137,7 @@ class Analytics:
 
     def get_transactions_in_period(self) -> Iterable[Transaction]:
         """Get all transactions effective between two dates"""
-        query = {
-            "$and": [
-                {
-                    "username": self.inputData.username,
-                },
-                {
-                    "$or": [
-                        {
-                            "ecoData.oneOff": True,
-                            "date": {
-                                "$gte": self.inputData.startDate,
-                                "$lte": self.inputData.endDate,
-                            },
-                        },
-                        {
-                            "ecoData.oneOff": False,
-                            "ecoData.startDate": {"$lte": self.inputData.endDate},
-                            "ecoData.endDate": {"$gte": self.inputData.startDate},
-                        },
-                    ]
-                },
-            ]
-        }
+        query = period_query(self.inputData.username, self.inputData.startDate, self.inputData.endDate)
 
         result = list(transactionsdb.find(query))
 
@@ -124,19 +151,221 @@ class Analytics:
         return sum(transaction.outputData.periodCost for transaction in self.outputData.transactions)
 
 
-def get_analytics(startDate, endDate, username):
+# date.toordinal() of the day datetime64[D] counts from
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _day_numbers(dates: List[Optional[str]]) -> np.ndarray:
+    """Parse ISO dates into days since the epoch, missing dates become NaT"""
+    return np.array(dates, dtype="datetime64[D]").astype("int64")
+
+
+@dataclass
+class TransactionColumns:
+    """Columnar view of transactions, one array entry per transaction"""
+
+    amount: np.ndarray
+    date: np.ndarray
+    startDate: np.ndarray
+    endDate: np.ndarray
+    oneOff: np.ndarray
+
+    @classmethod
+    def from_documents(cls, documents: List[Dict[str, Any]]) -> "TransactionColumns":
+        ecoData = [document["ecoData"] for document in documents]
+        oneOff = np.array([data["oneOff"] for data in ecoData], dtype=bool)
+        if all("day" in document for document in documents):
+            # Day ordinals stored since schema version 2 spare parsing the dates
+            date = np.array([document["day"] for document in documents], dtype="int64") - EPOCH_ORDINAL
+            spreadStart = np.array([0 if data["oneOff"] else data["startDay"] for data in ecoData]) - EPOCH_ORDINAL
+            spreadEnd = np.array([0 if data["oneOff"] else data["endDay"] for data in ecoData]) - EPOCH_ORDINAL
+        else:
+            date = _day_numbers([document["date"] for document in documents])
+            spreadStart = _day_numbers([None if data["oneOff"] else data["startDate"] for data in ecoData])
+            spreadEnd = _day_numbers([None if data["oneOff"] else data["endDate"] for data in ecoData])
+        # One-off rows carry no spread dates, pin them to the booking date so
+        # the spread arithmetic below stays well defined for every row.
+        startDate = np.where(oneOff, date, spreadStart)
+        endDate = np.where(oneOff, date, spreadEnd)
+        return cls(
+            amount=np.array([document["amount"] for document in documents], dtype=float),
+            date=date,
+            startDate=startDate,
+            endDate=endDate,
+            oneOff=oneOff,
+        )
+
+    def get_cost_in_period(self, startDate: str, endDate: str) -> np.ndarray:
+        """Cost of every transaction attributable to the period, prorated for spread ones"""
+        periodStart, periodEnd = _day_numbers([startDate, endDate])
+        oneOffCost = np.where((self.date >= periodStart) & (self.date <= periodEnd), self.amount, 0.0)
+        overlappingDays = np.maximum(
+            0,
+            np.minimum(periodEnd, self.endDate) - np.maximum(periodStart, self.startDate) + 1,
+        )
+        spreadCost = self.amount * overlappingDays / (self.endDate - self.startDate + 1)
+        return np.where(self.oneOff, oneOffCost, spreadCost)
+
+
+@dataclass
+class VectorizedAnalytics:
+    """Same results as Analytics, computed over columnar arrays instead of per-row objects"""
+
+    inputData: AnalyticsInputData
+    outputData: Optional[Dict[str, Any]] = None
+
+    def __post_init__(self):
+        query = period_query(self.inputData.username, self.inputData.startDate, self.inputData.endDate)
+        documents = list(transactionsdb.find(query))
+        costs = TransactionColumns.from_documents(documents).get_cost_in_period(
+            self.inputData.startDate,
+            self.inputData.endDate,
+        )
+        inputData = asdict(self.inputData)
+        self.outputData = {
+            "transactions": [
+                {
+                    "transaction": document,
+                    "inputData": inputData,
+                    "outputData": {"periodCost": cost},
+                }
+                for document, cost in zip(documents, costs.tolist())
+            ],
+            "periodCost": float(costs.sum()),
+        }
+
+
+BUCKETS = {
+    "currency": "$currency",
+    "account": "$tinkData.accountId",
+    "oneOff": "$ecoData.oneOff",
+}
+
+
+def _days_between(startDate, endDate) -> Dict[str, Any]:
+    return {"$dateDiff": {"startDate": startDate, "endDate": endDate, "unit": "day"}}
+
+
+def period_cost_pipeline(
+    username: str,
+    startDate: str,
+    endDate: str,
+    groupBy: Optional[str] = None,
+    numeric: Optional[bool] = None,
+) -> List[Dict]:
+    """Aggregation computing the prorated period cost of each transaction server side
+
+    Numeric pipelines work on day ordinals and sum exact decimal amounts, only
+    the totals are converted to floats.
+    """
+    if numeric is None:
+        numeric = transactions_migrated()
+    if numeric:
+        periodStart, periodEnd = day_number(startDate), day_number(endDate)
+        amount = {"$divide": [{"$toDecimal": "$amountMinor"}, {"$pow": [{"$toDecimal": 10}, "$amountScale"]}]}
+        overlappingDays = {
+            "$subtract": [{"$min": [periodEnd, "$ecoData.endDay"]}, {"$max": [periodStart, "$ecoData.startDay"]}]
+        }
+        spreadDays = {"$subtract": ["$ecoData.endDay", "$ecoData.startDay"]}
+    else:
+        periodStart = datetime.fromisoformat(startDate)
+        periodEnd = datetime.fromisoformat(endDate)
+        spreadStart = {"$dateFromString": {"dateString": "$ecoData.startDate"}}
+        spreadEnd = {"$dateFromString": {"dateString": "$ecoData.endDate"}}
+        amount = "$amount"
+        overlappingDays = _days_between({"$max": [periodStart, spreadStart]}, {"$min": [periodEnd, spreadEnd]})
+        spreadDays = _days_between(spreadStart, spreadEnd)
+    # The $match stage already guarantees that one-off transactions fall in
+    # the period and that spread ones overlap it by at least one day.
+    spreadCost = {
+        "$divide": [
+            {"$multiply": [amount, {"$add": [overlappingDays, 1]}]},
+            {"$add": [spreadDays, 1]},
+        ]
+    }
+    return [
+        {"$match": period_query(username, startDate, endDate, numeric)},
+        {
+            "$project": {
+                "bucket": BUCKETS[groupBy] if groupBy else None,
+                "periodCost": {"$cond": ["$ecoData.oneOff", amount, spreadCost]},
+            }
+        },
+        {"$group": {"_id": "$bucket", "periodCost": {"$sum": "$periodCost"}}},
+        {"$set": {"periodCost": {"$toDouble": "$periodCost"}}},
+    ]
+
+
+def _cached(username, startDate, endDate, variant, compute):
+    """Result of compute, cached until any transaction of the user is written"""
+    key = cache_key("analytics", username, startDate, endDate, variant, get_data_version(username))
+    result = analytics_cache.get(key)
+    if result is None:
+        result = compute()
+        analytics_cache.set(key, result)
+    return result
+
+
+def get_period_cost(startDate, endDate, username, groupBy=None, engine="aggregate"):
+    """Total cost in the period, computed without shipping the transactions
+
+    The aggregate engine has MongoDB prorate and sum the matching transactions,
+    the rollup engine reads it off the daily rollups of the user.
+    """
+    logger.debug(f"Getting period cost for {username} between {startDate} and {endDate} by {groupBy} with {engine}")
+    if engine not in SUMMARY_ENGINES:
+        raise UnknownAnalyticsEngine(f"Unknown analytics engine {engine}")
+    if groupBy is not None and (groupBy not in BUCKETS or engine == "rollup"):
+        raise UnknownAnalyticsBucket(f"Unknown analytics bucket {groupBy}")
+
+    if engine == "rollup":
+        return {"periodCost": get_rolled_up_period_cost(startDate, endDate, username)}
+
+    def compute():
+        buckets = list(transactionsdb.aggregate(period_cost_pipeline(username, startDate, endDate, groupBy)))
+        result = {"periodCost": sum(bucket["periodCost"] for bucket in buckets)}
+        if groupBy:
+            result["buckets"] = {str(bucket["_id"]): bucket["periodCost"] for bucket in buckets}
+        return result
+
+    return _cached(username, startDate, endDate, ["summary", groupBy], compute)
+
+
+def iter_analytics(startDate, endDate, username, batchSize=STREAM_BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """Analysed transactions one by one, then the period cost, holding a single batch in memory"""
+    cursor = transactionsdb.find(period_query(username, startDate, endDate), batch_size=batchSize)
+    periodCost = 0.0
+    while documents := list(islice(cursor, batchSize)):
+        costs = TransactionColumns.from_documents(documents).get_cost_in_period(startDate, endDate)
+        periodCost += float(costs.sum())
+        for document, cost in zip(documents, costs.tolist()):
+            yield {"transaction": document, "outputData": {"periodCost": cost}}
+    yield {"periodCost": periodCost}
+
+
+SUMMARY_ENGINES = ["aggregate", "rollup"]
+
+ENGINES = {
+    "python": lambda inputData: asdict(Analytics(inputData).outputData),
+    "numpy": lambda inputData: VectorizedAnalytics(inputData).outputData,
+}
+
+
+def get_analytics(startDate, endDate, username, engine="python"):
     logger.debug(
-        "The get_analytics function was called with: startDate: {}, endDate: {}, username: {}".format(
-            startDate, endDate, username
+        "The get_analytics function was called with: startDate: {}, endDate: {}, username: {}, engine: {}".format(
+            startDate, endDate, username, engine
         )
     )
+    if engine not in ENGINES:
+        raise UnknownAnalyticsEngine(f"Unknown analytics engine {engine}")
+
     inputData = AnalyticsInputData(
         username=username,
         startDate=startDate,
         endDate=endDate,
     )
-    analytics = Analytics(inputData)
-    return asdict(analytics.outputData)
+    return _cached(username, startDate, endDate, ["full", engine], lambda: ENGINES[engine](inputData))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+import dataclasses
+import types
+from typing import Any, Callable, Dict, Tuple, Type, TypeVar, Union, get_args, get_origin, get_type_hints
+
+T = TypeVar("T")
+
+Decoder = Callable[[Dict[str, Any]], T]
+
+_decoders: Dict[Tuple[type, bool], Decoder] = {}
+
+
+class DecodingError(Exception):
+    pass
+
+
+def _optional(hint: Any) -> Tuple[Any, bool]:
+    """Type wrapped by Optional[...] and whether it was wrapped"""
+    if get_origin(hint) in (Union, types.UnionType):
+        args = [arg for arg in get_args(hint) if arg is not type(None)]
+        if len(args) == 1 and len(get_args(hint)) == 2:
+            return args[0], True
+    return hint, False
+
+
+def _field_specs(cls: type):
+    """(name, type, optional, has default, default factory) of every init field of a dataclass"""
+    hints = get_type_hints(cls)
+    for field in dataclasses.fields(cls):
+        if not field.init:
+            continue
+        hint, optional = _optional(hints[field.name])
+        if not isinstance(hint, type) and hint is not Any:
+            raise TypeError(f"Cannot decode {cls.__name__}.{field.name} of type {hint}")
+        if field.default is not dataclasses.MISSING:
+            yield field.name, hint, optional, True, lambda default=field.default: default
+        elif field.default_factory is not dataclasses.MISSING:
+            yield field.name, hint, optional, True, field.default_factory
+        else:
+            # Like dacite, an Optional field without a default may be missing
+            yield field.name, hint, optional, optional, lambda: None
+
+
+def _compile_fast(cls: type) -> Decoder:
+    """Generate a function building cls from a dict with no type checks at all"""
+    namespace = {"cls": cls}
+    arguments = []
+    for index, (name, hint, optional, hasDefault, default) in enumerate(_field_specs(cls)):
+        namespace[f"default{index}"] = default
+        if not dataclasses.is_dataclass(hint):
+            value = f"data[{name!r}]"
+            if hasDefault:
+                value = f"({value} if {name!r} in data else default{index}())"
+        else:
+            namespace[f"decode{index}"] = compile_decoder(hint)
+            value = f"decode{index}(data[{name!r}])"
+            if optional:
+                value = f"(None if data[{name!r}] is None else {value})"
+            if hasDefault:
+                value = f"({value} if {name!r} in data else default{index}())"
+        arguments.append(f"{name}={value}")
+
+    source = f"def decode(data):\n    return cls({', '.join(arguments)})\n"
+    exec(compile(source, f"<decoder for {cls.__name__}>", "exec"), namespace)
+    decode = namespace["decode"]
+    decode.__qualname__ = f"decode_{cls.__name__}"
+    return decode
+
+
+def _check(value: Any, hint: Any, path: str) -> None:
+    if hint is Any:
+        return
+    if hint is float:
+        # int is acceptable where a float is expected, bool is not
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif hint is int:
+        valid = isinstance(value, int) and not isinstance(value, bool)
+    else:
+        valid = isinstance(value, hint)
+    if not valid:
+        raise DecodingError(f"{path} should be {hint.__name__}, got {type(value).__name__}")
+
+
+def _compile_strict(cls: type, path: str = "") -> Decoder:
+    """Build cls from a dict, checking every field is present and of the declared type"""
+    prefix = path or cls.__name__
+    specs = []
+    for name, hint, optional, hasDefault, default in _field_specs(cls):
+        nested = _compile_strict(hint, f"{prefix}.{name}") if dataclasses.is_dataclass(hint) else None
+        specs.append((name, hint, optional, hasDefault, default, nested))
+
+    def decode(data):
+        if not isinstance(data, dict):
+            raise DecodingError(f"{prefix} should be a dict, got {type(data).__name__}")
+        kwargs = {}
+        for name, hint, optional, hasDefault, default, nested in specs:
+            if name not in data:
+                if not hasDefault:
+                    raise DecodingError(f"{prefix}.{name} is missing")
+                kwargs[name] = default()
+                continue
+            value = data[name]
+            if value is None and optional:
+                kwargs[name] = None
+            elif nested is not None:
+                kwargs[name] = nested(value)
+            else:
+                _check(value, hint, f"{prefix}.{name}")
+                kwargs[name] = value
+        return cls(**kwargs)
+
+    return decode
+
+
+def compile_decoder(cls: Type[T], strict: bool = False) -> Decoder:
+    """Decoder building instances of a dataclass from Mongo documents
+
+    Field types are resolved once, so decoding costs a plain function call per
+    nested dataclass. Fields of plain classes, Any, nested dataclasses and
+    Optional of those are supported, keys not matching a field are ignored.
+    The default decoder trusts the document, a strict one checks that fields
+    are present and of their declared types, raising DecodingError otherwise.
+    """
+    key = (cls, strict)
+    if key not in _decoders:
+        # Threads racing here compile twice but all end up with the stored decoder
+        _decoders.setdefault(key, _compile_strict(cls) if strict else _compile_fast(cls))
+    return _decoders[key]
@@ -0,0 +1,80 @@
+import logging
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Optional
+
+from cachetools.func import ttl_cache
+from pymongo import UpdateOne
+
+from ecobud.config import MIGRATION_BATCH_SIZE, MIGRATION_PAUSE
+from ecobud.connections.mongo import collections
+from ecobud.model.transactions import SCHEMA_VERSION, schema_fields, transactionsdb, version_query
+
+logger = logging.getLogger(__name__)
+
+# One document per migration, completedAt is set once every document was migrated
+migrationsdb = collections["migrations"]
+
+TRANSACTIONS_SCHEMA = f"transactions_v{SCHEMA_VERSION}"
+
+
+def migrate_transactions(
+    batchSize: int = MIGRATION_BATCH_SIZE,
+    pause: float = MIGRATION_PAUSE,
+    limit: Optional[int] = None,
+) -> int:
+    """Bring transactions written by older versions to the current schema, returns how many were migrated
+
+    Documents are streamed and updated batchSize at a time, sleeping pause
+    seconds in between to leave room to the live traffic. Every writer stores
+    the current schema or bumps the version of the document, so an update only
+    applies to a document still at an older schema and unchanged since it was
+    read, and never overwrites a concurrent edit. Passes are repeated until no
+    document is left at an older schema, then the migration is recorded as done.
+    """
+    outdated = {"schemaVersion": {"$ne": SCHEMA_VERSION}}
+    migrated = 0
+    while True:
+        cursor = transactionsdb.find(
+            outdated,
+            {"amount": 1, "amountMinor": 1, "amountScale": 1, "date": 1, "ecoData": 1, "version": 1},
+            batch_size=batchSize,
+        )
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        while documents := list(islice(cursor, batchSize)):
+            operations = [
+                UpdateOne(
+                    {"_id": document["_id"], **outdated, "version": version_query(document.get("version", 0))},
+                    {"$set": schema_fields(document)},
+                )
+                for document in documents
+            ]
+            migrated += transactionsdb.bulk_write(operations, ordered=False).modified_count
+            logger.debug(f"Migrated {migrated} transactions to schema version {SCHEMA_VERSION}")
+            time.sleep(pause)
+
+        # Documents written between their read and their update are left for another pass
+        if limit is not None or transactionsdb.find_one(outdated, {"_id": 1}) is None:
+            break
+
+    if limit is None:
+        migrationsdb.update_one(
+            {"_id": TRANSACTIONS_SCHEMA},
+            {"$set": {"completedAt": datetime.utcnow(), "migrated": migrated}},
+            upsert=True,
+        )
+    return migrated
+
+
+@ttl_cache(maxsize=1, ttl=60)
+def transactions_migrated() -> bool:
+    """Whether every transaction has the fields of the current schema, so queries may rely on them"""
+    return migrationsdb.find_one({"_id": TRANSACTIONS_SCHEMA, "completedAt": {"$exists": True}}) is not None
+
+
+if __name__ == "__main__":
+    print(migrate_transactions(limit=int(sys.argv[1]) if len(sys.argv) > 1 else None))
@@ -0,0 +1,108 @@
+import logging
+import sys
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from ecobud.connections.mongo import collections
+
+logger = logging.getLogger(__name__)
+
+# One document per user and day on which some transaction costs something:
+#   day         date.toordinal() of the day
+#   cost        amortized cost of the day, spread transactions count amount / days spread over
+# Days without a document cost nothing. Costs are only ever incremented, the
+# cost of a period is summed when it is read.
+rollupsdb = collections["daily_rollups"]
+transactionsdb = collections["transactions"]
+
+# (first day, last day, amount spread evenly over those days)
+Contribution = Tuple[int, int, float]
+
+
+def day_number(isoDate: str) -> int:
+    return date.fromisoformat(isoDate[:10]).toordinal()
+
+
+def contribution(transaction: Optional[Dict[str, Any]]) -> Optional[Contribution]:
+    """How a transaction document weighs on the daily costs, ignored ones do not"""
+    if not transaction or transaction.get("ignore"):
+        return None
+    ecoData = transaction["ecoData"]
+    if ecoData["oneOff"]:
+        day = transaction.get("day") or day_number(transaction["date"])
+        return day, day, transaction["amount"]
+    return (
+        ecoData.get("startDay") or day_number(ecoData["startDate"]),
+        ecoData.get("endDay") or day_number(ecoData["endDate"]),
+        transaction["amount"],
+    )
+
+
+def daily_costs(contributions: Iterable[Tuple[Contribution, int]]) -> Dict[int, float]:
+    """Change of the cost of each day, contributions are added or removed according to their sign"""
+    costs = defaultdict(float)
+    for (first, last, amount), sign in contributions:
+        cost = sign * amount / (last - first + 1)
+        for day in range(first, last + 1):
+            costs[day] += cost
+    return costs
+
+
+def apply_contributions(username: str, contributions: Iterable[Tuple[Contribution, int]]) -> None:
+    """Add (sign 1) or remove (sign -1) contributions from the rollups of the user
+
+    Only the costs of the days of the contributions change, each with an $inc
+    upsert, so concurrent writers of the same user need no coordination.
+    """
+    costs = daily_costs((c, sign) for c, sign in contributions if c is not None)
+    if not costs:
+        return
+    operations = [
+        UpdateOne(
+            {"username": username, "day": day},
+            {"$inc": {"cost": cost}, "$setOnInsert": {"date": date.fromordinal(day).isoformat()}},
+            upsert=True,
+        )
+        for day, cost in sorted(costs.items())
+    ]
+    rollupsdb.bulk_write(operations, ordered=False)
+    logger.debug(f"Updated {len(operations)} daily rollups for {username}")
+
+
+def get_rolled_up_period_cost(startDate: str, endDate: str, username: str) -> float:
+    """Period cost summed over the daily rollups of the period"""
+    pipeline = [
+        {"$match": {"username": username, "day": {"$gte": day_number(startDate), "$lte": day_number(endDate)}}},
+        {"$group": {"_id": None, "cost": {"$sum": "$cost"}}},
+    ]
+    result = list(rollupsdb.aggregate(pipeline))
+    return result[0]["cost"] if result else 0.0
+
+
+def rebuild_rollups(username: str) -> int:
+    """Recompute the rollups of a user from scratch, returns the number of days costing something"""
+    transactions = transactionsdb.find(
+        {"username": username, "ignore": {"$ne": True}},
+        {"amount": 1, "date": 1, "day": 1, "ecoData": 1, "ignore": 1},
+    )
+    costs = daily_costs((contribution(transaction), 1) for transaction in transactions)
+
+    documents = [
+        {"username": username, "day": day, "date": date.fromordinal(day).isoformat(), "cost": costs[day]}
+        for day in sorted(costs)
+    ]
+
+    rollupsdb.delete_many({"username": username})
+    if documents:
+        rollupsdb.insert_many(documents)
+    logger.debug(f"Rebuilt {len(documents)} daily rollups for {username}")
+    return len(documents)
+
+
+if __name__ == "__main__":
+    usernames = sys.argv[1:] or transactionsdb.distinct("username")
+    for username in usernames:
+        print(username, rebuild_rollups(username))
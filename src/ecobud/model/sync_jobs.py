@@ -0,0 +1,107 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+
+from ecobud.config import SYNC_LEASE_SECONDS
+from ecobud.connections.mongo import collections
+
+logger = logging.getLogger(__name__)
+
+# One document per user, keyed by username:
+#   pending       a sync has been requested since the last one started
+#   notBefore     the pending sync should not start before then, to let bursts of requests coalesce
+#   full          the requested sync should disregard the stored sync state
+#   allAccounts   the requested sync covers every account of the user
+#   accountIds    otherwise, the accounts the requested sync is limited to
+#   runningUntil  lease of the worker currently syncing the user, None when idle
+#   claimed       the requested flags the running sync was claimed with, kept until it finishes
+syncjobsdb = collections["sync_jobs"]
+
+REQUESTED_FLAGS = {"full": False, "allAccounts": False, "accountIds": []}
+
+
+def enqueue_sync(username: str, full: bool = False, accountId: Optional[str] = None, delay: float = 0) -> None:
+    """Request a sync for the user, coalescing with any request not yet picked up
+
+    A request for a single account only adds it to the accounts of the pending
+    sync. The pending sync starts at the earliest notBefore requested, so
+    requests arriving within delay of the first one all share its run.
+    """
+    now = datetime.utcnow()
+    update = {
+        "$set": {"pending": True, "requestedAt": now},
+        "$min": {"notBefore": now + timedelta(seconds=delay)},
+        "$max": {"full": full, "allAccounts": accountId is None},
+        "$setOnInsert": {"runningUntil": None},
+    }
+    if accountId is not None:
+        update["$addToSet"] = {"accountIds": accountId}
+
+    syncjobsdb.update_one({"_id": username}, update, upsert=True)
+    logger.debug(f"Enqueued sync for {username}, account: {accountId}, delay: {delay}")
+
+
+def claim_sync_job(worker: str) -> Optional[Dict[str, Any]]:
+    """Lease the next due job, or one whose previous worker lost its lease
+
+    The requested flags move to claimed, so that a worker reclaiming the job
+    after a lost lease still runs everything the lost run was asked for, along
+    with whatever was requested since.
+    """
+    now = datetime.utcnow()
+    lease = {
+        "pending": False,
+        "runningUntil": now + timedelta(seconds=SYNC_LEASE_SECONDS),
+        "worker": worker,
+        "startedAt": now,
+    }
+    claimed = {
+        "full": {"$or": ["$full", "$claimed.full"]},
+        "allAccounts": {"$or": ["$allAccounts", "$claimed.allAccounts"]},
+        "accountIds": {"$setUnion": [{"$ifNull": ["$accountIds", []]}, {"$ifNull": ["$claimed.accountIds", []]}]},
+    }
+    job = syncjobsdb.find_one_and_update(
+        {
+            "$or": [
+                {"pending": True, "runningUntil": None, "notBefore": {"$lte": now}},
+                {"runningUntil": {"$lt": now}},
+            ]
+        },
+        [
+            {"$set": {"claimed": claimed}},
+            {"$set": {key: {"$literal": value} for key, value in {**lease, **REQUESTED_FLAGS}.items()}},
+            {"$unset": ["notBefore"]},
+        ],
+        sort=[("notBefore", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        return None
+    return {**job, **job["claimed"]}
+
+
+def renew_sync_job(job: Dict[str, Any]) -> bool:
+    """Extend the lease of a running job, False when the worker no longer holds it"""
+    result = syncjobsdb.update_one(
+        {"_id": job["_id"], "worker": job["worker"], "startedAt": job["startedAt"]},
+        {"$set": {"runningUntil": datetime.utcnow() + timedelta(seconds=SYNC_LEASE_SECONDS)}},
+    )
+    return result.matched_count == 1
+
+
+def finish_sync_job(job: Dict[str, Any], result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+    """Release the lease and record the outcome of the run"""
+    syncjobsdb.update_one(
+        {"_id": job["_id"], "worker": job["worker"], "startedAt": job["startedAt"]},
+        {
+            "$set": {
+                "runningUntil": None,
+                "finishedAt": datetime.utcnow(),
+                "result": result,
+                "error": error,
+            },
+            "$unset": {"claimed": ""},
+        },
+    )
@@ -1,33 +1,89 @@
+import base64
+import json
 import logging
-from dataclasses import asdict, dataclass
+import uuid
+from contextlib import closing
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
-from multiprocessing import Process
-from typing import Any, Dict, Optional, Tuple
-
-from dacite import from_dict
-
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from ecobud.config import (
+    STREAM_BATCH_SIZE,
+    SYNC_MAX_PAGES,
+    TRANSACTIONS_MAX_BATCH_SIZE,
+    TRANSACTIONS_MAX_SPREAD_DAYS,
+    TRANSACTIONS_PAGE_SIZE,
+)
 from ecobud.connections.mongo import collections
-from ecobud.connections.tink import get_user_transactions
+from ecobud.connections.tink import iter_user_transaction_pages
+from ecobud.model.decoding import compile_decoder
+from ecobud.model.rollups import apply_contributions, contribution, day_number
+from ecobud.model.versions import bump_data_version
 
 transactionsdb = collections["transactions"]
+syncstatedb = collections["sync_state"]
+
+TRANSACTIONS_ORDER = [("date", -1), ("_id", -1)]
+
+# Fields left out of transaction lists unless the full documents are asked for
+LIST_PROJECTION = {"description.detailed": 0, "tinkData": 0, "editTokens": 0}
+
+# How many of the most recently fetched transactions have their status remembered
+LAST_SEEN_LIMIT = 500
+
+# Version 2 keeps, next to the ISO dates and float amount of version 1:
+#   amountMinor, amountScale   the amount as an exact integer, amount = amountMinor / 10**amountScale
+#   day                        date.toordinal() of date
+#   ecoData.startDay/endDay    date.toordinal() of ecoData.startDate/endDate
+SCHEMA_VERSION = 2
+
+# Fields a user can change through edit_transactions, top level ones or of an embedded document
+EDITABLE_FIELDS = {
+    "ignore": None,
+    "ecoData": {"oneOff", "startDate", "endDate"},
+    "description": {"user"},
+}
+
+# Tokens of the latest edit_transactions calls applied to a transaction, telling which edits of a batch matched
+EDIT_TOKENS_KEPT = 16
+
+# What edit_transactions needs of the previous documents to update the rollups
+EDIT_PROJECTION = {"amount": 1, "date": 1, "day": 1, "ignore": 1, "ecoData": 1, "version": 1}
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+class InvalidCursor(Exception):
+    pass
+
+
+class InvalidTransactionChanges(Exception):
+    pass
+
+
+class TransactionsNotFound(Exception):
+    pass
+
+
+@dataclass(slots=True)
 class TinkTransactionData:
     status: str
     accountId: str
 
 
-@dataclass
+@dataclass(slots=True)
 class TransactionEcoData:
     oneOff: bool = True
     startDate: Optional[str] = None
     endDate: Optional[str] = None
+    startDay: Optional[int] = None
+    endDay: Optional[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class TransactionDescription:
     detailed: Optional[str]
     display: Optional[str]
@@ -62,7 +118,7 @@ class TransactionDescription:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Transaction:
     username: str
     _id: str
@@ -73,6 +129,12 @@ class Transaction:
     ecoData: TransactionEcoData
     tinkData: TinkTransactionData
     ignore: bool = False
+    amountMinor: Optional[int] = None
+    amountScale: Optional[int] = None
+    day: Optional[int] = None
+    schemaVersion: int = 1
+    # Bumped by every write, edits only apply to the version they were made on
+    version: int = 0
 
     @classmethod
     def from_tink(
@@ -83,9 +145,9 @@ class Transaction:
         """Create a transaction from a Tink payload"""
 
         _id = payload["id"]
-        unscaledValue = payload["amount"]["value"]["unscaledValue"]
-        scale = payload["amount"]["value"]["scale"]
-        amount = float(unscaledValue) / (10 ** int(scale))
+        unscaledValue = int(payload["amount"]["value"]["unscaledValue"])
+        scale = int(payload["amount"]["value"]["scale"])
+        amount = float(unscaledValue) / (10**scale)
         currency = payload["amount"]["currencyCode"]
         transactionDate = payload["dates"]["booked"]
 
@@ -106,57 +168,281 @@ class Transaction:
             description=description,
             ecoData=ecoData,
             tinkData=tinkData,
+            amountMinor=unscaledValue,
+            amountScale=scale,
+            day=day_number(transactionDate),
+            schemaVersion=SCHEMA_VERSION,
         )
 
     @classmethod
-    def from_dict(cls, payload: Dict[str, Any]) -> "Transaction":
-        return from_dict(data_class=Transaction, data=payload)
+    def from_dict(cls, payload: Dict[str, Any], strict: bool = False) -> "Transaction":
+        """Create a transaction from a Mongo document, checking field types when strict"""
+        return compile_decoder(cls, strict=strict)(payload)
+
+
+def minor_units(amount: float) -> Tuple[int, int]:
+    """Shortest (unscaled value, scale) pair of the decimal the float prints as"""
+    value = Decimal(repr(amount)).normalize()
+    exponent = value.as_tuple().exponent
+    if exponent >= 0:
+        return int(value), 0
+    return int(value.scaleb(-exponent)), -exponent
+
+
+def schema_fields(transaction: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields of the current schema version, derived from the version 1 fields of a document
+
+    Exact amounts already stored are kept as long as they still match the
+    float amount, so that the scale Tink reported is not lost.
+    """
+    amountMinor = transaction.get("amountMinor")
+    amountScale = transaction.get("amountScale")
+    if amountMinor is None or amountScale is None or amountMinor / 10**amountScale != transaction["amount"]:
+        amountMinor, amountScale = minor_units(transaction["amount"])
+    ecoData = transaction["ecoData"]
+    return {
+        "amountMinor": amountMinor,
+        "amountScale": amountScale,
+        "day": day_number(transaction["date"]),
+        "ecoData": {
+            **ecoData,
+            "startDay": day_number(ecoData["startDate"]) if ecoData.get("startDate") else None,
+            "endDay": day_number(ecoData["endDate"]) if ecoData.get("endDate") else None,
+        },
+        "schemaVersion": SCHEMA_VERSION,
+    }
+
+
+@dataclass
+class SyncResult:
+    """Outcome of writing a batch of Tink transactions"""
+
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    def __add__(self, other: "SyncResult") -> "SyncResult":
+        return SyncResult(
+            inserted=self.inserted + other.inserted,
+            updated=self.updated + other.updated,
+            unchanged=self.unchanged + other.unchanged,
+        )
+
+
+def _ingest_operations(transaction: Transaction) -> Tuple[UpdateOne, UpdateOne]:
+    """Insert the transaction if absent, otherwise only refresh its tinkData, bumping its version if it changed
+
+    Whichever order the two operations run in, a new transaction is inserted
+    with the Tink data and an existing one is updated at most once.
+    """
+    document = asdict(transaction)
+    tinkData = document["tinkData"]
+    key = {
+        "_id": document.pop("_id"),
+        "username": document.pop("username"),
+    }
+    return (
+        UpdateOne(key, {"$setOnInsert": {**document, "version": 1}}, upsert=True),
+        UpdateOne(
+            {**key, "tinkData": {"$ne": tinkData}},
+            {"$set": {"tinkData": tinkData}, "$inc": {"version": 1}},
+        ),
+    )
+
+
+def ingest_tink_transactions(
+    username: str,
+    payloads: Iterable[Dict[str, Any]],
+    ordered: bool = False,
+) -> SyncResult:
+    """Write a page of Tink payloads with a single bulk_write"""
+    transactions = [Transaction.from_tink(username, payload) for payload in payloads]
+    operations = [operation for transaction in transactions for operation in _ingest_operations(transaction)]
+    if not operations:
+        return SyncResult()
+
+    result = transactionsdb.bulk_write(operations, ordered=ordered)
+    apply_contributions(
+        username,
+        [(contribution(asdict(transactions[index // 2])), 1) for index in result.upserted_ids],
+    )
+    inserted = result.upserted_count
+    updated = result.modified_count
+    logger.debug(f"Ingested {len(transactions)} transactions for {username}: {inserted} new, {updated} updated")
+    return SyncResult(
+        inserted=inserted,
+        updated=updated,
+        unchanged=len(transactions) - inserted - updated,
+    )
+
+
+@dataclass
+class SyncState:
+    """Where the previous syncs of a user got to"""
+
+    lastBookedDate: Optional[str] = None
+    lastSeen: Dict[str, str] = field(default_factory=dict)
+    backfillPageToken: Optional[str] = None
+
+
+def get_sync_state(username: str) -> SyncState:
+    document = syncstatedb.find_one({"_id": username}) or {}
+    return SyncState(
+        lastBookedDate=document.get("lastBookedDate"),
+        lastSeen=document.get("lastSeen", {}),
+        backfillPageToken=document.get("backfillPageToken"),
+    )
+
+
+def save_sync_state(username: str, state: SyncState) -> None:
+    syncstatedb.replace_one(
+        {"_id": username},
+        {"_id": username, **asdict(state), "syncedAt": datetime.utcnow()},
+        upsert=True,
+    )
+
+
+def _sync_page(username: str, payloads: List[Dict[str, Any]], lastSeen: Dict[str, str]) -> SyncResult:
+    """Write the transactions of a page, skipping the ones last seen with the same status"""
+    changed = [payload for payload in payloads if lastSeen.get(payload["id"]) != payload["status"]]
+    result = ingest_tink_transactions(username, changed)
+    result.unchanged += len(payloads) - len(changed)
+    return result
 
 
 def sync_transactions(
     username: str,
-    noPages: int = 1,
-) -> Dict[str, Any]:
-    transactions = get_user_transactions(username, noPages=noPages)
-    cnt = 0
-    for transaction_dict in transactions:
-        tinkTransaction = Transaction.from_tink(username, transaction_dict)
-        existing = transactionsdb.find_one(
-            {
-                "_id": tinkTransaction._id,
-                "username": tinkTransaction.username,
-            },
-        )
+    noPages: int = SYNC_MAX_PAGES,
+    full: bool = False,
+    accountIds: Optional[List[str]] = None,
+) -> SyncResult:
+    """Sync the newest transactions until reaching already stored ones, then resume any unfinished backfill
+
+    At most noPages Tink pages are fetched per call, a walk cut short by that
+    limit is resumed by the next call. A full sync disregards the stored state
+    and walks the history again from the newest page. A sync limited to some
+    accounts only walks their newest transactions and leaves the backfill be.
+    """
+    state = SyncState() if full else get_sync_state(username)
+    result = SyncResult()
+    seen = {}
+    pages = 0
+    # A page write that raised may still have written part of the page
+    writing = False
+
+    def walk(pageToken, stopWhenKnown):
+        """Returns the token of the next page (None once history is exhausted) and whether the walk completed"""
+        nonlocal result, pages, writing
+        if pages >= noPages:
+            return pageToken, False
+
+        with closing(
+            iter_user_transaction_pages(username, pageToken, accountIds=accountIds, noPages=noPages - pages)
+        ) as tinkPages:
+            for page in tinkPages:
+                pages += 1
+                payloads = page["transactions"]
+                writing = True
+                pageResult = _sync_page(username, payloads, state.lastSeen)
+                writing = False
+                result += pageResult
+                seen.update((payload["id"], payload["status"]) for payload in payloads)
+                for payload in payloads:
+                    booked = payload["dates"].get("booked")
+                    if booked and (state.lastBookedDate is None or booked > state.lastBookedDate):
+                        state.lastBookedDate = booked
+
+                pageToken = page.get("nextPageToken")
+                if not pageToken:
+                    return None, True
+                if stopWhenKnown and pageResult.inserted == pageResult.updated == 0:
+                    return pageToken, True
+        return pageToken, False
+
+    try:
+        pageToken, caughtUp = walk(None, stopWhenKnown=not full)
+        # Page tokens of a walk limited to some accounts cannot resume a walk over all of them
+        if not accountIds:
+            if pageToken is None:
+                state.backfillPageToken = None
+            elif not caughtUp:
+                state.backfillPageToken = pageToken
+            elif state.backfillPageToken:
+                state.backfillPageToken, _ = walk(state.backfillPageToken, stopWhenKnown=False)
+
+        for _id, status in state.lastSeen.items():
+            if len(seen) >= LAST_SEEN_LIMIT:
+                break
+            seen.setdefault(_id, status)
+        state.lastSeen = dict(list(seen.items())[:LAST_SEEN_LIMIT])
+        save_sync_state(username, state)
+    finally:
+        # Pages already written by a sync that fails later must still reach the readers
+        if writing or result.inserted or result.updated:
+            bump_data_version(username)
+
+    logger.debug(f"Synced {pages} pages for {username}: {result}")
+    return result
+
+
+def encode_cursor(transaction: Dict[str, Any]) -> str:
+    """Opaque token pointing just past the transaction in the (date, _id) ordering"""
+    return base64.urlsafe_b64encode(json.dumps([transaction["date"], transaction["_id"]]).encode("utf-8")).decode(
+        "ascii"
+    )
 
-        if existing:
-            existingTransaction = Transaction.from_dict(existing)
-            existingTransaction.tinkData = tinkTransaction.tinkData
-            transactionsdb.find_one_and_replace(
-                {
-                    "_id": tinkTransaction._id,
-                    "username": tinkTransaction.username,
-                },
-                asdict(existingTransaction),
-                upsert=False,
-            )
 
-        else:
-            transactionsdb.insert_one(asdict(tinkTransaction))
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        date, _id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise InvalidCursor(f"Invalid cursor {cursor}")
+    return date, _id
+
 
-        cnt += 1
-    return True
+def _transactions_query(username: str, cursor: Optional[str]) -> Dict[str, Any]:
+    query = {"username": username, "ignore": False}
+    if cursor:
+        date, _id = decode_cursor(cursor)
+        query["$or"] = [{"date": {"$lt": date}}, {"date": date, "_id": {"$lt": _id}}]
+    return query
 
 
-def get_transactions(username: str) -> Dict[str, Any]:
-    async_process = Process(
-        target=sync_transactions,
-        args=(username,),
-        daemon=True,
+def get_transactions(
+    username: str,
+    pageSize: int = TRANSACTIONS_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    full: bool = False,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Page of transactions, newest first, and the cursor of the next page if there is one
+
+    Pages are delimited by the (date, _id) of their last transaction rather than
+    an offset, so every page is an index range scan however deep it is.
+    """
+    transactions = list(
+        transactionsdb.find(_transactions_query(username, cursor), None if full else LIST_PROJECTION)
+        .sort(TRANSACTIONS_ORDER)
+        .limit(pageSize + 1)
     )
-    async_process.start()
+    if len(transactions) > pageSize:
+        transactions = transactions[:pageSize]
+        return transactions, encode_cursor(transactions[-1])
+    return transactions, None
+
+
+def iter_transactions(
+    username: str,
+    cursor: Optional[str] = None,
+    full: bool = False,
+    batchSize: int = STREAM_BATCH_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """Every transaction past the cursor in the get_transactions order, fetched batchSize at a time"""
+    return transactionsdb.find(
+        _transactions_query(username, cursor),
+        None if full else LIST_PROJECTION,
+        batch_size=batchSize,
+    ).sort(TRANSACTIONS_ORDER)
 
-    transactions = list(transactionsdb.find({"username": username, "ignore": False}).sort("date", -1).limit(100))
-    return transactions
 
 def get_specific_transaction(username: str, _id: str) -> Dict[str, Any]:
     logger.debug(f"Getting transaction {_id} for {username}")
@@ -165,18 +451,171 @@ def get_specific_transaction(username: str, _id: str) -> Dict[str, Any]:
     return transaction
 
 
+def version_query(version: int) -> Dict[str, Any]:
+    # Transactions written before versions were introduced have none
+    return {"$in": [0, None]} if version == 0 else version
+
+
 def update_transaction(transaction: Dict[str, Any]) -> bool:
-    transactionsdb.find_one_and_replace(
-        {
-            "_id": transaction["_id"],
-            "username": transaction["username"],
-        },
-        transaction,
-        upsert=False,
-    )
-    logger.debug(f"Finished mongo interaction for transaction {transaction['_id']}")
-    return True
+    """Save the fields a user can edit of a transaction sent back whole, returns False if it is missing or
+    was written since its version
+
+    Every other field, tinkData included, is kept as stored: clients send back
+    transactions from lists, which leave some fields out.
+    """
+    changes = {
+        name: transaction[name] for name in EDITABLE_FIELDS if EDITABLE_FIELDS[name] is None and name in transaction
+    }
+    for name, keys in EDITABLE_FIELDS.items():
+        value = transaction.get(name)
+        if keys is not None and isinstance(value, dict) and keys & set(value):
+            changes[name] = {key: value[key] for key in keys if key in value}
+    edit = {"_id": transaction["_id"], "changes": changes}
+    if transaction.get("version") is not None:
+        edit["version"] = transaction["version"]
+    try:
+        result = edit_transactions(transaction["username"], [edit])
+    except TransactionsNotFound:
+        logger.debug(f"Transaction {transaction['_id']} not found")
+        return False
+    return not result["conflicts"]
+
+
+def change_fields(changes: Dict[str, Any]) -> Dict[str, Any]:
+    """$set of the changes to a transaction, with the day ordinals of the changed dates"""
+    if not isinstance(changes, dict) or not changes:
+        raise InvalidTransactionChanges(f"Changes should be a non empty object, got {changes}")
+    fields = {}
+    for name, value in changes.items():
+        if name not in EDITABLE_FIELDS:
+            raise InvalidTransactionChanges(f"{name} cannot be changed")
+        if EDITABLE_FIELDS[name] is None:
+            fields[name] = value
+            continue
+        if not isinstance(value, dict) or not set(value) <= EDITABLE_FIELDS[name]:
+            raise InvalidTransactionChanges(f"Only {', '.join(sorted(EDITABLE_FIELDS[name]))} of {name} can be changed")
+        fields.update((f"{name}.{key}", subvalue) for key, subvalue in value.items())
+
+    if "ignore" in fields and not isinstance(fields["ignore"], bool):
+        raise InvalidTransactionChanges("ignore should be a boolean")
+    if "ecoData.oneOff" in fields and not isinstance(fields["ecoData.oneOff"], bool):
+        raise InvalidTransactionChanges("ecoData.oneOff should be a boolean")
+    for bound in ("start", "end"):
+        if f"ecoData.{bound}Date" in fields:
+            isoDate = fields[f"ecoData.{bound}Date"]
+            try:
+                fields[f"ecoData.{bound}Day"] = day_number(isoDate) if isoDate is not None else None
+            except (TypeError, ValueError):
+                raise InvalidTransactionChanges(f"Invalid ecoData.{bound}Date {isoDate}")
+    return fields
+
+
+def check_spread(_id: str, ecoData: Dict[str, Any]) -> None:
+    """Raise unless a spread transaction ends after it starts and spans at most TRANSACTIONS_MAX_SPREAD_DAYS"""
+    if ecoData.get("oneOff", True):
+        return
+    try:
+        first, last = day_number(ecoData["startDate"]), day_number(ecoData["endDate"])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidTransactionChanges(f"Transaction {_id} cannot be spread without start and end dates")
+    if last < first:
+        raise InvalidTransactionChanges(f"Transaction {_id} cannot be spread over a period ending before it starts")
+    if last - first + 1 > TRANSACTIONS_MAX_SPREAD_DAYS:
+        raise InvalidTransactionChanges(
+            f"Transaction {_id} cannot be spread over more than {TRANSACTIONS_MAX_SPREAD_DAYS} days"
+        )
 
 
-if __name__ == "__main__":
-    print(sync_transactions("test0"))
+def _apply_fields(transaction: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of the transaction with a $set applied"""
+    transaction = {**transaction, "ecoData": dict(transaction["ecoData"])}
+    for path, value in fields.items():
+        name, _, key = path.partition(".")
+        if key == "":
+            transaction[name] = value
+        elif name == "ecoData":
+            transaction["ecoData"][key] = value
+    return transaction
+
+
+def edit_transactions(username: str, edits: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Apply changes to many transactions of the user with a single bulk_write
+
+    Each edit is {"_id", "changes", "version"}, changes being the fields to set
+    and version the one the changes were made on, by default the current one.
+    Edits of a transaction written since that version, for instance by a sync,
+    are not applied and returned as conflicts. The whole batch is rejected if
+    any edit is invalid or any transaction is not the user's.
+    """
+    if not 0 < len(edits) <= TRANSACTIONS_MAX_BATCH_SIZE:
+        raise InvalidTransactionChanges(f"Between 1 and {TRANSACTIONS_MAX_BATCH_SIZE} edits can be made at once")
+    try:
+        ids = [edit["_id"] for edit in edits]
+        fields = [change_fields(edit["changes"]) for edit in edits]
+        unique = len(set(ids)) == len(ids)
+    except (KeyError, TypeError):
+        raise InvalidTransactionChanges("Every edit should have an _id and changes")
+    if not unique:
+        raise InvalidTransactionChanges("Every transaction can only be edited once per batch")
+
+    previous = {
+        transaction["_id"]: transaction
+        for transaction in transactionsdb.find({"username": username, "_id": {"$in": ids}}, EDIT_PROJECTION)
+    }
+    missing = [_id for _id in ids if _id not in previous]
+    if missing:
+        raise TransactionsNotFound(f"Transactions {', '.join(missing)} not found")
+
+    token = uuid.uuid4().hex
+    operations = []
+    edited = []
+    for edit, editFields in zip(edits, fields):
+        transaction = previous[edit["_id"]]
+        version = edit.get("version", transaction.get("version", 0))
+        if not isinstance(version, int):
+            raise InvalidTransactionChanges(f"Invalid version {version}")
+        after = _apply_fields(transaction, editFields)
+        check_spread(edit["_id"], after["ecoData"])
+        operations.append(
+            UpdateOne(
+                {"_id": edit["_id"], "username": username, "version": version_query(version)},
+                {
+                    "$set": editFields,
+                    "$inc": {"version": 1},
+                    "$push": {"editTokens": {"$each": [token], "$slice": -EDIT_TOKENS_KEPT}},
+                },
+            )
+        )
+        edited.append((transaction, after, editFields))
+
+    result = transactionsdb.bulk_write(operations, ordered=False)
+    applied = edited
+    if result.matched_count < len(operations):
+        applied = _applied_edits(username, edited, token)
+    conflicts = sorted(set(ids) - {transaction["_id"] for transaction, _, _ in applied})
+
+    apply_contributions(
+        username,
+        [
+            change
+            for before, after, _ in applied
+            if contribution(before) != contribution(after)
+            for change in ((contribution(before), -1), (contribution(after), 1))
+        ],
+    )
+    if applied:
+        bump_data_version(username)
+    logger.debug(f"Edited {len(applied)} transactions of {username}, {len(conflicts)} conflicts")
+    return {"updated": [transaction["_id"] for transaction, _, _ in applied], "conflicts": conflicts}
+
+
+def _applied_edits(username: str, edited: List[Tuple[Dict, Dict, Dict]], token: str) -> List[Tuple[Dict, Dict, Dict]]:
+    """Edits of the batch that matched their version, found by the token they pushed"""
+    matched = {
+        transaction["_id"]
+        for transaction in transactionsdb.find(
+            {"username": username, "_id": {"$in": [before["_id"] for before, _, _ in edited]}, "editTokens": token},
+            {"_id": 1},
+        )
+    }
+    return [edit for edit in edited if edit[0]["_id"] in matched]
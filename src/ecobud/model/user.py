@@ -1,11 +1,22 @@
 import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
 
-import bcrypt
 import requests as re
-
-from ecobud.config import SELF_BASE_URL
+from cachetools import TTLCache
+from pymongo.errors import OperationFailure, PyMongoError
+
+from ecobud.config import (
+    SELF_BASE_URL,
+    USER_CACHE_NEGATIVE_TTL,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    USER_CACHE_WATCH,
+)
 from ecobud.connections import tink
 from ecobud.connections.mongo import collections
+from ecobud.passwords import PasswordHasherBusy, hasher
 from ecobud.utils import curl, fmt_response
 
 logger = logging.getLogger(__name__)
@@ -37,18 +48,15 @@ def create_user(username, email, password):
     except UserNotFound:
         pass
 
+    # Hashed first, so a busy hasher fails the request before a Tink user is created
+    encrypted_password = hasher.hash(password)
+
     try:
         tink_user_id = tink.create_user(username)
     except TinkUserAlreadyExists:
         logger.debug(f"User {username} already exists in Tink")
         tink_user_id = tink.get_user(username)["id"]
 
-    salt = bcrypt.gensalt()
-    encrypted_password = bcrypt.hashpw(
-        password.encode("utf-8"),
-        salt,
-    ).decode("utf-8")
-
     user = {
         "username": username,
         "email": email,
@@ -59,6 +67,7 @@ def create_user(username, email, password):
 
     logger.debug(f"Saving user {username}")
     usersdb.insert_one(user)
+    directory.invalidate(username)
     logger.debug(f"User {username} created")
     return True
 
@@ -67,15 +76,152 @@ def login_user(username, password):
     logger.debug(f"Logging in user {username}")
     user = _get_user(username)
 
-    encrypted_password = user["password"].encode("utf-8")
-    if not bcrypt.checkpw(password.encode("utf-8"), encrypted_password):
+    encrypted_password = user["password"]
+    if not hasher.check(password, encrypted_password):
         logger.debug(f"Wrong password for user {username}")
         raise WrongPassword(f"Wrong password for user {username}")
 
+    if hasher.needs_rehash(encrypted_password):
+        _rehash_password(user, password)
+
+
+def _rehash_password(user, password):
+    """Store the password hashed with the current work factor, unless it changed meanwhile"""
+    try:
+        encrypted_password = hasher.hash(password)
+    except PasswordHasherBusy:
+        logger.debug(f"Not rehashing the password of {user['username']}, the hasher is busy")
+        return
+    usersdb.update_one(
+        {"username": user["username"], "password": user["password"]},
+        {"$set": {"password": encrypted_password}},
+    )
+    directory.invalidate(user["username"])
+    logger.debug(f"Rehashed the password of {user['username']}")
+
+
+class UserDirectory:
+    """Per-process cache of user documents, including the users found not to exist
+
+    Users are kept for ttl seconds and unknown usernames for negativeTtl. With
+    watch, a change stream on the collection evicts users as soon as they are
+    written anywhere. Change streams need a replica set, without one entries
+    only expire.
+    """
+
+    def __init__(self, collection, maxsize: int, ttl: float, negativeTtl: float, watch: bool = True):
+        self.collection = collection
+        self.watch = watch
+        self._users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._unknown = TTLCache(maxsize=maxsize, ttl=negativeTtl)
+        self._lock = threading.Lock()
+        self._watcher = None
+        # Invalidations of each username being read from the collection, so a
+        # read that raced with one is not cached. Entries only live while a read
+        # is in flight, and clear bumps the epoch for every username at once.
+        self._reading: Dict[str, int] = {}
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+
+    def get(self, username: str) -> Optional[Dict[str, Any]]:
+        self._start_watching()
+        with self._lock:
+            if username in self._unknown:
+                return None
+            user = self._users.get(username)
+            if user is None:
+                self._reading[username] = self._reading.get(username, 0) + 1
+                generation = (self._epoch, self._generations.get(username, 0))
+        if user is None:
+            user = self._read(username, generation)
+        return dict(user) if user is not None else None
+
+    def _read(self, username: str, generation: Tuple[int, int]) -> Optional[Dict[str, Any]]:
+        """Read the user and cache it, unless it was invalidated meanwhile"""
+        try:
+            user = self.collection.find_one({"username": username})
+        except Exception:
+            with self._lock:
+                self._done_reading(username)
+            raise
+        with self._lock:
+            if (self._epoch, self._generations.get(username, 0)) != generation:
+                logger.debug(f"User {username} changed while being read, not caching it")
+            elif user is None:
+                self._unknown[username] = True
+            else:
+                self._users[username] = user
+            self._done_reading(username)
+        return user
+
+    def _done_reading(self, username: str) -> None:
+        self._reading[username] -= 1
+        if not self._reading[username]:
+            del self._reading[username]
+            self._generations.pop(username, None)
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._users.pop(username, None)
+            self._unknown.pop(username, None)
+            if username in self._reading:
+                self._generations[username] = self._generations.get(username, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+            self._unknown.clear()
+            self._epoch += 1
+
+    def apply_change(self, event: Dict[str, Any]) -> None:
+        """Evict the user a change stream event is about"""
+        document = event.get("fullDocument")
+        if document:
+            self.invalidate(document["username"])
+            return
+        # Deletions only tell the _id of the document
+        _id = event.get("documentKey", {}).get("_id")
+        with self._lock:
+            usernames = [username for username, user in self._users.items() if user["_id"] == _id]
+        for username in usernames:
+            self.invalidate(username)
+
+    def _start_watching(self) -> None:
+        if not self.watch or self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="user-directory", daemon=True)
+                self._watcher.start()
+
+    def _watch(self) -> None:
+        while True:
+            try:
+                with self.collection.watch(full_document="updateLookup") as stream:
+                    # Changes missed while the stream was down are unknown
+                    self.clear()
+                    for event in stream:
+                        self.apply_change(event)
+            except OperationFailure as e:
+                logger.info(f"Not watching users, entries will only expire: {e}")
+                return
+            except PyMongoError as e:
+                logger.warning(f"User change stream interrupted, restarting: {e}")
+                time.sleep(1)
+
+
+directory = UserDirectory(
+    usersdb,
+    maxsize=USER_CACHE_SIZE,
+    ttl=USER_CACHE_TTL,
+    negativeTtl=USER_CACHE_NEGATIVE_TTL,
+    watch=USER_CACHE_WATCH,
+)
+
 
 def _get_user(username):
     logger.debug(f"Getting user {username}")
-    user = usersdb.find_one({"username": username})
+    user = directory.get(username)
     if user is None:
         raise UserNotFound(f"User {username} not found")
     return user
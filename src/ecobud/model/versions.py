@@ -0,0 +1,18 @@
+import logging
+
+from ecobud.connections.mongo import collections
+
+logger = logging.getLogger(__name__)
+
+# One counter per user, bumped whenever any of their transactions is written
+versionsdb = collections["data_versions"]
+
+
+def get_data_version(username: str) -> int:
+    document = versionsdb.find_one({"_id": username})
+    return document["version"] if document else 0
+
+
+def bump_data_version(username: str) -> None:
+    versionsdb.update_one({"_id": username}, {"$inc": {"version": 1}}, upsert=True)
+    logger.debug(f"Bumped data version of {username}")
@@ -0,0 +1,42 @@
+import logging
+from typing import Any, Dict
+
+from ecobud.config import SYNC_DEBOUNCE_SECONDS
+from ecobud.model.sync_jobs import enqueue_sync
+from ecobud.model.user import UserNotFound, _get_user
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONS_MODIFIED = "account-transactions:modified"
+
+
+class InvalidWebhookEvent(Exception):
+    pass
+
+
+def handle_tink_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Schedule a debounced sync of the account whose transactions changed
+
+    Tink users are created with our username as their external user id, so the
+    event context maps straight back to the user.
+    """
+    try:
+        name = event["event"]
+        username = event["context"]["externalUserId"]
+        accountId = event["content"]["account"]["id"]
+    except (KeyError, TypeError):
+        raise InvalidWebhookEvent(f"Malformed event {event}")
+
+    if name != TRANSACTIONS_MODIFIED:
+        logger.debug(f"Ignoring event {name}")
+        return {"scheduled": False}
+
+    try:
+        _get_user(username)
+    except UserNotFound:
+        # Answering differently would tell callers which usernames exist
+        logger.debug(f"Ignoring event for unknown user {username}")
+        return {"scheduled": False}
+    enqueue_sync(username, accountId=accountId, delay=SYNC_DEBOUNCE_SECONDS)
+    logger.debug(f"Scheduled sync of account {accountId} for {username}")
+    return {"scheduled": True}
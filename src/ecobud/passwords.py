@@ -0,0 +1,92 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+import bcrypt
+
+from ecobud.config import BCRYPT_ROUNDS, PASSWORD_QUEUE_SIZE, PASSWORD_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed: str) -> int:
+    """Work factor of a bcrypt hash, $2b$<rounds>$<salt and hash>"""
+    return int(hashed.split("$")[2])
+
+
+class PasswordHasher:
+    """bcrypt run in a pool of processes so that it does not hold up request threads
+
+    At most processes + queueSize calls are running or waiting at any time,
+    further ones fail right away with PasswordHasherBusy. The pool is started
+    on first use, with spawn as forking a threaded server is unsafe, and
+    replaced when one of its processes dies. Without processes, hashing runs
+    inline in the calling thread.
+    """
+
+    def __init__(self, processes: int, queueSize: int, rounds: int):
+        self.processes = processes
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max(1, processes) + queueSize)
+        self._executor: Optional[Executor] = None
+        self._executor_lock = threading.Lock()
+
+    def _run(self, function: Callable, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Too many password checks in progress")
+        try:
+            if not self.processes:
+                return function(*args)
+            executor = self.executor()
+            try:
+                return executor.submit(function, *args).result()
+            except BrokenProcessPool:
+                # A process of the pool died, hashing and checking are safe to run again
+                logger.warning("Password hasher pool broken, starting a new one")
+                self._discard(executor)
+                return self.executor().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def _discard(self, executor: Executor) -> None:
+        with self._executor_lock:
+            # Another caller may already have replaced it
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def executor(self) -> Executor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash, password.encode("utf-8"), self.rounds).decode("utf-8")
+
+    def check(self, password: str, hashed: str) -> bool:
+        return self._run(_check, password.encode("utf-8"), hashed.encode("utf-8"))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+
+hasher = PasswordHasher(processes=PASSWORD_WORKERS, queueSize=PASSWORD_QUEUE_SIZE, rounds=BCRYPT_ROUNDS)
@@ -0,0 +1,113 @@
+import functools
+import gzip
+import hashlib
+import logging
+from typing import Any, Callable
+
+from flask import Response, make_response, request, session
+from flask.json.provider import DefaultJSONProvider
+
+from ecobud.config import RESPONSE_COMPRESSION_LEVEL, RESPONSE_COMPRESSION_MIN_SIZE
+from ecobud.model.versions import get_data_version
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Encodes with orjson, producing the same JSON as the default provider
+
+    Values orjson cannot encode, and calls with json.dumps options such as
+    indent, go through the default provider.
+    """
+
+    OPTIONS = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_SERIALIZE_NUMPY
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_NON_STR_KEYS
+        if orjson
+        else 0
+    )
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self._encode(obj, **kwargs).decode("utf-8")
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
+
+    def _encode(self, obj: Any, **kwargs: Any) -> bytes:
+        if not kwargs:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self.OPTIONS)
+            except orjson.JSONEncodeError:
+                pass
+        return super().dumps(obj, **kwargs).encode("utf-8")
+
+
+JSONProvider = OrjsonProvider if orjson else DefaultJSONProvider
+
+
+def compress_response(response: Response) -> Response:
+    """gzip large bodies for clients accepting it, streamed ones are left as they are"""
+    response.vary.add("Accept-Encoding")
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or not 200 <= response.status_code < 300
+        or "Content-Encoding" in response.headers
+        or "gzip" not in request.accept_encodings
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < RESPONSE_COMPRESSION_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=RESPONSE_COMPRESSION_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def data_etag(username: str) -> str:
+    """Changes whenever any transaction of the user is written, for the requested representation"""
+    seed = f"{username}\n{get_data_version(username)}\n{request.full_path}\n{request.accept_mimetypes}"
+    return hashlib.blake2b(seed.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def conditional(view: Callable) -> Callable:
+    """Answer 304 without running the view when the client already has the current data of the user
+
+    The data version is read before the view runs, so data written meanwhile
+    changes the ETag of the next request.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        username = session.get("username")
+        if not username:
+            return view(*args, **kwargs)
+        etag = data_etag(username)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        # Compression keeps the body equivalent, so the tag is weak
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    return wrapper
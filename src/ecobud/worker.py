@@ -0,0 +1,106 @@
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Any, Dict, Iterator
+
+from pymongo.errors import PyMongoError
+
+from ecobud.config import SYNC_HEARTBEAT_SECONDS, SYNC_POLL_INTERVAL, SYNC_WORKER_CONCURRENCY
+from ecobud.model.sync_jobs import claim_sync_job, finish_sync_job, renew_sync_job
+from ecobud.model.transactions import sync_transactions
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def renew_lease(job: Dict[str, Any], stop: threading.Event) -> None:
+    while not stop.wait(SYNC_HEARTBEAT_SECONDS):
+        try:
+            if not renew_sync_job(job):
+                logger.warning(f"Lost the lease of the sync of {job['_id']}")
+                return
+        except Exception:
+            # The lease lasts longer than a heartbeat, the next one may succeed
+            logger.exception(f"Could not renew the lease of the sync of {job['_id']}")
+
+
+@contextmanager
+def leased(job: Dict[str, Any]) -> Iterator[None]:
+    """Keep renewing the lease of the job while the block runs"""
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=renew_lease, args=(job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def run_sync_job(job: Dict[str, Any]) -> None:
+    username = job["_id"]
+    accountIds = None if job["full"] or job["allAccounts"] else job["accountIds"]
+    logger.debug(f"Syncing transactions for {username}, full: {job['full']}, accounts: {accountIds}")
+    try:
+        with leased(job):
+            result = sync_transactions(username, full=job["full"], accountIds=accountIds)
+    except Exception as e:
+        logger.exception(f"Sync failed for {username}")
+        finish_sync_job(job, error=repr(e))
+    else:
+        logger.debug(f"Synced transactions for {username}: {result}")
+        finish_sync_job(job, result=asdict(result))
+
+
+def run_worker(concurrency: int, stop: threading.Event) -> None:
+    """Claim and run sync jobs, at most concurrency of them at a time, until stopped"""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def run(job):
+        try:
+            run_sync_job(job)
+        finally:
+            slots.release()
+
+    logger.info(f"Sync worker {worker} started with concurrency {concurrency}")
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while not stop.is_set():
+            slots.acquire()
+            # Stopped while every slot was busy
+            if stop.is_set():
+                slots.release()
+                break
+            try:
+                job = claim_sync_job(worker)
+            except PyMongoError as e:
+                logger.warning(f"Could not claim a sync job, retrying: {e!r}")
+                job = None
+            if job is None:
+                slots.release()
+                stop.wait(SYNC_POLL_INTERVAL)
+                continue
+            pool.submit(run, job)
+    logger.info(f"Sync worker {worker} stopped")
+
+
+def main() -> None:
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else SYNC_WORKER_CONCURRENCY
+    run_worker(concurrency, stop)
+
+
+if __name__ == "__main__":
+    main()
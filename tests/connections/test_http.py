@@ -0,0 +1,108 @@
+import email
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from requests.cookies import MockRequest, MockResponse
+
+from ecobud.connections.http import HttpClient, retry_after
+
+
+def response(status_code, headers=None):
+    response = MagicMock(spec=requests.Response)
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+def make_client(*outcomes, max_retries=3):
+    client = HttpClient(max_retries=max_retries, backoff_base=1, backoff_max=8)
+    client.session = MagicMock()
+    client.session.request.side_effect = outcomes
+    client.sleep = MagicMock()
+    return client
+
+
+def test_request_success():
+    client = make_client(response(200))
+    assert client.get("https://tink/x", "x").status_code == 200
+    assert client.session.request.call_args[1]["timeout"] == client.timeout
+    assert client.stats()["x"]["requests"] == 1
+    assert client.stats()["x"]["errors"] == 0
+
+
+def test_request_retries_server_errors():
+    client = make_client(response(502), requests.ConnectionError(), response(200))
+    assert client.get("https://tink/x", "x").status_code == 200
+    assert client.sleep.call_count == 2
+    assert client.stats()["x"] == {"requests": 3, "errors": 2, "retries": 2, "seconds": pytest.approx(0, abs=1)}
+
+
+def test_request_gives_up():
+    client = make_client(response(500), response(500), max_retries=1)
+    assert client.get("https://tink/x", "x").status_code == 500
+    assert client.session.request.call_count == 2
+
+
+def test_request_honours_retry_after():
+    client = make_client(response(429, {"Retry-After": "5"}), response(200))
+    client.post("https://tink/x", "x", idempotent=False)
+    assert client.sleep.call_args[0][0] >= 5
+
+
+def test_request_retry_after_beyond_backoff():
+    client = make_client(response(429, {"Retry-After": "60"}), response(200))
+    assert client.post("https://tink/x", "x", idempotent=False).status_code == 429
+    assert client.sleep.called == False
+    assert client.stats()["x"]["retries"] == 0
+
+
+def test_request_not_idempotent():
+    client = make_client(response(500))
+    assert client.post("https://tink/x", "x", idempotent=False).status_code == 500
+
+    client = make_client(requests.ReadTimeout())
+    with pytest.raises(requests.ReadTimeout):
+        client.post("https://tink/x", "x", idempotent=False)
+    assert client.sleep.called == False
+
+
+def test_backoff_bounds():
+    client = HttpClient(backoff_base=1, backoff_max=8)
+    for attempt in range(6):
+        assert 0 <= client.backoff(attempt) <= min(8, 2**attempt)
+    assert client.backoff(0, response(503, {"Retry-After": "8"})) == 8
+    assert client.backoff(0, response(503, {"Retry-After": "9"})) is None
+
+
+def test_retry_after():
+    assert retry_after(response(429, {"Retry-After": "3"})) == 3
+    assert retry_after(response(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert retry_after(response(429, {"Retry-After": "soon"})) is None
+    assert retry_after(response(429)) is None
+
+
+def test_request_observer():
+    client = make_client(response(503), response(200))
+    client.observer = MagicMock()
+    client.get("https://tink/x", "x")
+    assert [c[0][:2] for c in client.observer.call_args_list] == [("x", "503"), ("x", "200")]
+
+
+def test_session_refuses_cookies():
+    client = HttpClient()
+    headers = email.message_from_string("Set-Cookie: token=1\n\n", _class=http.client.HTTPMessage)
+    request = requests.Request("GET", "https://tink/x").prepare()
+    client.session.cookies.extract_cookies(MockResponse(headers), MockRequest(request))
+    assert len(client.session.cookies) == 0
+
+
+def test_stats_from_many_threads():
+    client = HttpClient()
+    client.session = MagicMock()
+    client.session.request.return_value = response(200)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda _: client.get("https://tink/x", "x"), range(1000)))
+    assert client.stats()["x"]["requests"] == 1000
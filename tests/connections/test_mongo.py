@@ -0,0 +1,30 @@
+from unittest.mock import patch
+
+from ecobud.connections import mongo
+
+
+@patch("ecobud.connections.mongo.MongoClient")
+def test_client_created_on_first_use(mock_client):
+    with patch.object(mongo, "_client", None):
+        transactions = mongo.collections["transactions"]
+        assert mock_client.called == False
+
+        transactions.find_one({"_id": "1"})
+        transactions.find_one({"_id": "2"})
+        assert mock_client.call_count == 1
+        assert mock_client.return_value.__getitem__.return_value.__getitem__.call_args[0] == ("transactions",)
+
+
+@patch("ecobud.connections.mongo.MongoClient")
+def test_forked_child_creates_its_client(mock_client):
+    with patch.object(mongo, "_client", None):
+        parent = mongo.get_client()
+        mongo._forget_client()
+        mock_client.return_value = object()
+        assert mongo.get_client() is not parent
+        assert mock_client.call_count == 2
+
+
+@patch("ecobud.connections.mongo.MONGO_COMPRESSORS", "zstd,snappy")
+def test_client_options():
+    assert mongo.client_options()["compressors"] == "zstd,snappy"
@@ -0,0 +1,77 @@
+import hashlib
+import hmac
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from ecobud.connections.tink import (
+    InvalidWebhookSignature,
+    get_user_transactions,
+    iter_user_transaction_pages,
+    verify_webhook_signature,
+)
+
+body = b'{"event": "account-transactions:modified"}'
+
+
+def sign(timestamp, body, secret="secret"):
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def test_verify_webhook_signature():
+    verify_webhook_signature(body, sign(1000, body), "secret", now=1010)
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        None,
+        "garbage",
+        sign(1000, body, secret="other"),
+        sign(1000, b"{}"),
+        sign(100, body),
+    ],
+)
+def test_verify_webhook_signature_invalid(header):
+    with pytest.raises(InvalidWebhookSignature):
+        verify_webhook_signature(body, header, "secret", now=1010)
+
+
+pages = {
+    None: {"transactions": [{"id": "1"}], "nextPageToken": "p2"},
+    "p2": {"transactions": [{"id": "2"}], "nextPageToken": "p3"},
+    "p3": {"transactions": [{"id": "3"}], "nextPageToken": ""},
+}
+
+
+@patch("ecobud.connections.tink.get_user_transactions_page")
+def test_iter_user_transaction_pages(mock_page):
+    mock_page.side_effect = lambda username, pageToken, accountIds: pages[pageToken]
+    assert list(iter_user_transaction_pages("test")) == list(pages.values())
+    assert [call[0][1] for call in mock_page.call_args_list] == [None, "p2", "p3"]
+
+
+@patch("ecobud.connections.tink.get_user_transactions_page")
+def test_iter_user_transaction_pages_prefetches(mock_page):
+    fetched = {token: threading.Event() for token in pages}
+
+    def page(username, pageToken, accountIds):
+        fetched[pageToken].set()
+        return pages[pageToken]
+
+    mock_page.side_effect = page
+    iterator = iter_user_transaction_pages("test", noPages=2)
+    assert next(iterator) == pages[None]
+    assert fetched["p2"].wait(timeout=5)
+    assert next(iterator) == pages["p2"]
+    assert list(iterator) == []
+    assert not fetched["p3"].is_set()
+
+
+@patch("ecobud.connections.tink.get_user_transactions_page")
+def test_get_user_transactions_stops_at_last_page(mock_page):
+    mock_page.side_effect = lambda username, pageToken, accountIds: pages[pageToken]
+    assert get_user_transactions("test", noPages=5) == [{"id": "1"}, {"id": "2"}, {"id": "3"}]
+    assert mock_page.call_count == 3
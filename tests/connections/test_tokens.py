@@ -0,0 +1,77 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from ecobud.connections.tokens import TokenStore
+
+
+def make_store(collection=None):
+    if collection is None:
+        collection = MagicMock()
+        collection.find_one.return_value = None
+    store = TokenStore(collection, refreshMargin=60, leaseSeconds=30, poll=0)
+    store.now = MagicMock(return_value=datetime(2023, 1, 1))
+    return store
+
+
+def test_token_store_refreshes_early():
+    store = make_store()
+    fetch = MagicMock(side_effect=[("first", 600), ("second", 600)])
+
+    assert store.get("key", fetch) == "first"
+    store.now.return_value += timedelta(seconds=500)
+    assert store.get("key", fetch) == "first"
+    assert fetch.call_count == 1
+
+    store.now.return_value += timedelta(seconds=50)
+    assert store.get("key", fetch) == "second"
+    key, entry = store.collection.replace_one.call_args[0]
+    assert key == {"_id": "key"}
+    assert entry["expiresAt"] == datetime(2023, 1, 1, 0, 19, 10)
+
+
+def test_token_store_single_flight():
+    store = make_store()
+    store.now = datetime.utcnow
+    calls = []
+
+    def fetch():
+        calls.append(threading.current_thread())
+        time.sleep(0.05)
+        return "token", 600
+
+    threads = [threading.Thread(target=store.get, args=("key", fetch)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+
+def test_token_store_uses_token_refreshed_elsewhere():
+    collection = MagicMock()
+    collection.find_one.return_value = {
+        "_id": "key",
+        "token": "current",
+        "refreshAt": datetime(2022, 12, 31),
+        "expiresAt": datetime(2023, 1, 1, 0, 1),
+    }
+    collection.update_one.side_effect = DuplicateKeyError("locked")
+    store = make_store(collection)
+    fetch = MagicMock()
+
+    assert store.get("key", fetch) == "current"
+    assert not fetch.called
+
+
+def test_token_store_releases_lease_on_failure():
+    store = make_store()
+    fetch = MagicMock(side_effect=ValueError)
+
+    with pytest.raises(ValueError):
+        store.get("key", fetch)
+    assert store.collection.update_one.call_args[0] == ({"_id": "key"}, {"$unset": {"refreshingUntil": ""}})
@@ -0,0 +1,197 @@
+from unittest.mock import patch
+
+import pytest
+
+from ecobud.cache import LocalCache, NoCache
+from ecobud.model.analytics import (
+    TransactionColumns,
+    UnknownAnalyticsBucket,
+    UnknownAnalyticsEngine,
+    get_analytics,
+    get_period_cost,
+    iter_analytics,
+    period_cost_pipeline,
+    period_query,
+)
+from ecobud.model.rollups import contribution, daily_costs, day_number
+from ecobud.model.transactions import schema_fields
+
+
+def make_document(_id, amount, date, ecoData):
+    return {
+        "username": "test",
+        "_id": _id,
+        "amount": amount,
+        "currency": "GBP",
+        "date": date,
+        "description": {"detailed": None, "display": "test", "original": "test", "user": "test"},
+        "ecoData": ecoData,
+        "tinkData": {"status": "BOOKED", "accountId": "123"},
+        "ignore": False,
+    }
+
+
+@pytest.fixture(autouse=True)
+def not_migrated():
+    with patch("ecobud.model.analytics.transactions_migrated", lambda: False):
+        yield
+
+
+def uncached(test):
+    test = patch("ecobud.model.analytics.analytics_cache", NoCache("test"))(test)
+    return patch("ecobud.model.analytics.get_data_version", lambda username: 0)(test)
+
+
+example_documents = [
+    make_document("1", -12.5, "2023-10-05", {"oneOff": True, "startDate": None, "endDate": None}),
+    make_document("2", -7.0, "2023-09-30", {"oneOff": True, "startDate": None, "endDate": None}),
+    make_document("3", -300.0, "2023-09-01", {"oneOff": False, "startDate": "2023-09-01", "endDate": "2023-11-29"}),
+    make_document("4", -31.0, "2023-10-20", {"oneOff": False, "startDate": "2023-10-20", "endDate": "2023-11-19"}),
+    make_document("5", -10.0, "2023-08-01", {"oneOff": False, "startDate": "2023-08-01", "endDate": "2023-08-10"}),
+]
+
+
+def test_transaction_columns_cost_in_period():
+    columns = TransactionColumns.from_documents(example_documents)
+    costs = columns.get_cost_in_period("2023-10-01", "2023-10-31")
+    assert costs.tolist() == pytest.approx([-12.5, 0.0, -300.0 * 31 / 90, -12.0, 0.0])
+
+
+def test_transaction_columns_from_day_ordinals():
+    migrated = [{**document, **schema_fields(document), "version": 1} for document in example_documents]
+    costs = TransactionColumns.from_documents(migrated).get_cost_in_period("2023-10-01", "2023-10-31")
+    expected = TransactionColumns.from_documents(example_documents).get_cost_in_period("2023-10-01", "2023-10-31")
+    assert costs.tolist() == expected.tolist()
+
+
+def test_period_query_numeric():
+    spread = period_query("test", "2023-10-01", "2023-10-31", numeric=True)["$and"][1]["$or"][1]
+    assert spread == {"ecoData.oneOff": False, "ecoData.startDay": {"$lte": 738824}, "ecoData.endDay": {"$gte": 738794}}
+
+
+@uncached
+@patch("ecobud.model.analytics.transactionsdb")
+def test_engines_agree(mock_transactionsdb):
+    migrated = [{**document, **schema_fields(document), "version": 1} for document in example_documents]
+    mock_transactionsdb.find.side_effect = lambda query: iter(migrated)
+
+    python = get_analytics("2023-10-01", "2023-10-31", "test", engine="python")
+    numpy = get_analytics("2023-10-01", "2023-10-31", "test", engine="numpy")
+
+    assert numpy["periodCost"] == pytest.approx(python["periodCost"])
+    assert python["periodCost"] == pytest.approx(-12.5 - 300.0 * 31 / 90 - 12.0)
+    assert numpy["transactions"] == [
+        {**transaction, "outputData": {"periodCost": pytest.approx(transaction["outputData"]["periodCost"])}}
+        for transaction in python["transactions"]
+    ]
+    assert mock_transactionsdb.find.call_args[0][0] == period_query("test", "2023-10-01", "2023-10-31")
+
+
+@uncached
+@patch("ecobud.model.rollups.rollupsdb")
+@patch("ecobud.model.analytics.transactionsdb")
+def test_engines_agree_on_ignored_transactions(mock_transactionsdb, mock_rollupsdb):
+    ignored = make_document("6", -99.0, "2023-10-10", {"oneOff": True, "startDate": None, "endDate": None})
+    documents = example_documents + [{**ignored, "ignore": True}]
+    startDay, endDay = day_number("2023-10-01"), day_number("2023-10-31")
+
+    def find(query, *args, **kwargs):
+        assert query["$and"][0]["ignore"] == {"$ne": True}
+        return iter(document for document in documents if not document["ignore"])
+
+    costs = daily_costs((contribution(document), 1) for document in documents if not document["ignore"])
+    mock_transactionsdb.find.side_effect = find
+    mock_rollupsdb.aggregate.return_value = iter(
+        [{"_id": None, "cost": sum(cost for day, cost in costs.items() if startDay <= day <= endDay)}]
+    )
+
+    python = get_analytics("2023-10-01", "2023-10-31", "test", engine="python")["periodCost"]
+    numpy = get_analytics("2023-10-01", "2023-10-31", "test", engine="numpy")["periodCost"]
+    rollup = get_period_cost("2023-10-01", "2023-10-31", "test", engine="rollup")["periodCost"]
+    assert python == pytest.approx(-12.5 - 300.0 * 31 / 90 - 12.0)
+    assert numpy == pytest.approx(python)
+    assert rollup == pytest.approx(python)
+    assert period_cost_pipeline("test", "2023-10-01", "2023-10-31")[0]["$match"]["$and"][0]["ignore"] == {"$ne": True}
+
+
+def test_unknown_engine():
+    with pytest.raises(UnknownAnalyticsEngine):
+        get_analytics("2023-10-01", "2023-10-31", "test", engine="nope")
+
+
+@uncached
+@patch("ecobud.model.analytics.transactionsdb")
+def test_get_period_cost(mock_transactionsdb):
+    mock_transactionsdb.aggregate.return_value = iter([{"_id": None, "periodCost": -127.83}])
+
+    assert get_period_cost("2023-10-01", "2023-10-31", "test") == {"periodCost": -127.83}
+    pipeline = mock_transactionsdb.aggregate.call_args[0][0]
+    assert pipeline[0] == {"$match": period_query("test", "2023-10-01", "2023-10-31")}
+    assert pipeline[1]["$project"]["bucket"] is None
+
+
+@uncached
+@patch("ecobud.model.analytics.transactionsdb")
+def test_get_period_cost_by_bucket(mock_transactionsdb):
+    mock_transactionsdb.aggregate.return_value = iter(
+        [{"_id": True, "periodCost": -12.5}, {"_id": False, "periodCost": -115.33}]
+    )
+
+    result = get_period_cost("2023-10-01", "2023-10-31", "test", groupBy="oneOff")
+
+    assert result == {"periodCost": pytest.approx(-127.83), "buckets": {"True": -12.5, "False": -115.33}}
+    assert mock_transactionsdb.aggregate.call_args[0][0][1]["$project"]["bucket"] == "$ecoData.oneOff"
+
+
+def test_get_period_cost_unknown_bucket():
+    with pytest.raises(UnknownAnalyticsBucket):
+        get_period_cost("2023-10-01", "2023-10-31", "test", groupBy="nope")
+
+
+@patch("ecobud.model.analytics.transactionsdb")
+def test_iter_analytics(mock_transactionsdb):
+    mock_transactionsdb.find.return_value = iter(example_documents)
+
+    rows = list(iter_analytics("2023-10-01", "2023-10-31", "test", batchSize=2))
+
+    assert [row["transaction"]["_id"] for row in rows[:-1]] == ["1", "2", "3", "4", "5"]
+    assert [row["outputData"]["periodCost"] for row in rows[:-1]] == pytest.approx(
+        [-12.5, 0.0, -300.0 * 31 / 90, -12.0, 0.0]
+    )
+    assert rows[-1] == {"periodCost": pytest.approx(-12.5 - 300.0 * 31 / 90 - 12.0)}
+    assert mock_transactionsdb.find.call_args[1] == {"batch_size": 2}
+
+
+@patch("ecobud.model.analytics.analytics_cache", LocalCache("test", maxsize=8, ttl=60))
+@patch("ecobud.model.analytics.get_data_version")
+@patch("ecobud.model.analytics.transactionsdb")
+def test_get_period_cost_cached(mock_transactionsdb, mock_get_data_version):
+    mock_get_data_version.return_value = 1
+    mock_transactionsdb.aggregate.side_effect = lambda pipeline: iter([{"_id": None, "periodCost": -10.0}])
+
+    assert get_period_cost("2023-10-01", "2023-10-31", "test") == {"periodCost": -10.0}
+    assert get_period_cost("2023-10-01", "2023-10-31", "test") == {"periodCost": -10.0}
+    assert mock_transactionsdb.aggregate.call_count == 1
+
+    mock_get_data_version.return_value = 2
+    get_period_cost("2023-10-01", "2023-10-31", "test")
+    assert mock_transactionsdb.aggregate.call_count == 2
+
+
+@patch("ecobud.model.analytics.get_rolled_up_period_cost")
+def test_get_period_cost_rollup(mock_get_rolled_up_period_cost):
+    mock_get_rolled_up_period_cost.return_value = -42.0
+    assert get_period_cost("2023-10-01", "2023-10-31", "test", engine="rollup") == {"periodCost": -42.0}
+    mock_get_rolled_up_period_cost.assert_called_once_with("2023-10-01", "2023-10-31", "test")
+    with pytest.raises(UnknownAnalyticsBucket):
+        get_period_cost("2023-10-01", "2023-10-31", "test", groupBy="currency", engine="rollup")
+    with pytest.raises(UnknownAnalyticsEngine):
+        get_period_cost("2023-10-01", "2023-10-31", "test", engine="nope")
+
+
+def test_period_cost_pipeline_numeric():
+    pipeline = period_cost_pipeline("test", "2023-10-01", "2023-10-31", numeric=True)
+    assert pipeline[0] == {"$match": period_query("test", "2023-10-01", "2023-10-31", numeric=True)}
+    oneOffCost = pipeline[1]["$project"]["periodCost"]["$cond"][1]
+    assert oneOffCost == {"$divide": [{"$toDecimal": "$amountMinor"}, {"$pow": [{"$toDecimal": 10}, "$amountScale"]}]}
+    assert pipeline[-1] == {"$set": {"periodCost": {"$toDouble": "$periodCost"}}}
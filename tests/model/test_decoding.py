@@ -0,0 +1,68 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+import pytest
+from dacite import from_dict
+
+from ecobud.model.decoding import DecodingError, compile_decoder
+from ecobud.model.transactions import Transaction
+
+example_transaction_dict = {
+    "username": "test",
+    "_id": "1",
+    "amount": 1.0,
+    "currency": "USD",
+    "date": "2020-12-15",
+    "description": {"detailed": "test", "display": "test", "original": "test", "user": "test"},
+    "ecoData": {"oneOff": True},
+    "tinkData": {"status": "BOOKED", "accountId": "123"},
+}
+
+
+@dataclass
+class Inner:
+    value: int
+
+
+@dataclass
+class Outer:
+    name: str
+    inner: Optional[Inner]
+    tags: list = field(default_factory=list)
+    note: Optional[str] = "none"
+
+
+def test_matches_dacite():
+    assert compile_decoder(Transaction)(example_transaction_dict) == from_dict(Transaction, example_transaction_dict)
+    assert Transaction.from_dict({**example_transaction_dict, "extra": 1}) == Transaction.from_dict(
+        example_transaction_dict
+    )
+
+
+def test_defaults_and_optionals():
+    assert compile_decoder(Outer)({"name": "a", "inner": None}) == Outer("a", None, [], "none")
+    decoded = compile_decoder(Outer, strict=True)({"name": "a", "inner": {"value": 1}, "note": None})
+    assert decoded == Outer("a", Inner(1), [], None)
+
+
+def test_decoders_are_compiled_once():
+    assert compile_decoder(Transaction) is compile_decoder(Transaction)
+    assert compile_decoder(Transaction) is not compile_decoder(Transaction, strict=True)
+
+
+def test_strict_accepts_int_as_float():
+    assert Transaction.from_dict({**example_transaction_dict, "amount": 1}, strict=True).amount == 1
+
+
+@pytest.mark.parametrize(
+    "document, message",
+    [
+        ({**example_transaction_dict, "amount": "1.0"}, "Transaction.amount should be float, got str"),
+        ({**example_transaction_dict, "ignore": 0}, "Transaction.ignore should be bool, got int"),
+        ({**example_transaction_dict, "tinkData": {"status": "BOOKED"}}, "Transaction.tinkData.accountId is missing"),
+        ({**example_transaction_dict, "ecoData": None}, "Transaction.ecoData should be a dict, got NoneType"),
+    ],
+)
+def test_strict_errors(document, message):
+    with pytest.raises(DecodingError, match=message):
+        Transaction.from_dict(document, strict=True)
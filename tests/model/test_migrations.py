@@ -0,0 +1,62 @@
+from unittest.mock import MagicMock, patch
+
+from ecobud.model.migrations import TRANSACTIONS_SCHEMA, migrate_transactions
+
+documents = [
+    {"_id": "1", "amount": -12.5, "date": "2023-10-05", "ecoData": {"oneOff": True}},
+    {
+        "_id": "2",
+        "amount": 3.0,
+        "date": "2023-10-06",
+        "version": 3,
+        "ecoData": {"oneOff": False, "startDate": "2023-10-01", "endDate": "2023-10-31"},
+    },
+]
+
+
+@patch("ecobud.model.migrations.migrationsdb")
+@patch("ecobud.model.migrations.transactionsdb")
+def test_migrate_transactions(mock_transactionsdb, mock_migrationsdb):
+    mock_transactionsdb.find.return_value = iter(documents)
+    mock_transactionsdb.find_one.return_value = None
+    mock_transactionsdb.bulk_write.return_value = MagicMock(modified_count=1)
+
+    assert migrate_transactions(batchSize=1, pause=0) == 2
+
+    assert mock_transactionsdb.find.call_args[0][0] == {"schemaVersion": {"$ne": 2}}
+    operations = [call[0][0][0] for call in mock_transactionsdb.bulk_write.call_args_list]
+    assert [operation._filter for operation in operations] == [
+        {"_id": "1", "schemaVersion": {"$ne": 2}, "version": {"$in": [0, None]}},
+        {"_id": "2", "schemaVersion": {"$ne": 2}, "version": 3},
+    ]
+    assert operations[1]._doc["$set"]["ecoData"]["endDay"] == 738824
+    assert operations[1]._doc["$set"]["amountMinor"] == 3
+    assert mock_migrationsdb.update_one.call_args[0][0] == {"_id": TRANSACTIONS_SCHEMA}
+
+
+@patch("ecobud.model.migrations.migrationsdb")
+@patch("ecobud.model.migrations.transactionsdb")
+def test_migrate_transactions_limited(mock_transactionsdb, mock_migrationsdb):
+    mock_transactionsdb.find.return_value.limit.return_value = iter(documents[:1])
+    mock_transactionsdb.bulk_write.return_value = MagicMock(modified_count=1)
+
+    assert migrate_transactions(pause=0, limit=1) == 1
+    assert mock_migrationsdb.update_one.called == False
+
+
+@patch("ecobud.model.migrations.migrationsdb")
+@patch("ecobud.model.migrations.transactionsdb")
+def test_migrate_transactions_edited_meanwhile(mock_transactionsdb, mock_migrationsdb):
+    edited = {
+        **documents[0],
+        "version": 1,
+        "ecoData": {"oneOff": False, "startDate": "2023-10-01", "endDate": "2023-10-02"},
+    }
+    mock_transactionsdb.find.side_effect = [iter(documents[:1]), iter([edited])]
+    mock_transactionsdb.find_one.side_effect = [{"_id": "1"}, None]
+    mock_transactionsdb.bulk_write.side_effect = [MagicMock(modified_count=0), MagicMock(modified_count=1)]
+
+    assert migrate_transactions(pause=0) == 1
+    retry = mock_transactionsdb.bulk_write.call_args[0][0][0]
+    assert retry._filter["version"] == 1
+    assert retry._doc["$set"]["ecoData"]["endDay"] == 738795
@@ -0,0 +1,79 @@
+from unittest.mock import patch
+
+import pytest
+
+from ecobud.model.rollups import (
+    apply_contributions,
+    contribution,
+    daily_costs,
+    day_number,
+    get_rolled_up_period_cost,
+    rebuild_rollups,
+)
+
+one_off = {"amount": -10.0, "date": "2023-10-05", "ecoData": {"oneOff": True}, "ignore": False}
+spread = {
+    "amount": -30.0,
+    "date": "2023-10-01",
+    "ecoData": {"oneOff": False, "startDate": "2023-10-01", "endDate": "2023-10-03"},
+    "ignore": False,
+}
+day = day_number("2023-10-01")
+
+
+def test_contribution():
+    assert contribution(one_off) == (day + 4, day + 4, -10.0)
+    assert contribution(spread) == (day, day + 2, -30.0)
+    assert contribution({**spread, "ignore": True}) is None
+    assert contribution(None) is None
+
+
+def test_daily_costs():
+    costs = daily_costs([(contribution(spread), 1), (contribution(one_off), 1), ((day, day, -4.0), -1)])
+    assert costs == {day: -6.0, day + 1: -10.0, day + 2: -10.0, day + 4: -10.0}
+
+
+@patch("ecobud.model.rollups.rollupsdb")
+def test_apply_contributions(mock_rollupsdb):
+    apply_contributions("test", [(contribution(spread), 1), (contribution(one_off), -1)])
+
+    operations = mock_rollupsdb.bulk_write.call_args[0][0]
+    assert [operation._filter for operation in operations] == [
+        {"username": "test", "day": day + offset} for offset in (0, 1, 2, 4)
+    ]
+    assert [operation._doc["$inc"]["cost"] for operation in operations] == [-10.0, -10.0, -10.0, 10.0]
+    assert operations[0]._doc["$setOnInsert"] == {"date": "2023-10-01"}
+    assert all(operation._upsert for operation in operations)
+
+
+@patch("ecobud.model.rollups.rollupsdb")
+def test_apply_contributions_nothing(mock_rollupsdb):
+    apply_contributions("test", [(None, 1), (contribution({**one_off, "ignore": True}), -1)])
+    assert mock_rollupsdb.bulk_write.called == False
+
+
+@patch("ecobud.model.rollups.rollupsdb")
+def test_get_rolled_up_period_cost(mock_rollupsdb):
+    mock_rollupsdb.aggregate.return_value = iter([{"_id": None, "cost": -30.0}])
+
+    assert get_rolled_up_period_cost("2023-10-01", "2023-10-31", "test") == pytest.approx(-30.0)
+    match = mock_rollupsdb.aggregate.call_args[0][0][0]["$match"]
+    assert match == {"username": "test", "day": {"$gte": day, "$lte": day_number("2023-10-31")}}
+
+    mock_rollupsdb.aggregate.return_value = iter([])
+    assert get_rolled_up_period_cost("2023-10-01", "2023-10-31", "test") == 0.0
+
+
+@patch("ecobud.model.rollups.rollupsdb")
+@patch("ecobud.model.rollups.transactionsdb")
+def test_rebuild_rollups(mock_transactionsdb, mock_rollupsdb):
+    mock_transactionsdb.find.return_value = [spread, one_off]
+
+    assert rebuild_rollups("test") == 4
+
+    # Documents without an ignore field count, as they do in contribution and period_query
+    assert mock_transactionsdb.find.call_args[0][0] == {"username": "test", "ignore": {"$ne": True}}
+
+    mock_rollupsdb.delete_many.assert_called_once_with({"username": "test"})
+    documents = mock_rollupsdb.insert_many.call_args[0][0]
+    assert [document["cost"] for document in documents] == [-10.0, -10.0, -10.0, -10.0]
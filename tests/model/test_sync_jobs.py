@@ -0,0 +1,82 @@
+from datetime import datetime
+from unittest.mock import patch
+
+from ecobud.model.sync_jobs import claim_sync_job, enqueue_sync, finish_sync_job, renew_sync_job
+
+
+@patch("ecobud.model.sync_jobs.syncjobsdb")
+def test_enqueue_sync(mock_syncjobsdb):
+    enqueue_sync("test")
+    enqueue_sync("test", full=True)
+    assert mock_syncjobsdb.update_one.call_args[0][1]["$max"] == {"full": True, "allAccounts": True}
+    assert mock_syncjobsdb.update_one.call_count == 2
+    for call in mock_syncjobsdb.update_one.call_args_list:
+        assert call[0][0] == {"_id": "test"}
+        assert call[0][1]["$set"]["pending"] == True
+        assert call[1]["upsert"] == True
+
+
+@patch("ecobud.model.sync_jobs.syncjobsdb")
+def test_claim_sync_job(mock_syncjobsdb):
+    mock_syncjobsdb.find_one_and_update.return_value = {
+        "_id": "test",
+        "worker": "w1",
+        "full": False,
+        "claimed": {"full": True, "allAccounts": False, "accountIds": ["123"]},
+    }
+    job = claim_sync_job("w1")
+    assert job["_id"] == "test"
+    assert job["worker"] == "w1"
+    assert job["full"] == True
+    assert job["accountIds"] == ["123"]
+    claim, reset, unset = mock_syncjobsdb.find_one_and_update.call_args[0][1]
+    # The flags of a lost run are claimed along with the requested ones
+    assert claim["$set"]["claimed"]["full"] == {"$or": ["$full", "$claimed.full"]}
+    assert reset["$set"]["pending"] == {"$literal": False}
+    assert reset["$set"]["full"] == {"$literal": False}
+    assert reset["$set"]["accountIds"] == {"$literal": []}
+    assert reset["$set"]["worker"] == {"$literal": "w1"}
+    assert reset["$set"]["runningUntil"]["$literal"] > reset["$set"]["startedAt"]["$literal"]
+    assert unset == {"$unset": ["notBefore"]}
+
+
+@patch("ecobud.model.sync_jobs.syncjobsdb")
+def test_finish_sync_job(mock_syncjobsdb):
+    job = {"_id": "test", "worker": "w1", "startedAt": datetime(2023, 1, 1)}
+    finish_sync_job(job, result={"inserted": 1})
+    assert mock_syncjobsdb.update_one.call_args[0][0] == job
+    update = mock_syncjobsdb.update_one.call_args[0][1]
+    assert update["$unset"] == {"claimed": ""}
+    update = update["$set"]
+    assert update["runningUntil"] is None
+    assert update["result"] == {"inserted": 1}
+    assert update["error"] is None
+
+
+@patch("ecobud.model.sync_jobs.syncjobsdb")
+def test_renew_sync_job(mock_syncjobsdb):
+    job = {"_id": "test", "worker": "w1", "startedAt": datetime(2023, 1, 1), "full": False}
+    mock_syncjobsdb.update_one.return_value.matched_count = 1
+    assert renew_sync_job(job) == True
+    query, update = mock_syncjobsdb.update_one.call_args[0]
+    assert query == {"_id": "test", "worker": "w1", "startedAt": datetime(2023, 1, 1)}
+    assert update["$set"]["runningUntil"] > datetime.utcnow()
+
+    # Reclaimed by another worker after the lease ran out
+    mock_syncjobsdb.update_one.return_value.matched_count = 0
+    assert renew_sync_job(job) == False
+
+
+@patch("ecobud.model.sync_jobs.syncjobsdb")
+def test_claim_sync_job_none(mock_syncjobsdb):
+    mock_syncjobsdb.find_one_and_update.return_value = None
+    assert claim_sync_job("w1") is None
+
+
+@patch("ecobud.model.sync_jobs.syncjobsdb")
+def test_enqueue_sync_account(mock_syncjobsdb):
+    enqueue_sync("test", accountId="123", delay=30)
+    update = mock_syncjobsdb.update_one.call_args[0][1]
+    assert update["$addToSet"] == {"accountIds": "123"}
+    assert update["$max"]["allAccounts"] == False
+    assert (update["$min"]["notBefore"] - update["$set"]["requestedAt"]).total_seconds() == 30
@@ -1,13 +1,32 @@
 import unittest
 from unittest.mock import MagicMock, patch
 
+import pytest
+import requests
+from pymongo.errors import BulkWriteError
+
 from ecobud.model.transactions import (
+    LIST_PROJECTION,
+    InvalidCursor,
+    InvalidTransactionChanges,
+    SyncResult,
+    SyncState,
     TinkTransactionData,
     Transaction,
     TransactionDescription,
     TransactionEcoData,
+    TransactionsNotFound,
+    change_fields,
+    decode_cursor,
+    edit_transactions,
+    encode_cursor,
     get_specific_transaction,
     get_transactions,
+    ingest_tink_transactions,
+    iter_transactions,
+    minor_units,
+    schema_fields,
+    sync_transactions,
     update_transaction,
 )
 
@@ -32,7 +51,7 @@ example_tink_payload = {
 
 example_transaction_dict = {
     "username": "test",
-    "id": "1",
+    "_id": "1",
     "amount": 1.0,
     "currency": "USD",
     "date": "2020-12-15",
@@ -44,11 +63,15 @@ example_transaction_dict = {
     },
     "ecoData": {"oneOff": True},
     "tinkData": {"status": "BOOKED", "accountId": "123"},
+    "amountMinor": 100,
+    "amountScale": 2,
+    "day": 737774,
+    "schemaVersion": 2,
 }
 
 example_transaction = Transaction(
     username="test",
-    id="1",
+    _id="1",
     amount=1.0,
     currency="USD",
     date="2020-12-15",
@@ -58,6 +81,10 @@ example_transaction = Transaction(
         status="BOOKED",
         accountId="123",
     ),
+    amountMinor=100,
+    amountScale=2,
+    day=737774,
+    schemaVersion=2,
 )
 
 
@@ -71,58 +98,421 @@ class TestTransaction(unittest.TestCase):
         assert transaction == example_transaction
 
 
-@patch("ecobud.model.transactions.Process")
-@patch("ecobud.model.transactions.sync_transactions")
 @patch("ecobud.model.transactions.transactionsdb")
-def test_get_transactions(mock_transactionsdb, mock_sync_transactions, mock_process):
+def test_get_transactions(mock_transactionsdb):
     mock_transactionsdb.find.return_value.sort.return_value.limit.return_value = [
-        {"username": "test", "id": "1"},
-        {"username": "test", "id": "2"},
+        {"username": "test", "_id": "1"},
+        {"username": "test", "_id": "2"},
     ]
-    transactions = get_transactions("test")
+    transactions, next_cursor = get_transactions("test")
     assert len(transactions) == 2
-    assert transactions[0]["id"] == "1"
-    assert transactions[1]["id"] == "2"
+    assert transactions[0]["_id"] == "1"
+    assert transactions[1]["_id"] == "2"
+    assert next_cursor is None
+    assert mock_transactionsdb.find.call_args[0] == ({"username": "test", "ignore": False}, LIST_PROJECTION)
+
+
+@patch("ecobud.model.transactions.transactionsdb")
+def test_get_transactions_pages(mock_transactionsdb):
+    mock_transactionsdb.find.return_value.sort.return_value.limit.return_value = [
+        {"username": "test", "_id": "3", "date": "2020-12-16"},
+        {"username": "test", "_id": "2", "date": "2020-12-15"},
+        {"username": "test", "_id": "1", "date": "2020-12-15"},
+    ]
+    transactions, next_cursor = get_transactions("test", pageSize=2, full=True)
+    assert [transaction["_id"] for transaction in transactions] == ["3", "2"]
+    assert decode_cursor(next_cursor) == ("2020-12-15", "2")
+    assert mock_transactionsdb.find.return_value.sort.return_value.limit.call_args[0] == (3,)
+
+    get_transactions("test", pageSize=2, cursor=next_cursor, full=True)
+    assert mock_transactionsdb.find.call_args[0] == (
+        {
+            "username": "test",
+            "ignore": False,
+            "$or": [{"date": {"$lt": "2020-12-15"}}, {"date": "2020-12-15", "_id": {"$lt": "2"}}],
+        },
+        None,
+    )
+
+
+@patch("ecobud.model.transactions.transactionsdb")
+def test_iter_transactions(mock_transactionsdb):
+    cursor = encode_cursor({"date": "2020-12-15", "_id": "2"})
+    iter_transactions("test", cursor=cursor, batchSize=50)
+    assert mock_transactionsdb.find.call_args[0][0]["$or"][1] == {"date": "2020-12-15", "_id": {"$lt": "2"}}
+    assert mock_transactionsdb.find.call_args[1] == {"batch_size": 50}
+    assert mock_transactionsdb.find.return_value.sort.call_args[0][0] == [("date", -1), ("_id", -1)]
+
+
+@pytest.mark.parametrize("cursor", ["garbage", encode_cursor({"date": "2020-12-15", "_id": "1"})[:-3], "é"])
+def test_decode_cursor_invalid(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
 
 
 @patch("ecobud.model.transactions.transactionsdb")
 def test_get_specific_transaction(mock_transactionsdb):
     mock_transactionsdb.find_one.return_value = {
         "username": "test",
-        "id": "1",
+        "_id": "1",
     }
     transaction = get_specific_transaction("test", "1")
-    assert transaction["id"] == "1"
+    assert transaction["_id"] == "1"
     assert transaction["username"] == "test"
 
 
+@patch("ecobud.model.transactions.apply_contributions")
+@patch("ecobud.model.transactions.bump_data_version")
 @patch("ecobud.model.transactions.transactionsdb")
-def test_update_transaction(mock_transactionsdb):
-    resp = update_transaction(
-        {
-            "username": "test",
-            "id": "1",
-            "amount": 1.0,
-            "currency": "USD",
-            "date": "2020-12-15",
-            "description": None,
-            "ecoData": None,
-            "tinkData": None,
-        }
+def test_update_transaction(mock_transactionsdb, mock_bump_data_version, mock_apply_contributions):
+    mock_transactionsdb.find.return_value = [{**example_transaction_dict, "version": 3}]
+    mock_transactionsdb.bulk_write.return_value.matched_count = 1
+    # As listed, without tinkData nor the detailed description
+    listed = {**example_transaction_dict, "description": {"display": "test", "user": "renamed"}, "ignore": False}
+    del listed["tinkData"]
+
+    assert update_transaction(listed) == True
+
+    mock_bump_data_version.assert_called_once_with("test")
+    assert mock_transactionsdb.find_one_and_replace.called == False
+    (operation,) = mock_transactionsdb.bulk_write.call_args[0][0]
+    assert operation._filter == {"_id": "1", "username": "test", "version": 3}
+    assert operation._doc["$set"] == {"ignore": False, "ecoData.oneOff": True, "description.user": "renamed"}
+
+
+@patch("ecobud.model.transactions.apply_contributions")
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.transactionsdb")
+def test_update_transaction_conflict(mock_transactionsdb, mock_bump_data_version, mock_apply_contributions):
+    mock_transactionsdb.find.side_effect = [[example_transaction_dict], []]
+    mock_transactionsdb.bulk_write.return_value.matched_count = 0
+
+    assert update_transaction({**example_transaction_dict, "version": 0}) == False
+    (operation,) = mock_transactionsdb.bulk_write.call_args[0][0]
+    assert operation._filter["version"] == {"$in": [0, None]}
+    assert mock_bump_data_version.called == False
+
+
+@patch("ecobud.model.transactions.transactionsdb")
+def test_update_transaction_not_found(mock_transactionsdb):
+    mock_transactionsdb.find.return_value = []
+    assert update_transaction(example_transaction_dict) == False
+    assert mock_transactionsdb.bulk_write.called == False
+
+
+@patch("ecobud.model.transactions.apply_contributions")
+@patch("ecobud.model.transactions.transactionsdb")
+def test_ingest_tink_transactions(mock_transactionsdb, mock_apply_contributions):
+    mock_transactionsdb.bulk_write.return_value.upserted_count = 1
+    mock_transactionsdb.bulk_write.return_value.upserted_ids = {4: "3"}
+    mock_transactionsdb.bulk_write.return_value.modified_count = 1
+    payloads = [example_tink_payload, {**example_tink_payload, "id": "2"}, {**example_tink_payload, "id": "3"}]
+
+    result = ingest_tink_transactions("test", payloads)
+
+    assert result == SyncResult(inserted=1, updated=1, unchanged=1)
+    operations = mock_transactionsdb.bulk_write.call_args[0][0]
+    assert len(operations) == 6
+    assert operations[0]._filter == {"_id": "1", "username": "test"}
+    assert operations[0]._doc["$setOnInsert"]["tinkData"] == {"status": "BOOKED", "accountId": "123"}
+    assert operations[0]._doc["$setOnInsert"]["version"] == 1
+    assert operations[0]._upsert == True
+    tinkData = {"status": "BOOKED", "accountId": "123"}
+    assert operations[1]._filter == {"_id": "1", "username": "test", "tinkData": {"$ne": tinkData}}
+    assert operations[1]._doc == {"$set": {"tinkData": tinkData}, "$inc": {"version": 1}}
+    assert not operations[1]._upsert
+    mock_apply_contributions.assert_called_once_with("test", [((737774, 737774, 1.0), 1)])
+
+
+@patch("ecobud.model.transactions.transactionsdb")
+def test_ingest_tink_transactions_empty(mock_transactionsdb):
+    assert ingest_tink_transactions("test", []) == SyncResult()
+    assert mock_transactionsdb.bulk_write.called == False
+
+
+def serve_pages(mock_pages, pages):
+    """Have the mocked page iterator walk the pages, up to noPages of them per call"""
+
+    def iterate(username, pageToken=None, accountIds=None, noPages=None):
+        for _ in range(noPages):
+            if not pages:
+                return
+            yield pages.pop(0)
+
+    mock_pages.side_effect = iterate
+
+
+def tink_page(ids, nextPageToken="", status="BOOKED"):
+    return {
+        "transactions": [{**example_tink_payload, "id": _id, "status": status} for _id in ids],
+        "nextPageToken": nextPageToken,
+    }
+
+
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.save_sync_state")
+@patch("ecobud.model.transactions.get_sync_state")
+@patch("ecobud.model.transactions.ingest_tink_transactions")
+@patch("ecobud.model.transactions.iter_user_transaction_pages")
+def test_sync_transactions_stops_at_known_page(
+    mock_page, mock_ingest, mock_get_state, mock_save_state, mock_bump_data_version
+):
+    mock_get_state.return_value = SyncState(lastSeen={"2": "BOOKED", "3": "BOOKED"})
+    serve_pages(mock_page, [tink_page(["1", "2"], "p2"), tink_page(["3"], "p3"), tink_page(["4"], "p4")])
+    mock_ingest.side_effect = lambda username, payloads: SyncResult(inserted=len(payloads))
+
+    result = sync_transactions("test", noPages=10)
+
+    assert result == SyncResult(inserted=1, unchanged=2)
+    assert mock_page.call_count == 1
+    assert [payload["id"] for payload in mock_ingest.call_args_list[0][0][1]] == ["1"]
+    assert mock_ingest.call_args_list[1][0][1] == []
+    state = mock_save_state.call_args[0][1]
+    assert list(state.lastSeen) == ["1", "2", "3"]
+    assert state.lastBookedDate == "2020-12-15"
+    assert state.backfillPageToken is None
+    mock_bump_data_version.assert_called_once_with("test")
+
+
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.save_sync_state")
+@patch("ecobud.model.transactions.get_sync_state")
+@patch("ecobud.model.transactions.ingest_tink_transactions")
+@patch("ecobud.model.transactions.iter_user_transaction_pages")
+def test_sync_transactions_failing_midway(
+    mock_page, mock_ingest, mock_get_state, mock_save_state, mock_bump_data_version
+):
+    def iterate(username, pageToken=None, accountIds=None, noPages=None):
+        yield tink_page(["1", "2"], "p2")
+        raise requests.ConnectionError("page 2 failed")
+
+    mock_get_state.return_value = SyncState()
+    mock_page.side_effect = iterate
+    mock_ingest.side_effect = lambda username, payloads: SyncResult(inserted=len(payloads))
+
+    with pytest.raises(requests.ConnectionError):
+        sync_transactions("test", noPages=10)
+
+    assert mock_save_state.called == False
+    # The first page was written, cached analytics and ETags must not outlive it
+    mock_bump_data_version.assert_called_once_with("test")
+
+
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.save_sync_state")
+@patch("ecobud.model.transactions.get_sync_state")
+@patch("ecobud.model.transactions.ingest_tink_transactions")
+@patch("ecobud.model.transactions.iter_user_transaction_pages")
+def test_sync_transactions_failing_write(
+    mock_page, mock_ingest, mock_get_state, mock_save_state, mock_bump_data_version
+):
+    mock_get_state.return_value = SyncState()
+    serve_pages(mock_page, [tink_page(["1"], "p2")])
+    mock_ingest.side_effect = BulkWriteError({"writeErrors": [], "nInserted": 0})
+
+    with pytest.raises(BulkWriteError):
+        sync_transactions("test", noPages=10)
+
+    mock_bump_data_version.assert_called_once_with("test")
+
+
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.save_sync_state")
+@patch("ecobud.model.transactions.get_sync_state")
+@patch("ecobud.model.transactions.ingest_tink_transactions")
+@patch("ecobud.model.transactions.iter_user_transaction_pages")
+def test_sync_transactions_resumes_backfill(
+    mock_page, mock_ingest, mock_get_state, mock_save_state, mock_bump_data_version
+):
+    mock_get_state.return_value = SyncState(lastSeen={"1": "BOOKED"}, backfillPageToken="p7")
+    serve_pages(mock_page, [tink_page(["1"], "p2"), tink_page(["70"], "p8"), tink_page(["80"], "")])
+    mock_ingest.side_effect = lambda username, payloads: SyncResult(unchanged=len(payloads))
+
+    sync_transactions("test", noPages=2)
+
+    assert [call[0][1] for call in mock_page.call_args_list] == [None, "p7"]
+    assert [call[1]["noPages"] for call in mock_page.call_args_list] == [2, 1]
+    assert mock_save_state.call_args[0][1].backfillPageToken == "p8"
+
+
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.save_sync_state")
+@patch("ecobud.model.transactions.get_sync_state")
+@patch("ecobud.model.transactions.ingest_tink_transactions")
+@patch("ecobud.model.transactions.iter_user_transaction_pages")
+def test_sync_transactions_full(mock_page, mock_ingest, mock_get_state, mock_save_state, mock_bump_data_version):
+    serve_pages(mock_page, [tink_page(["1"], "p2"), tink_page(["2"], "p3")])
+    mock_ingest.side_effect = lambda username, payloads: SyncResult(unchanged=len(payloads))
+
+    result = sync_transactions("test", noPages=2, full=True)
+
+    assert result == SyncResult(unchanged=2)
+    assert mock_bump_data_version.called == False
+    assert mock_get_state.called == False
+    assert mock_save_state.call_args[0][1].backfillPageToken == "p3"
+
+
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.save_sync_state")
+@patch("ecobud.model.transactions.get_sync_state")
+@patch("ecobud.model.transactions.ingest_tink_transactions")
+@patch("ecobud.model.transactions.iter_user_transaction_pages")
+def test_sync_transactions_accounts(mock_page, mock_ingest, mock_get_state, mock_save_state, mock_bump_data_version):
+    mock_get_state.return_value = SyncState(backfillPageToken="p7")
+    serve_pages(mock_page, [tink_page(["1"], "p2")])
+    mock_ingest.side_effect = lambda username, payloads: SyncResult(inserted=len(payloads))
+
+    sync_transactions("test", noPages=1, accountIds=["123"])
+
+    assert mock_page.call_args[1]["accountIds"] == ["123"]
+    assert mock_save_state.call_args[0][1].backfillPageToken == "p7"
+
+
+@patch("ecobud.model.transactions.apply_contributions")
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.transactionsdb")
+def test_update_transaction_rollups(mock_transactionsdb, mock_bump_data_version, mock_apply_contributions):
+    previous = {**example_transaction_dict, "ecoData": {"oneOff": True, "startDate": None, "endDate": None}}
+    spread = {**previous, "ecoData": {"oneOff": False, "startDate": "2020-12-01", "endDate": "2020-12-31"}}
+    mock_transactionsdb.find.return_value = [previous]
+    mock_transactionsdb.bulk_write.return_value.matched_count = 1
+
+    update_transaction({**previous, "description": None})
+    assert mock_apply_contributions.call_args[0][1] == []
+
+    update_transaction(spread)
+    assert mock_apply_contributions.call_args[0] == ("test", [((737774, 737774, 1.0), -1), ((737760, 737790, 1.0), 1)])
+
+
+def test_change_fields():
+    assert change_fields({"ignore": True, "ecoData": {"oneOff": False, "startDate": "2020-12-01"}}) == {
+        "ignore": True,
+        "ecoData.oneOff": False,
+        "ecoData.startDate": "2020-12-01",
+        "ecoData.startDay": 737760,
+    }
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [{}, {"amount": 2.0}, {"ignore": "yes"}, {"ecoData": {"startDay": 1}}, {"ecoData": {"endDate": "never"}}],
+)
+def test_change_fields_invalid(changes):
+    with pytest.raises(InvalidTransactionChanges):
+        change_fields(changes)
+
+
+@patch("ecobud.model.transactions.apply_contributions")
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.transactionsdb")
+def test_edit_transactions(mock_transactionsdb, mock_bump_data_version, mock_apply_contributions):
+    mock_transactionsdb.find.return_value = [
+        {**example_transaction_dict, "version": 2},
+        {**example_transaction_dict, "_id": "2"},
+    ]
+    mock_transactionsdb.bulk_write.return_value.matched_count = 2
+    spread = {"oneOff": False, "startDate": "2020-12-01", "endDate": "2020-12-31"}
+
+    result = edit_transactions(
+        "test", [{"_id": "1", "changes": {"ecoData": spread}}, {"_id": "2", "changes": {"ignore": True}, "version": 0}]
     )
-    assert resp == True
-    assert mock_transactionsdb.find_one_and_replace.called == True
-    assert mock_transactionsdb.find_one_and_replace.call_args[0][0] == {
-        "id": "1",
+
+    assert result == {"updated": ["1", "2"], "conflicts": []}
+    operations = mock_transactionsdb.bulk_write.call_args[0][0]
+    assert operations[0]._filter == {"_id": "1", "username": "test", "version": 2}
+    assert operations[0]._doc["$set"]["ecoData.endDay"] == 737790
+    assert operations[0]._doc["$inc"] == {"version": 1}
+    assert operations[1]._filter == {"_id": "2", "username": "test", "version": {"$in": [0, None]}}
+    assert operations[1]._doc["$set"] == {"ignore": True}
+    mock_apply_contributions.assert_called_once_with(
+        "test",
+        [
+            ((737774, 737774, 1.0), -1),
+            ((737760, 737790, 1.0), 1),
+            ((737774, 737774, 1.0), -1),
+            (None, 1),
+        ],
+    )
+    mock_bump_data_version.assert_called_once_with("test")
+
+
+@patch("ecobud.model.transactions.apply_contributions")
+@patch("ecobud.model.transactions.bump_data_version")
+@patch("ecobud.model.transactions.transactionsdb")
+def test_edit_transactions_conflict(mock_transactionsdb, mock_bump_data_version, mock_apply_contributions):
+    # Transaction 2 got the same change from a concurrent request, which won its version
+    mock_transactionsdb.find.side_effect = [
+        [example_transaction_dict, {**example_transaction_dict, "_id": "2"}],
+        [{"_id": "1"}],
+    ]
+    mock_transactionsdb.bulk_write.return_value.matched_count = 1
+    edits = [{"_id": "1", "changes": {"ignore": True}}, {"_id": "2", "changes": {"ignore": True}}]
+
+    assert edit_transactions("test", edits) == {"updated": ["1"], "conflicts": ["2"]}
+    assert mock_apply_contributions.call_args[0][1] == [((737774, 737774, 1.0), -1), (None, 1)]
+    token = mock_transactionsdb.bulk_write.call_args[0][0][0]._doc["$push"]["editTokens"]["$each"][0]
+    assert mock_transactionsdb.find.call_args[0][0] == {
         "username": "test",
+        "_id": {"$in": ["1", "2"]},
+        "editTokens": token,
     }
-    assert mock_transactionsdb.find_one_and_replace.call_args[0][1] == {
-        "username": "test",
-        "id": "1",
-        "amount": 1.0,
-        "currency": "USD",
+
+
+@pytest.mark.parametrize(
+    "ecoData",
+    [
+        {"oneOff": False, "startDate": "2020-12-02", "endDate": "2020-12-01"},
+        {"oneOff": False, "startDate": "0001-01-01", "endDate": "9999-12-31"},
+        {"oneOff": False, "startDate": None},
+    ],
+)
+@patch("ecobud.model.transactions.apply_contributions")
+@patch("ecobud.model.transactions.transactionsdb")
+def test_edit_transactions_invalid_spread(mock_transactionsdb, mock_apply_contributions, ecoData):
+    mock_transactionsdb.find.return_value = [example_transaction_dict]
+    with pytest.raises(InvalidTransactionChanges):
+        edit_transactions("test", [{"_id": "1", "changes": {"ecoData": ecoData}}])
+    assert mock_transactionsdb.bulk_write.called == False
+    assert mock_apply_contributions.called == False
+
+
+@patch("ecobud.model.transactions.transactionsdb")
+def test_edit_transactions_not_found(mock_transactionsdb):
+    mock_transactionsdb.find.return_value = [example_transaction_dict]
+    with pytest.raises(TransactionsNotFound):
+        edit_transactions(
+            "test", [{"_id": "1", "changes": {"ignore": True}}, {"_id": "2", "changes": {"ignore": True}}]
+        )
+    assert mock_transactionsdb.bulk_write.called == False
+
+
+@pytest.mark.parametrize(
+    "amount, expected",
+    [(1.0, (1, 0)), (-12.34, (-1234, 2)), (0.1, (1, 1)), (100.0, (100, 0)), (0.0, (0, 0)), (-0.005, (-5, 3))],
+)
+def test_minor_units(amount, expected):
+    assert minor_units(amount) == expected
+
+
+def test_schema_fields():
+    document = {
+        "amount": -7.5,
         "date": "2020-12-15",
-        "description": None,
-        "ecoData": None,
-        "tinkData": None,
+        "ecoData": {"oneOff": False, "startDate": "2020-12-01", "endDate": "2020-12-31"},
+    }
+    assert schema_fields(document) == {
+        "amountMinor": -75,
+        "amountScale": 1,
+        "day": 737774,
+        "ecoData": {
+            "oneOff": False,
+            "startDate": "2020-12-01",
+            "endDate": "2020-12-31",
+            "startDay": 737760,
+            "endDay": 737790,
+        },
+        "schemaVersion": 2,
     }
+    # The scale reported by Tink is kept while it matches the amount, an edited amount is recomputed
+    assert schema_fields({**document, "amountMinor": -750, "amountScale": 2})["amountMinor"] == -750
+    assert schema_fields({**document, "amountMinor": -800, "amountScale": 2})["amountMinor"] == -75
@@ -0,0 +1,130 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ecobud.model.user import UserDirectory, UserNotFound, WrongPassword, _get_user, create_user, login_user
+from ecobud.passwords import PasswordHasher, PasswordHasherBusy
+
+old_hash = PasswordHasher(processes=0, queueSize=0, rounds=4).hash("secret")
+
+
+def make_directory(collection):
+    return UserDirectory(collection, maxsize=10, ttl=60, negativeTtl=60, watch=False)
+
+
+def test_directory_caches_users():
+    collection = MagicMock()
+    collection.find_one.return_value = {"_id": 1, "username": "test", "tink_user_id": "t"}
+    directory = make_directory(collection)
+
+    assert directory.get("test")["tink_user_id"] == "t"
+    directory.get("test")["tink_user_id"] = "changed by a caller"
+    assert directory.get("test")["tink_user_id"] == "t"
+    assert collection.find_one.call_count == 1
+
+    directory.invalidate("test")
+    directory.get("test")
+    assert collection.find_one.call_count == 2
+
+
+def test_directory_caches_unknown_users():
+    collection = MagicMock()
+    collection.find_one.return_value = None
+    directory = make_directory(collection)
+
+    assert directory.get("nobody") is None
+    assert directory.get("nobody") is None
+    assert collection.find_one.call_count == 1
+
+    directory.apply_change({"operationType": "insert", "fullDocument": {"_id": 2, "username": "nobody"}})
+    directory.get("nobody")
+    assert collection.find_one.call_count == 2
+
+
+def test_directory_applies_deletions():
+    collection = MagicMock()
+    collection.find_one.return_value = {"_id": 1, "username": "test"}
+    directory = make_directory(collection)
+    directory.get("test")
+
+    directory.apply_change({"operationType": "delete", "documentKey": {"_id": 1}})
+    collection.find_one.return_value = None
+    assert directory.get("test") is None
+
+
+def test_directory_skips_users_invalidated_while_read():
+    collection = MagicMock()
+    directory = make_directory(collection)
+
+    def find_one(query):
+        # The user is written, and its change applied, before the read returns
+        directory.apply_change({"operationType": "update", "fullDocument": {"_id": 1, "username": "test"}})
+        return {"_id": 1, "username": "test", "tink_user_id": "stale"}
+
+    collection.find_one.side_effect = find_one
+    assert directory.get("test")["tink_user_id"] == "stale"
+
+    collection.find_one.side_effect = None
+    collection.find_one.return_value = {"_id": 1, "username": "test", "tink_user_id": "current"}
+    assert directory.get("test")["tink_user_id"] == "current"
+    assert directory.get("test")["tink_user_id"] == "current"
+    assert collection.find_one.call_count == 2
+    assert directory._reading == {} and directory._generations == {}
+
+
+def test_directory_skips_users_read_across_clear():
+    collection = MagicMock()
+    directory = make_directory(collection)
+    collection.find_one.side_effect = lambda query: directory.clear()
+
+    assert directory.get("test") is None
+    assert directory.get("test") is None
+    assert collection.find_one.call_count == 2
+
+
+def test_get_user_not_found():
+    collection = MagicMock()
+    collection.find_one.return_value = None
+    with patch("ecobud.model.user.directory", make_directory(collection)):
+        with pytest.raises(UserNotFound):
+            _get_user("nobody")
+
+
+@patch("ecobud.model.user.hasher", PasswordHasher(processes=0, queueSize=0, rounds=5))
+@patch("ecobud.model.user.usersdb")
+def test_login_rehashes(mock_usersdb):
+    mock_usersdb.find_one.return_value = {"_id": 1, "username": "test", "password": old_hash}
+
+    with patch("ecobud.model.user.directory", make_directory(mock_usersdb)):
+        login_user("test", "secret")
+
+    query, update = mock_usersdb.update_one.call_args[0]
+    assert query == {"username": "test", "password": old_hash}
+    assert update["$set"]["password"].startswith("$2b$05$")
+
+
+@patch("ecobud.model.user.hasher", PasswordHasher(processes=0, queueSize=0, rounds=4))
+@patch("ecobud.model.user.usersdb")
+def test_login(mock_usersdb):
+    mock_usersdb.find_one.return_value = {"_id": 1, "username": "test", "password": old_hash}
+
+    with patch("ecobud.model.user.directory", make_directory(mock_usersdb)):
+        login_user("test", "secret")
+        assert mock_usersdb.update_one.called == False
+
+        with pytest.raises(WrongPassword):
+            login_user("test", "wrong")
+
+
+@patch("ecobud.model.user.hasher")
+@patch("ecobud.model.user.tink")
+@patch("ecobud.model.user.usersdb")
+def test_create_user_busy_hasher(mock_usersdb, mock_tink, mock_hasher):
+    mock_usersdb.find_one.return_value = None
+    mock_hasher.hash.side_effect = PasswordHasherBusy()
+
+    with patch("ecobud.model.user.directory", make_directory(mock_usersdb)):
+        with pytest.raises(PasswordHasherBusy):
+            create_user("new", "new@example.com", "secret")
+    assert mock_tink.create_user.called == False
+    assert mock_usersdb.insert_one.called == False
@@ -0,0 +1,17 @@
+from unittest.mock import patch
+
+from ecobud.model.versions import bump_data_version, get_data_version
+
+
+@patch("ecobud.model.versions.versionsdb")
+def test_get_data_version(mock_versionsdb):
+    mock_versionsdb.find_one.return_value = None
+    assert get_data_version("test") == 0
+    mock_versionsdb.find_one.return_value = {"_id": "test", "version": 3}
+    assert get_data_version("test") == 3
+
+
+@patch("ecobud.model.versions.versionsdb")
+def test_bump_data_version(mock_versionsdb):
+    bump_data_version("test")
+    mock_versionsdb.update_one.assert_called_once_with({"_id": "test"}, {"$inc": {"version": 1}}, upsert=True)
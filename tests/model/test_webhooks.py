@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+import pytest
+
+from ecobud.model.user import UserNotFound
+from ecobud.model.webhooks import InvalidWebhookEvent, handle_tink_event
+
+example_event = {
+    "context": {"userId": "tink-1", "externalUserId": "test"},
+    "content": {
+        "account": {"id": "123"},
+        "transactions": {"inserted": 2, "updated": 0, "deleted": 0},
+    },
+    "event": "account-transactions:modified",
+}
+
+
+@patch("ecobud.model.webhooks._get_user")
+@patch("ecobud.model.webhooks.enqueue_sync")
+def test_handle_tink_event(mock_enqueue_sync, mock_get_user):
+    assert handle_tink_event(example_event) == {"scheduled": True}
+    mock_get_user.assert_called_once_with("test")
+    assert mock_enqueue_sync.call_args[0] == ("test",)
+    assert mock_enqueue_sync.call_args[1]["accountId"] == "123"
+    assert mock_enqueue_sync.call_args[1]["delay"] > 0
+
+
+@patch("ecobud.model.webhooks._get_user")
+@patch("ecobud.model.webhooks.enqueue_sync")
+def test_handle_tink_event_other_event(mock_enqueue_sync, mock_get_user):
+    assert handle_tink_event({**example_event, "event": "refresh:finished"}) == {"scheduled": False}
+    assert mock_enqueue_sync.called == False
+
+
+@patch("ecobud.model.webhooks._get_user")
+@patch("ecobud.model.webhooks.enqueue_sync")
+def test_handle_tink_event_unknown_user(mock_enqueue_sync, mock_get_user):
+    mock_get_user.side_effect = UserNotFound("nope")
+    assert handle_tink_event(example_event) == {"scheduled": False}
+    assert mock_enqueue_sync.called == False
+
+
+@pytest.mark.parametrize("event", [None, {}, {**example_event, "content": {}}])
+def test_handle_tink_event_malformed(event):
+    with pytest.raises(InvalidWebhookEvent):
+        handle_tink_event(event)
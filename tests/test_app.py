@@ -0,0 +1,156 @@
+import gzip
+import hashlib
+import hmac
+import json
+import time
+from unittest.mock import patch
+
+import pytest
+
+from ecobud.app import app
+from ecobud.model.user import UserNotFound
+from ecobud.passwords import PasswordHasherBusy
+
+
+@pytest.fixture(autouse=True)
+def data_version():
+    with patch("ecobud.responses.get_data_version", return_value=1) as mock_get_data_version:
+        yield mock_get_data_version
+
+
+@pytest.fixture
+def client():
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["username"] = "test"
+    return client
+
+
+@patch("ecobud.app.iter_transactions")
+def test_transactions_stream(mock_iter_transactions, client):
+    mock_iter_transactions.return_value = iter([{"_id": "2"}, {"_id": "1"}])
+
+    response = client.get("/transactions?stream=1")
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in response.data.splitlines()] == [{"_id": "2"}, {"_id": "1"}]
+
+
+@patch("ecobud.app.iter_analytics")
+def test_analytics_stream(mock_iter_analytics, client):
+    mock_iter_analytics.return_value = iter(
+        [{"transaction": {"_id": "1"}, "outputData": {"periodCost": 1.0}}, {"periodCost": 1.0}]
+    )
+
+    response = client.get("/analytics/2023-10-01/2023-10-31", headers={"Accept": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.data.splitlines()][-1] == {"periodCost": 1.0}
+    mock_iter_analytics.assert_called_once_with("2023-10-01", "2023-10-31", "test")
+
+
+def test_transactions_not_logged_in():
+    assert app.test_client().get("/transactions?stream=1").status_code == 401
+
+
+def test_metrics(client):
+    client.get("/metrics")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert b'ecobud_request_duration_seconds_count{method="GET",route="/metrics",status="200"}' in response.data
+
+
+@patch("ecobud.app.login_user")
+def test_login_busy(mock_login_user, client):
+    mock_login_user.side_effect = PasswordHasherBusy()
+
+    response = client.post("/login", json={"username": "test", "password": "secret"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def signed(body, secret="secret"):
+    timestamp = str(int(time.time()))
+    signature = hmac.new(secret.encode("utf-8"), f"{timestamp}.".encode("utf-8") + body, hashlib.sha256).hexdigest()
+    return {"X-Tink-Signature": f"t={timestamp},v1={signature}", "Content-Type": "application/json"}
+
+
+@patch("ecobud.app.TINK_WEBHOOK_SECRET", None)
+@patch("ecobud.app.handle_tink_event")
+def test_webhook_without_secret(mock_handle_tink_event, client):
+    response = client.post("/tink/webhook", json={"event": "account-transactions:modified"})
+
+    assert response.status_code == 503
+    assert mock_handle_tink_event.called == False
+
+
+@patch("ecobud.app.TINK_WEBHOOK_SECRET", "secret")
+@patch("ecobud.model.webhooks.enqueue_sync")
+@patch("ecobud.model.webhooks._get_user")
+def test_webhook_unknown_user(mock_get_user, mock_enqueue_sync, client):
+    mock_get_user.side_effect = UserNotFound("nope")
+    body = json.dumps(
+        {
+            "event": "account-transactions:modified",
+            "context": {"externalUserId": "nope"},
+            "content": {"account": {"id": "1"}},
+        }
+    ).encode("utf-8")
+
+    response = client.post("/tink/webhook", data=body, headers=signed(body))
+    assert response.status_code == 202
+    assert response.get_json() == {"success": True, "scheduled": False}
+
+    response = client.post("/tink/webhook", data=body, headers=signed(body, "other"))
+    assert response.status_code == 401
+    assert mock_enqueue_sync.called == False
+
+
+@patch("ecobud.app.edit_transactions")
+def test_transactions_patch(mock_edit_transactions, client):
+    mock_edit_transactions.return_value = {"updated": ["1"], "conflicts": ["2"]}
+    edits = [{"_id": "1", "changes": {"ignore": True}}, {"_id": "2", "changes": {"ignore": True}, "version": 3}]
+
+    response = client.patch("/transactions", json={"transactions": edits})
+
+    assert response.status_code == 200
+    assert response.json == {"updated": ["1"], "conflicts": ["2"]}
+    mock_edit_transactions.assert_called_once_with("test", edits)
+    assert client.patch("/transactions", json={"transactions": {}}).status_code == 400
+
+
+@patch("ecobud.app.get_specific_transaction")
+def test_transaction_not_modified(mock_get_specific_transaction, client, data_version):
+    mock_get_specific_transaction.return_value = {"_id": "1"}
+
+    response = client.get("/transactions/1")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    response = client.get("/transactions/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert mock_get_specific_transaction.call_count == 1
+
+    data_version.return_value = 2
+    response = client.get("/transactions/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@patch("ecobud.app.get_transactions")
+def test_transactions_compressed(mock_get_transactions, client):
+    transactions = [{"_id": str(index), "amount": index / 10} for index in range(200)]
+    mock_get_transactions.return_value = (transactions, None)
+
+    response = client.get("/transactions", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.data)) == {"transactions": transactions, "next": None}
+
+    response = client.get("/transactions")
+    assert "Content-Encoding" not in response.headers
+    assert response.json == {"transactions": transactions, "next": None}
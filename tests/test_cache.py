@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+
+from ecobud.cache import LocalCache, MongoCache, ResultCache, cache_key
+
+
+def test_local_cache():
+    cache = LocalCache("test", maxsize=2, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", {"periodCost": 1.0})
+    cache.set("b", 2)
+    assert cache.get("a") == {"periodCost": 1.0}
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+
+def test_incomplete_backend():
+    class GetOnlyCache(ResultCache):
+        def _get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyCache("test")
+
+
+def test_cache_key():
+    assert cache_key("analytics", "test", 1) != cache_key("analytics", "test", 2)
+    assert cache_key("analytics", "a:b", "c") != cache_key("analytics", "a", "b:c")
+
+
+def test_mongo_cache_get():
+    collection = MagicMock()
+    cache = MongoCache("test", collection, maxsize=10, ttl=60)
+    collection.find_one_and_update.return_value = {"_id": "a", "value": 1}
+    assert cache.get("a") == 1
+    collection.find_one_and_update.return_value = None
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_mongo_cache_set_evicts():
+    collection = MagicMock()
+    cache = MongoCache("test", collection, maxsize=2, ttl=60)
+    collection.estimated_document_count.return_value = 3
+    collection.find.return_value.sort.return_value.limit.return_value = [{"_id": "old"}]
+
+    cache.set("a", 1)
+
+    assert collection.replace_one.call_args[0][0] == {"_id": "a"}
+    assert collection.find.return_value.sort.return_value.limit.call_args[0] == (1,)
+    collection.delete_many.assert_called_once_with({"_id": {"$in": ["old"]}})
+
+
+def test_local_cache_from_many_threads():
+    cache = LocalCache("test", maxsize=50, ttl=60)
+
+    def use(index):
+        cache.set(str(index % 100), index)
+        cache.get(str((index + 1) % 100))
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(use, range(5000)))
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 5000
+    assert len(cache._cache) <= 50
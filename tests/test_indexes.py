@@ -0,0 +1,56 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ecobud.indexes import INDEXES, CollectionScan, check_query_plans, ensure_indexes, main, plan_stages
+
+index_scan_plan = {
+    "stage": "LIMIT",
+    "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "username_ignore_date"}},
+}
+
+or_plan = {
+    "stage": "SUBPLAN",
+    "inputStage": {
+        "stage": "FETCH",
+        "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "IXSCAN"}]},
+    },
+}
+
+
+def test_plan_stages():
+    assert plan_stages(index_scan_plan) == {"LIMIT", "FETCH", "IXSCAN"}
+    assert plan_stages(or_plan) == {"SUBPLAN", "FETCH", "OR", "IXSCAN"}
+
+
+@patch("ecobud.indexes.collections")
+def test_ensure_indexes(mock_collections):
+    ensure_indexes()
+    assert mock_collections.__getitem__.return_value.create_indexes.call_count == len(INDEXES)
+
+
+def explaining(plan):
+    collection = MagicMock()
+    explanation = {"queryPlanner": {"winningPlan": plan}}
+    collection.find.return_value.explain.return_value = explanation
+    collection.find.return_value.sort.return_value.limit.return_value.explain.return_value = explanation
+    return collection
+
+
+@patch("ecobud.indexes.collections")
+def test_check_query_plans(mock_collections):
+    mock_collections.__getitem__.return_value = explaining(or_plan)
+    assert all("IXSCAN" in stages for stages in check_query_plans().values())
+
+
+@patch("ecobud.indexes.collections")
+def test_check_query_plans_collscan(mock_collections):
+    mock_collections.__getitem__.return_value = explaining({"stage": "COLLSCAN"})
+    with pytest.raises(CollectionScan):
+        check_query_plans()
+    assert main(["check"]) == 1
+
+
+def test_main_usage():
+    assert main([]) == 2
+    assert main(["drop"]) == 2
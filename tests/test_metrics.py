@@ -0,0 +1,33 @@
+from unittest.mock import MagicMock
+
+from prometheus_client import REGISTRY
+
+from ecobud.cache import LocalCache
+from ecobud.metrics import MongoCommandListener, observe_tink_call
+
+
+def sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_mongo_listener():
+    labels = {"command": "find", "outcome": "succeeded"}
+    before = sample("ecobud_mongo_command_duration_seconds_count", labels)
+    MongoCommandListener().succeeded(MagicMock(command_name="find", duration_micros=1500))
+    assert sample("ecobud_mongo_command_duration_seconds_count", labels) == before + 1
+
+
+def test_observe_tink_call():
+    labels = {"endpoint": "user", "status": "error"}
+    before = sample("ecobud_tink_request_duration_seconds_count", labels)
+    observe_tink_call("user", "error", 0.2)
+    assert sample("ecobud_tink_request_duration_seconds_count", labels) == before + 1
+
+
+def test_cache_requests():
+    cache = LocalCache("metrics_test", maxsize=1, ttl=60)
+    cache.get("a")
+    cache.set("a", 1)
+    cache.get("a")
+    assert sample("ecobud_cache_requests_total", {"cache": "metrics_test", "result": "miss"}) == 1
+    assert sample("ecobud_cache_requests_total", {"cache": "metrics_test", "result": "hit"}) == 1
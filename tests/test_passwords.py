@@ -0,0 +1,46 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from ecobud.passwords import PasswordHasher, PasswordHasherBusy, hash_rounds
+
+
+def test_hash_and_check_inline():
+    hasher = PasswordHasher(processes=0, queueSize=0, rounds=4)
+    hashed = hasher.hash("secret")
+    assert hash_rounds(hashed) == 4
+    assert hasher.check("secret", hashed)
+    assert not hasher.check("wrong", hashed)
+    assert not hasher.needs_rehash(hashed)
+    assert PasswordHasher(processes=0, queueSize=0, rounds=5).needs_rehash(hashed)
+
+
+def test_hash_in_process_pool():
+    hasher = PasswordHasher(processes=1, queueSize=0, rounds=4)
+    try:
+        assert hasher.check("secret", hasher.hash("secret"))
+    finally:
+        hasher.executor().shutdown()
+
+
+def test_pool_replaced_when_broken():
+    hasher = PasswordHasher(processes=1, queueSize=0, rounds=4)
+    broken = hasher.executor()
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+    try:
+        assert hasher.check("secret", hasher.hash("secret"))
+        assert hasher.executor() is not broken
+    finally:
+        hasher.executor().shutdown()
+
+
+def test_busy():
+    hasher = PasswordHasher(processes=0, queueSize=1, rounds=4)
+    hasher._slots.acquire()
+    hasher._slots.acquire()
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hash("secret")
+    hasher._slots.release()
+    assert hasher.hash("secret")
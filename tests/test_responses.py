@@ -0,0 +1,34 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from ecobud.responses import OrjsonProvider
+
+pytest.importorskip("orjson")
+
+
+@dataclass
+class Point:
+    x: int
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"b": [1, 2.5, None, True], "a": "é"},
+        {"date": datetime(2023, 10, 5, 12, 30)},
+        {"point": Point(1), "amount": Decimal("1.10")},
+        {"cost": np.float64(-12.5)},
+        {1: "key"},
+        {"big": 2**70},
+    ],
+)
+def test_orjson_provider_matches_default(value):
+    app = Flask(__name__)
+    assert json.loads(OrjsonProvider(app).dumps(value)) == json.loads(DefaultJSONProvider(app).dumps(value))
@@ -0,0 +1,96 @@
+import threading
+import time
+from unittest.mock import patch
+
+from pymongo.errors import AutoReconnect
+
+from ecobud.model.transactions import SyncResult
+from ecobud.worker import run_sync_job, run_worker
+
+
+@patch("ecobud.worker.finish_sync_job")
+@patch("ecobud.worker.sync_transactions")
+def test_run_sync_job(mock_sync_transactions, mock_finish_sync_job):
+    mock_sync_transactions.return_value = SyncResult(inserted=2)
+    job = {"_id": "test", "worker": "w1", "full": False, "allAccounts": False, "accountIds": ["123"]}
+    run_sync_job(job)
+    mock_sync_transactions.assert_called_once_with("test", full=False, accountIds=["123"])
+    mock_finish_sync_job.assert_called_once_with(job, result={"inserted": 2, "updated": 0, "unchanged": 0})
+
+
+@patch("ecobud.worker.finish_sync_job")
+@patch("ecobud.worker.sync_transactions")
+def test_run_sync_job_failure(mock_sync_transactions, mock_finish_sync_job):
+    mock_sync_transactions.side_effect = ValueError("boom")
+    job = {"_id": "test", "worker": "w1", "full": True, "allAccounts": False, "accountIds": ["123"]}
+    run_sync_job(job)
+    mock_sync_transactions.assert_called_once_with("test", full=True, accountIds=None)
+    mock_finish_sync_job.assert_called_once_with(job, error="ValueError('boom')")
+
+
+@patch("ecobud.worker.SYNC_HEARTBEAT_SECONDS", 0.01)
+@patch("ecobud.worker.renew_sync_job")
+@patch("ecobud.worker.finish_sync_job")
+@patch("ecobud.worker.sync_transactions")
+def test_run_sync_job_renews_lease(mock_sync_transactions, mock_finish_sync_job, mock_renew_sync_job):
+    mock_sync_transactions.side_effect = lambda *args, **kwargs: time.sleep(0.1) or SyncResult()
+    job = {"_id": "test", "worker": "w1", "full": True, "allAccounts": True, "accountIds": []}
+    run_sync_job(job)
+    assert mock_renew_sync_job.call_count > 1
+    renewed = mock_renew_sync_job.call_count
+    time.sleep(0.05)
+    # The heartbeat stops with the sync
+    assert mock_renew_sync_job.call_count == renewed
+    assert mock_finish_sync_job.called
+
+
+@patch("ecobud.worker.SYNC_POLL_INTERVAL", 0.01)
+@patch("ecobud.worker.run_sync_job")
+@patch("ecobud.worker.claim_sync_job")
+def test_run_worker(mock_claim_sync_job, mock_run_sync_job):
+    stop = threading.Event()
+    jobs = [{"_id": "a"}, {"_id": "b"}, None]
+
+    def claim(worker):
+        if not jobs:
+            stop.set()
+            return None
+        return jobs.pop(0)
+
+    mock_claim_sync_job.side_effect = claim
+    run_worker(2, stop)
+    assert sorted(call[0][0]["_id"] for call in mock_run_sync_job.call_args_list) == ["a", "b"]
+
+
+@patch("ecobud.worker.SYNC_POLL_INTERVAL", 0.01)
+@patch("ecobud.worker.run_sync_job")
+@patch("ecobud.worker.claim_sync_job")
+def test_run_worker_survives_claim_errors(mock_claim_sync_job, mock_run_sync_job):
+    stop = threading.Event()
+    outcomes = [AutoReconnect("primary stepped down"), {"_id": "a"}]
+
+    def claim(worker):
+        if not outcomes:
+            stop.set()
+            return None
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    mock_claim_sync_job.side_effect = claim
+    run_worker(1, stop)
+    assert [call[0][0]["_id"] for call in mock_run_sync_job.call_args_list] == ["a"]
+
+
+@patch("ecobud.worker.run_sync_job")
+@patch("ecobud.worker.claim_sync_job")
+def test_run_worker_stops_without_claiming(mock_claim_sync_job, mock_run_sync_job):
+    stop = threading.Event()
+    # Stop once the worker waits for the slot
+    mock_run_sync_job.side_effect = lambda job: time.sleep(0.05) or stop.set()
+    mock_claim_sync_job.return_value = {"_id": "a"}
+
+    run_worker(1, stop)
+    # Stopped while the only slot was busy: no job is claimed once it frees up
+    assert mock_claim_sync_job.call_count == 1